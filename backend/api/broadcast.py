@@ -0,0 +1,317 @@
+# backend/api/broadcast.py
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Iterable, Tuple
+
+import orjson
+import redis.asyncio as redis
+
+from backend.arbitrage_finder.deltas import OpportunityState, Payload
+from backend.arbitrage_finder.filters import OpportunityFilter, OpportunityIndex, payload_keys
+from backend.core.config import settings
+from backend.data_processor.processor import data_processor
+from backend.data_processor.store import InMemoryMarketDataStore
+from backend.monitoring import ws_clients, ws_client_queue_depth, ws_messages_dropped
+from backend.utils.logger import logger
+
+
+def _dumps(message: Any) -> str:
+    return orjson.dumps(message).decode()
+
+
+class ClientQueue:
+    """
+    Ограниченная очередь сообщений одного WebSocket клиента.
+    Сообщения канала - дельты, пропуск любой из них ломает состояние клиента, поэтому при переполнении
+    очередь очищается целиком, а следующим сообщением клиент получает текущий снимок канала:
+    медленный клиент пропускает промежуточные изменения, а рассылка остальным клиентам не ждет его.
+
+    Клиент с фильтром получает не общие дельты канала, а дельты собственного отфильтрованного набора
+    со своей нумерацией: сообщение канала только помечает очередь, а выборка по индексу хаба и сравнение
+    с отправленным набором выполняются при отправке, поэтому медленный клиент сразу получает последнее состояние.
+    """
+    __slots__ = ("channel", "_messages", "_max_size", "_ready", "_snapshot", "_select", "_resync", "_control",
+                 "filter", "_view", "dropped", "_dropped_metric", "_depth_metric")
+
+    def __init__(self, channel: str, max_size: int, snapshot: Callable[[], Optional[str]],
+                 select: Callable[[OpportunityFilter], Optional[Tuple[str, Dict[str, Payload]]]]):
+        self.channel = channel
+        self._messages: Deque[str] = deque()
+        self._max_size = max_size
+        self._ready = asyncio.Event()
+        self._snapshot = snapshot
+        self._select = select
+        self._resync = False
+        # Служебные сообщения клиенту (подтверждение подписки, ошибки) отправляются вне очереди
+        self._control: Deque[str] = deque()
+        self.filter: Optional[OpportunityFilter] = None
+        # Отправленный клиенту отфильтрованный набор; None - следующим сообщением будет снимок
+        self._view: Optional[OpportunityState] = None
+        self.dropped = 0
+        # Метрики с меткой канала получаем один раз, а не на каждое сообщение
+        self._dropped_metric = ws_messages_dropped.labels(channel=channel)
+        self._depth_metric = ws_client_queue_depth.labels(channel=channel)
+
+    def put(self, message: str):
+        if self.filter is None and not self._resync:
+            if len(self._messages) < self._max_size:
+                self._messages.append(message)
+                self._depth_metric.observe(len(self._messages))
+            else:
+                self.dropped += len(self._messages)
+                self._dropped_metric.inc(len(self._messages))
+                self.resync()
+                return
+        # Во время ожидания ресинхронизации сообщение не сохраняется: снимок уже будет его включать
+        self._ready.set()
+
+    def put_control(self, message: str):
+        self._control.append(message)
+        self._ready.set()
+
+    def resync(self):
+        """Следующим сообщением клиент получит текущий снимок канала вместо ожидающих дельт."""
+        self._messages.clear()
+        self._view = None
+        self._resync = True
+        self._ready.set()
+
+    def set_filter(self, opportunity_filter: Optional[OpportunityFilter]):
+        """Меняет фильтр подписки (None или пустой фильтр - весь канал); клиент получит подтверждение и новый снимок."""
+        self.filter = None if opportunity_filter is None or opportunity_filter.is_empty else opportunity_filter
+        self.put_control(_dumps({"type": "subscribed", "filter": (self.filter or OpportunityFilter())._asdict()}))
+        self.resync()
+
+    def _filtered_message(self) -> Optional[str]:
+        selected = self._select(self.filter)
+        if selected is None:
+            return None
+        epoch, opportunities = selected
+        view = self._view
+        if view is None or view.epoch != epoch:
+            view = self._view = OpportunityState(self.channel.split(":", 1)[1])
+            view.epoch, view.opportunities = epoch, opportunities
+            view.seq += 1
+            return _dumps(view.snapshot_message())
+        if opportunities == view.opportunities:
+            return None
+        previous, view.opportunities = view.opportunities, opportunities
+        view.seq += 1
+        return _dumps(view.delta_message(previous))
+
+    async def get(self) -> str:
+        while True:
+            if self._control:
+                return self._control.popleft()
+            if self.filter is not None:
+                self._resync = False
+                message = self._filtered_message()
+                if message is not None:
+                    return message
+            elif self._resync:
+                # Снимок уже включает все дельты, полученные до него
+                self._messages.clear()
+                snapshot = self._snapshot()
+                if snapshot is not None:
+                    self._resync = False
+                    return snapshot
+            elif self._messages:
+                return self._messages.popleft()
+            self._ready.clear()
+            await self._ready.wait()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+
+class BroadcastHub:
+    """
+    Один подписчик Redis pubsub на процесс API: каждое сообщение канала декодируется один раз
+    и раскладывается по очередям подключенных клиентов. Подписка запускается при первом клиенте
+    и закрывается после отключения последнего.
+    Хаб применяет дельты к собственной копии состояния каждого канала: новый клиент первым сообщением
+    получает текущий снимок, а при разрыве последовательности хаб перечитывает снимок из Redis.
+    С хранилищем рыночных данных в памяти (MARKET_DATA_STORE=memory) поиск публикует каналы в этом же
+    процессе: хаб получает сообщения от хранилища напрямую, без Redis.
+    """
+
+    def __init__(self, channels: Iterable[str], queue_size: int):
+        self._channels = tuple(channels)
+        self._queue_size = queue_size
+        self._clients: Dict[str, Set[ClientQueue]] = {channel: set() for channel in self._channels}
+        # Канал "arbitrage:<вид>" -> состояние потока этого вида
+        self._states: Dict[str, OpportunityState] = {
+            channel: OpportunityState(channel.split(":", 1)[1]) for channel in self._channels
+        }
+        # Сериализованный снимок канала для (эпоха, seq), общий для всех ресинхронизируемых клиентов
+        self._snapshots: Dict[str, Tuple[Tuple[Optional[str], int], str]] = {}
+        # Индекс состояния канала для фильтрованных подписок: ((эпоха, seq), индекс, возможности в порядке индекса)
+        self._indexes: Dict[str, Tuple[Tuple[Optional[str], int], OpportunityIndex, List[Payload]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Хранилище в памяти, от которого хаб получает сообщения каналов (вместо подписки Redis)
+        self._local_store: Optional[InMemoryMarketDataStore] = None
+
+    def _ensure_started(self):
+        store = data_processor.store
+        if isinstance(store, InMemoryMarketDataStore):
+            if self._local_store is not store:
+                self._start_local(store)
+            return
+        # Задача подписки привязана к event loop; в другом loop (например, в тестовом клиенте) запускается заново
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        self._task = loop.create_task(self._listen(), name="ws_broadcast_hub")
+
+    def subscribe(self, channel: str) -> ClientQueue:
+        self._ensure_started()
+        client = ClientQueue(channel, self._queue_size, lambda: self.snapshot(channel),
+                             lambda opportunity_filter: self.select(channel, opportunity_filter))
+        # Первым сообщением клиент получает текущий снимок
+        client.resync()
+        self._clients[channel].add(client)
+        ws_clients.labels(channel=channel).set(len(self._clients[channel]))
+        return client
+
+    def unsubscribe(self, client: ClientQueue):
+        """Удаляет клиента; после отключения последнего клиента подписка Redis закрывается."""
+        clients = self._clients[client.channel]
+        clients.discard(client)
+        ws_clients.labels(channel=client.channel).set(len(clients))
+        if not any(self._clients.values()):
+            self._stop_local()
+            if self._task is not None:
+                # Без ожидания: unsubscribe вызывается и из отменяемого обработчика WebSocket.
+                # Задача подписки сама закрывает соединение с Redis при завершении
+                self._task.cancel()
+                self._task = None
+
+    def client_count(self, channel: str) -> int:
+        return len(self._clients[channel])
+
+    def snapshot(self, channel: str) -> Optional[str]:
+        """Текущий снимок канала в JSON; None, пока состояние канала не синхронизировано."""
+        state = self._states[channel]
+        if not state.synced:
+            return None
+        version = (state.epoch, state.seq)
+        cached = self._snapshots.get(channel)
+        if cached is None or cached[0] != version:
+            cached = self._snapshots[channel] = (version, _dumps(state.snapshot_message()))
+        return cached[1]
+
+    def select(self, channel: str, opportunity_filter: OpportunityFilter) -> Optional[Tuple[str, Dict[str, Payload]]]:
+        """(эпоха, id -> payload) возможностей канала, подходящих под фильтр; None, пока состояние не синхронизировано."""
+        state = self._states[channel]
+        if not state.synced:
+            return None
+        version = (state.epoch, state.seq)
+        cached = self._indexes.get(channel)
+        if cached is None or cached[0] != version:
+            # Индекс строится один раз на версию состояния и разделяется всеми фильтрованными клиентами
+            payloads = list(state.opportunities.values())
+            cached = self._indexes[channel] = (
+                version, OpportunityIndex([payload_keys(state.kind, payload) for payload in payloads]), payloads)
+        _, index, payloads = cached
+        return state.epoch, {payloads[i]["id"]: payloads[i] for i in index.select(opportunity_filter)}
+
+    def broadcast(self, channel: str, message: str):
+        # Копия множества: клиенты могут отписываться во время рассылки
+        for client in tuple(self._clients.get(channel, ())):
+            client.put(message)
+
+    def handle_message(self, channel: str, data: str) -> bool:
+        """
+        Применяет сообщение канала к состоянию и рассылает его клиентам.
+        Возвращает False при разрыве последовательности: клиенты переводятся на ресинхронизацию,
+        состояние нужно восстановить из снимка.
+        """
+        state = self._states[channel]
+        message = orjson.loads(data)
+        # Периодический снимок для синхронизированных клиентов заменяется эквивалентной дельтой
+        previous = state.opportunities if (
+            state.synced and message["type"] == "snapshot" and message["epoch"] == state.epoch) else None
+        if state.apply(message):
+            if previous is not None:
+                data = _dumps(state.delta_message(previous))
+            self.broadcast(channel, data)
+            return True
+        if state.synced:
+            # Устаревшее сообщение (уже учтено в снимке)
+            return True
+        for client in tuple(self._clients[channel]):
+            client.resync()
+        return False
+
+    def _start_local(self, store: InMemoryMarketDataStore):
+        self._stop_local()
+        self._local_store = store
+        store.add_listener(self._handle_local_message)
+        for channel in self._channels:
+            self._states[channel].synced = False
+            self._load_local_snapshot(channel)
+        logger.info(f"Рассылка WebSocket получает каналы {', '.join(self._channels)} в процессе (MARKET_DATA_STORE=memory)")
+
+    def _stop_local(self):
+        store, self._local_store = self._local_store, None
+        if store is not None:
+            store.remove_listener(self._handle_local_message)
+
+    def _load_local_snapshot(self, channel: str):
+        data = self._local_store.channel_snapshot(channel)
+        if data is not None:
+            self.handle_message(channel, data.decode())
+
+    def _handle_local_message(self, channel: str, data: bytes):
+        if channel in self._states and not self.handle_message(channel, data.decode()):
+            logger.warning(f"Разрыв последовательности в канале {channel}, загрузка снимка.")
+            self._load_local_snapshot(channel)
+
+    async def _load_snapshot(self, redis_client: redis.Redis, channel: str):
+        data = await redis_client.get(f"{channel}:snapshot")
+        if data is not None:
+            self.handle_message(channel, data)
+
+    async def _listen(self):
+        redis_client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB,
+            decode_responses=True
+        )
+        pubsub = redis_client.pubsub()
+        try:
+            while True:
+                try:
+                    await pubsub.subscribe(*self._channels)
+                    logger.info(f"Рассылка WebSocket подписана на каналы: {', '.join(self._channels)}")
+                    # Снимки читаются после подписки: дельты, пришедшие за это время, ждут в буфере
+                    # подписки и либо применяются поверх снимка, либо отбрасываются как уже учтенные
+                    for channel in self._channels:
+                        self._states[channel].synced = False
+                        await self._load_snapshot(redis_client, channel)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message' and not self.handle_message(message['channel'], message['data']):
+                            logger.warning(f"Разрыв последовательности в канале {message['channel']}, загрузка снимка.")
+                            await self._load_snapshot(redis_client, message['channel'])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка подписки рассылки WebSocket: {e}. Повторная подписка через 1 секунду...")
+                    await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+            await redis_client.aclose()
+
+    async def stop(self):
+        self._stop_local()
+        task, self._task = self._task, None
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+broadcast_hub = BroadcastHub(
+    ("arbitrage:cex_cex", "arbitrage:cex_cex_cex"),
+    queue_size=settings.WS_CLIENT_QUEUE_SIZE
+)
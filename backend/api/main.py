@@ -10,6 +10,7 @@ from backend.data_processor.processor import data_processor # Импорт эк
 from backend.data_collector.collector import data_collector # Импорт экземпляра коллектора
 from backend.arbitrage_finder.finder import arbitrage_finder # Импорт экземпляра finder'а
 from backend.api.v1.endpoints import router as api_v1_router # Импорт роутов v1
+from backend.api.broadcast import broadcast_hub # Общая рассылка WebSocket
 
 
 logger.info(f"Запуск приложения: {settings.PROJECT_NAME} (v{settings.VERSION})")
@@ -39,12 +40,16 @@ async def startup_event():
     """Выполняется при запуске FastAPI приложения."""
     logger.info("Выполнение startup_event...")
     # Подключение к Redis
-    await data_processor.connect_redis()
+    await data_processor.connect()
+    if settings.COLLECTOR_MODE == "inprocess":
+        # Буферизованная запись рыночных данных в Redis
+        data_processor.start_writer()
 
-    # Запуск сбора данных с бирж (в фоне)
-    # start_collecting запускает asyncio задачи, которые работают параллельно
-    # Мы не await'им здесь, т.к. они должны работать в фоне
-    asyncio.create_task(data_collector.start_collecting()) # Запускаем как фоновую задачу
+        # Запуск сбора данных с бирж (в фоне)
+        # start_collecting запускает asyncio задачи, которые работают параллельно
+        # Мы не await'им здесь, т.к. они должны работать в фоне
+        asyncio.create_task(data_collector.start_collecting()) # Запускаем как фоновую задачу
+    # else: коллектор запущен отдельно (python -m backend.data_collector.supervisor)
 
 
     # Arbitrage finder также может работать в цикле, периодически проверяя Redis
@@ -56,12 +61,17 @@ async def shutdown_event():
     """Выполняется при остановке FastAPI приложения."""
     logger.info("Выполнение shutdown_event...")
     # Остановка задач сбора данных
-    await data_collector.stop_collecting()
+    if settings.COLLECTOR_MODE == "inprocess":
+        await data_collector.stop_collecting()
 
+    # Остановка общей подписки WebSocket рассылки
+    await broadcast_hub.stop()
 
+    # Сброс накопленных обновлений перед отключением
+    await data_processor.stop_writer()
 
     # Отключение от Redis
-    await data_processor.disconnect_redis()
+    await data_processor.disconnect()
     logger.info("Startup/shutdown события выполнены.")
 
 # --- Подключение API роутов ---
@@ -1,19 +1,34 @@
 # backend/api/v1/endpoints.py
-from typing import List, Tuple, Optional
-from fastapi import APIRouter, HTTPException, WebSocket
+from typing import Any, List, Dict, Tuple, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, WebSocket
 from pydantic import BaseModel, ConfigDict, field_serializer
 from decimal import Decimal
-import asyncio
-import redis.asyncio as redis
+from pathlib import Path
+import anyio
 import json
+import math
+import re
+import time
+import orjson
+import redis.asyncio as redis
 
 from backend.core.config import settings
-from backend.arbitrage_finder.finder import arbitrage_finder, OpportunityCexCex
+from backend.arbitrage_finder.finder import arbitrage_finder
+from backend.arbitrage_finder.filters import OpportunityFilter, OpportunityIndex, opportunity_keys
+from backend.data_collector.supervisor import read_collector_health
+from backend.data_processor.history import spread_history
+from backend.api.broadcast import ClientQueue, broadcast_hub
+from backend.monitoring import ws_connections, ws_messages_sent
 from backend.utils.logger import logger
 
 router = APIRouter()
 
+# Пара истории лучших цен: BASE/QUOTE из латинских букв и цифр (из нее строится путь к файлу серии)
+_HISTORY_PAIR_RE = re.compile(r"[A-Z0-9]+/[A-Z0-9]+")
+
+# Модели ответов описывают схему OpenAPI; тела ответов собираются из готового JSON возможностей
 class OpportunityCexCexResponse(BaseModel):
+    id: str
     pair: str
     buy_exchange: str
     sell_exchange: str
@@ -21,106 +36,217 @@ class OpportunityCexCexResponse(BaseModel):
     sell_price: Decimal
     profit_percent: Decimal
     volume_usd: Optional[Decimal] = None
+    max_size: Optional[Decimal] = None
+    net_profit_percent: Optional[Decimal] = None
 
-    @field_serializer('buy_price', 'sell_price', 'profit_percent', 'volume_usd', when_used='json')
+    @field_serializer('buy_price', 'sell_price', 'profit_percent', 'volume_usd', 'max_size', 'net_profit_percent', when_used='json')
     def serialize_decimal(self, value: Decimal) -> str:
         return str(value) if value is not None else None
 
     model_config = ConfigDict(from_attributes=False)
 
 class OpportunityCexCexCexResponse(BaseModel):
+    id: str
     cycle: List[Tuple[str, str, str]]
     profit_percent: Decimal
     volume_usd: Optional[Decimal] = None
+    net_profit_percent: Optional[Decimal] = None
 
-    @field_serializer('profit_percent', 'volume_usd', when_used='json')
+    @field_serializer('profit_percent', 'volume_usd', 'net_profit_percent', when_used='json')
     def serialize_decimal(self, value: Decimal) -> str:
         return str(value) if value is not None else None
 
     model_config = ConfigDict(from_attributes=False)
 
+def _json_array(opportunities: List[Any]) -> bytes:
+    """Тело ответа из JSON возможностей, закодированного один раз при публикации результата (без Pydantic)."""
+    return b"[" + b",".join(opp.to_json() for opp in opportunities) + b"]"
+
+# Сериализованное тело последнего результата по видам: (etag, JSON) - один раз на версию, а не на запрос
+_response_bodies: Dict[str, Tuple[str, bytes]] = {}
+# Индекс последнего результата по видам для фильтрованных запросов: (etag, индекс)
+_result_indexes: Dict[str, Tuple[str, OpportunityIndex]] = {}
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Слабое сравнение (RFC 9110): префикс W/ не учитывается
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+def _result_index(kind: str, result) -> OpportunityIndex:
+    cached = _result_indexes.get(kind)
+    if cached is None or cached[0] != result.etag:
+        cached = (result.etag, OpportunityIndex([opportunity_keys(kind, opp) for opp in result.opportunities]))
+        _result_indexes[kind] = cached
+    return cached[1]
+
+async def _result_response(request: Request, kind: str, fresh: bool, opportunity_filter: OpportunityFilter) -> Response:
+    result = await arbitrage_finder.get_result(kind, fresh=fresh)
+    headers = {
+        "ETag": result.etag,
+        "X-Result-Version": str(result.version),
+        "X-Result-Timestamp": f"{result.published_at:.3f}",
+        "Cache-Control": "no-cache",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), result.etag):
+        return Response(status_code=304, headers=headers)
+    if not opportunity_filter.is_empty:
+        # Фильтрованный ответ зависит только от версии результата и параметров запроса, поэтому ETag общий
+        selected = [result.opportunities[i] for i in _result_index(kind, result).select(opportunity_filter)]
+        logger.info(f"Ответ на /api/v1/arbitrage/{kind}: версия {result.version}, {len(selected)} из {len(result.opportunities)} возможностей по фильтру.")
+        return Response(content=_json_array(selected), media_type="application/json", headers=headers)
+    cached = _response_bodies.get(kind)
+    if cached is None or cached[0] != result.etag:
+        cached = (result.etag, _json_array(result.opportunities))
+        _response_bodies[kind] = cached
+    logger.info(f"Ответ на /api/v1/arbitrage/{kind}: версия {result.version}, {len(result.opportunities)} возможностей.")
+    return Response(content=cached[1], media_type="application/json", headers=headers)
+
+def _query_filter(
+        pair: Optional[str] = Query(None, description="Пара, например BTC/USDT (для циклов - любая нога)"),
+        exchange: Optional[str] = Query(None, description="Биржа покупки или продажи (для циклов - любая нога)"),
+        min_profit: Optional[float] = Query(None, description="Минимальная прибыль, %"),
+        min_volume: Optional[float] = Query(None, ge=0, description="Минимальный оборот, USD"),
+        top: Optional[int] = Query(None, ge=1, description="Не больше top самых прибыльных возможностей"),
+) -> OpportunityFilter:
+    return OpportunityFilter.create(pair=pair, exchange=exchange, min_profit=min_profit, min_volume=min_volume, top=top)
+
 @router.get("/arbitrage/cex_cex", response_model=List[OpportunityCexCexResponse], tags=["Arbitrage"])
-async def get_cex_cex_opportunities():
+async def get_cex_cex_opportunities(request: Request, fresh: bool = False,
+                                    opportunity_filter: OpportunityFilter = Depends(_query_filter)):
+    """
+    Последний результат фонового поиска (ETag, X-Result-Version, X-Result-Timestamp; поддерживается If-None-Match).
+    fresh=true - дождаться пересчета; одновременные запросы объединяются в один пересчет.
+    pair, exchange, min_profit, min_volume, top - фильтр по индексу последнего результата.
+    """
     logger.info("Получен запрос на /api/v1/arbitrage/cex_cex")
     try:
-        opportunities = await arbitrage_finder.find_cex_cex_opportunities()
-        response_opportunities = [
-            OpportunityCexCexResponse(
-                pair=opp.pair,
-                buy_exchange=opp.buy_exchange,
-                sell_exchange=opp.sell_exchange,
-                buy_price=opp.buy_price,
-                sell_price=opp.sell_price,
-                profit_percent=opp.profit_percent,
-                volume_usd=opp.volume_usd
-            ) for opp in opportunities
-        ]
-        logger.info(f"Ответ на /api/v1/arbitrage/cex_cex: {len(response_opportunities)} возможностей найдено.")
-        return response_opportunities
+        return await _result_response(request, "cex_cex", fresh, opportunity_filter)
     except Exception as e:
         logger.error(f"Ошибка при поиске CEX-CEX арбитража: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера при поиске арбитража")
 
 @router.get("/arbitrage/cex_cex_cex", response_model=List[OpportunityCexCexCexResponse], tags=["Arbitrage"])
-async def get_cex_cex_cex_opportunities():
+async def get_cex_cex_cex_opportunities(request: Request, fresh: bool = False,
+                                        opportunity_filter: OpportunityFilter = Depends(_query_filter)):
+    """Как /arbitrage/cex_cex, для циклов из трех и более сделок."""
     logger.info("Получен запрос на /api/v1/arbitrage/cex_cex_cex")
     try:
-        opportunities = await arbitrage_finder.find_cex_cex_cex_opportunities()
-        response_opportunities = [
-            OpportunityCexCexCexResponse(
-                cycle=opp.cycle,
-                profit_percent=opp.profit_percent,
-                volume_usd=opp.volume_usd
-            ) for opp in opportunities
-        ]
-        logger.info(f"Ответ на /api/v1/arbitrage/cex_cex_cex: {len(response_opportunities)} возможностей найдено.")
-        return response_opportunities
+        return await _result_response(request, "cex_cex_cex", fresh, opportunity_filter)
     except Exception as e:
         logger.error(f"Ошибка при поиске CEX-CEX-CEX арбитража: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера при поиске арбитража")
 
-@router.websocket("/ws/arbitrage/cex_cex")
-async def websocket_cex_cex_opportunities(websocket: WebSocket):
-    await websocket.accept()
-    logger.info("WebSocket подключен для /ws/arbitrage/cex_cex")
+@router.get("/health/collectors", tags=["Health"])
+async def get_collectors_health():
+    """Сводное состояние воркеров внешнего коллектора (COLLECTOR_MODE=external)."""
     redis_client = redis.Redis(
         host=settings.REDIS_HOST,
         port=settings.REDIS_PORT,
         db=settings.REDIS_DB,
         decode_responses=True
     )
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe("arbitrage:cex_cex")
     try:
-        async for message in pubsub.listen():
-            if message['type'] == 'message':
-                await websocket.send_text(message['data'])
+        return await read_collector_health(redis_client)
     except Exception as e:
-        logger.error(f"Ошибка в WebSocket /ws/arbitrage/cex_cex: {e}", exc_info=True)
+        logger.error(f"Ошибка чтения состояния коллектора: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Не удалось получить состояние коллектора")
     finally:
-        await pubsub.unsubscribe("arbitrage:cex_cex")
         await redis_client.aclose()
-        await websocket.close()
 
-@router.websocket("/ws/arbitrage/cex_cex_cex")
-async def websocket_cex_cex_cex_opportunities(websocket: WebSocket):
+@router.get("/history", tags=["History"])
+async def get_history(
+        pair: str = Query(..., description="Пара, например BTC/USDT"),
+        exchanges: Optional[str] = Query(None, description="Биржи через запятую (по умолчанию все с историей пары)"),
+        start: Optional[int] = Query(None, description="Начало интервала, мс Unix (по умолчанию час до end)"),
+        end: Optional[int] = Query(None, description="Конец интервала, мс Unix (по умолчанию сейчас)"),
+        step_ms: Optional[int] = Query(None, ge=1, description="Шаг прореживания, мс"),
+):
+    """
+    Прореженная история лучших цен пары по биржам и спреды между ними (HISTORY_DIR).
+    Шаг не меньше (end - start) / HISTORY_MAX_POINTS; в точке - последняя котировка интервала, null - котировки нет.
+    """
+    if not settings.HISTORY_DIR:
+        raise HTTPException(status_code=404, detail="История лучших цен не ведется (HISTORY_DIR не задан)")
+    end = end if end is not None else int(time.time() * 1000)
+    start = start if start is not None else end - 3600 * 1000
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start должен быть меньше end")
+    step = max(step_ms or 1, math.ceil((end - start) / settings.HISTORY_MAX_POINTS))
+    # Пара и биржи становятся частью пути к файлам: принимаются только пара вида BASE/QUOTE и биржи из EXCHANGES
+    pair = pair.strip().upper()
+    if not _HISTORY_PAIR_RE.fullmatch(pair):
+        raise HTTPException(status_code=400, detail="pair должна иметь вид BASE/QUOTE, например BTC/USDT")
+    exchange_ids = [exchange_id.strip().lower() for exchange_id in exchanges.split(",") if exchange_id.strip()] \
+        if exchanges else None
+    unknown = [exchange_id for exchange_id in exchange_ids or () if exchange_id not in settings.EXCHANGES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные биржи: {', '.join(unknown)}")
+    try:
+        # Чтение файлов с отображением в память - вне event loop
+        history = await anyio.to_thread.run_sync(
+            spread_history, Path(settings.HISTORY_DIR), pair, exchange_ids, start, end, step, settings.MAX_QUOTE_AGE_MS
+        )
+    except Exception as e:
+        logger.error(f"Ошибка чтения истории лучших цен {pair}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Не удалось прочитать историю лучших цен")
+    return Response(content=orjson.dumps(history, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
+
+def _handle_client_message(client: ClientQueue, text: Optional[str]):
+    """
+    Сообщение клиента WebSocket: {"type": "subscribe", "pair", "exchange", "min_profit", "min_volume", "top"}
+    задает фильтр подписки (без полей - весь канал). Ответ - {"type": "subscribed"} и новый снимок или {"type": "error"}.
+    """
+    try:
+        message = json.loads(text) if text is not None else None
+        if not isinstance(message, dict) or message.get("type") != "subscribe":
+            raise ValueError('ожидается сообщение {"type": "subscribe", ...}')
+        opportunity_filter = OpportunityFilter.from_message(message)
+    except ValueError as e:
+        client.put_control(json.dumps({"type": "error", "detail": str(e)}))
+        return
+    client.set_filter(opportunity_filter)
+    logger.info(f"WebSocket канала {client.channel}: фильтр подписки {opportunity_filter}")
+
+async def _serve_websocket(websocket: WebSocket, channel: str):
+    """Отправляет клиенту сообщения канала из его очереди в общей рассылке; входящие сообщения задают фильтр подписки."""
     await websocket.accept()
-    logger.info("WebSocket подключен для /ws/arbitrage/cex_cex_cex")
-    redis_client = redis.Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        db=settings.REDIS_DB,
-        decode_responses=True
-    )
-    pubsub = redis_client.pubsub()
-    await pubsub.subscribe("arbitrage:cex_cex_cex")
+    ws_connections.labels(channel=channel).inc()
+    logger.info(f"WebSocket подключен к каналу {channel}")
+    client = broadcast_hub.subscribe(channel)
+
+    sent_metric = ws_messages_sent.labels(channel=channel)
+
+    async def send_loop():
+        while True:
+            await websocket.send_text(await client.get())
+            sent_metric.inc()
+
     try:
-        async for message in pubsub.listen():
-            if message['type'] == 'message':
-                await websocket.send_text(message['data'])
+        # Группа задач anyio: отправка и прием завершаются вместе и корректно отменяются сервером
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(send_loop)
+            # Ожидание входящих нужно и чтобы заметить отключение клиента, даже если сообщений нет
+            while (message := await websocket.receive())["type"] != "websocket.disconnect":
+                _handle_client_message(client, message.get("text"))
+            task_group.cancel_scope.cancel()
     except Exception as e:
-        logger.error(f"Ошибка в WebSocket /ws/arbitrage/cex_cex_cex: {e}", exc_info=True)
+        logger.error(f"Ошибка в WebSocket канала {channel}: {e!r}")
+        # Соединение закрывается, чтобы клиент переподключился, а не ждал сообщений от остановленной отправки
+        with anyio.CancelScope(shield=True):
+            try:
+                await websocket.close(code=1011)
+            except Exception:
+                pass
     finally:
-        await pubsub.unsubscribe("arbitrage:cex_cex_cex")
-        await redis_client.aclose()
-        await websocket.close()
\ No newline at end of file
+        broadcast_hub.unsubscribe(client)
+        logger.info(f"WebSocket отключен от канала {channel} (отброшено сообщений: {client.dropped})")
+
+@router.websocket("/ws/arbitrage/cex_cex")
+async def websocket_cex_cex_opportunities(websocket: WebSocket):
+    await _serve_websocket(websocket, "arbitrage:cex_cex")
+
+@router.websocket("/ws/arbitrage/cex_cex_cex")
+async def websocket_cex_cex_cex_opportunities(websocket: WebSocket):
+    await _serve_websocket(websocket, "arbitrage:cex_cex_cex")
@@ -0,0 +1,82 @@
+# backend/arbitrage_finder/cycle_scan.py
+import math
+from typing import List, Dict, Optional, Tuple, NamedTuple
+
+from backend.core.constants import USD_QUOTE_CURRENCIES
+from backend.arbitrage_finder.cycles import Edge, find_negative_cycles
+
+# Рынок для поиска циклов: (биржа, пара, ask, bid, объем ask, объем bid, taker комиссия покупки, продажи)
+CycleMarket = Tuple[str, str, float, float, float, float, float, float]
+# Нога цикла: (биржа, пара, действие, цена, объем, валюта котировки)
+CycleLeg = Tuple[str, str, str, float, float, str]
+# (сделки цикла, прибыль в процентах, оборот в USD по лучшим уровням)
+CycleScanResult = Tuple[List[Tuple[str, str, str]], float, Optional[float]]
+
+
+class CycleScanInput(NamedTuple):
+    """
+    Компактные входные данные поиска циклов, не зависящие от состояния процесса: лучшие цены и комиссии рынков.
+    Передаются в процесс пула целиком, поэтому результат не зависит от версии комиссий в воркере.
+    Стаканы в пул не передаются: глубину найденных циклов считает вызывающий по своему срезу.
+    """
+    markets: List[CycleMarket]
+    max_length: int
+    min_length: int
+    max_rounds: int
+    min_profit_percent: float
+
+
+def build_currency_graph(markets: List[CycleMarket]) -> Tuple[List[str], List[Edge], List[CycleLeg]]:
+    """
+    Строит граф валют по рынкам.
+    Покупка base за quote - ребро quote -> base с курсом (1 - fee) / ask,
+    продажа base за quote - ребро base -> quote с курсом bid * (1 - fee); вес ребра = -log(курс).
+    """
+    currency_index: Dict[str, int] = {}
+    edges: List[Edge] = []
+    legs: List[CycleLeg] = []
+    for exchange_id, pair, ask, bid, ask_volume, bid_volume, buy_fee, sell_fee in markets:
+        if ask <= 0 or bid <= 0:
+            continue
+        base, quote = pair.split('/')
+        base_index = currency_index.setdefault(base, len(currency_index))
+        quote_index = currency_index.setdefault(quote, len(currency_index))
+
+        buy_rate = (1 - buy_fee) / ask
+        if buy_rate > 0:
+            edges.append((quote_index, base_index, -math.log(buy_rate)))
+            legs.append((exchange_id, pair, 'buy', ask, ask_volume, quote))
+        sell_rate = bid * (1 - sell_fee)
+        if sell_rate > 0:
+            edges.append((base_index, quote_index, -math.log(sell_rate)))
+            legs.append((exchange_id, pair, 'sell', bid, bid_volume, quote))
+    currencies = sorted(currency_index, key=currency_index.__getitem__)
+    return currencies, edges, legs
+
+
+def scan_cycles(scan_input: CycleScanInput) -> List[CycleScanResult]:
+    """
+    Поиск прибыльных циклов (Bellman-Ford по графу валют) по лучшим ценам рынков.
+    Чистая функция от scan_input: выполняется в процессе пула сканирования.
+    """
+    markets = scan_input.markets
+    currencies, edges, legs = build_currency_graph(markets)
+    cycles = find_negative_cycles(
+        len(currencies), edges,
+        max_length=scan_input.max_length,
+        min_length=scan_input.min_length,
+        max_rounds=scan_input.max_rounds,
+    )
+
+    results: List[CycleScanResult] = []
+    for cycle in cycles:
+        profit_percent = (math.exp(-sum(edges[i][2] for i in cycle)) - 1) * 100
+        if profit_percent < scan_input.min_profit_percent:
+            continue
+        cycle_legs = [legs[i] for i in cycle]
+        trades = [(exchange_id, pair, action) for exchange_id, pair, action, _, _, _ in cycle_legs]
+        # Оценка объема по лучшим уровням ног, котируемых в долларовых стейблкоинах
+        usd_notionals = [price * volume for _, _, _, price, volume, quote in cycle_legs
+                         if quote in USD_QUOTE_CURRENCIES and volume > 0]
+        results.append((trades, profit_percent, min(usd_notionals) if usd_notionals else None))
+    return results
@@ -0,0 +1,183 @@
+# backend/arbitrage_finder/cycles.py
+from typing import List, Dict, Sequence, Tuple, Set, Optional
+
+# Ребро графа валют: (источник, назначение, вес = -log(курс обмена))
+Edge = Tuple[int, int, float]
+
+# Допуск на погрешность float при сравнении весов
+_EPSILON = 1e-12
+_INF = float('inf')
+# Родитель метки "виртуальный супер-источник"
+_SOURCE = -1
+
+
+def canonical_cycle(cycle: Sequence[int]) -> Tuple[int, ...]:
+    """Поворачивает цикл так, чтобы он начинался с минимального индекса ребра: один цикл - одно представление."""
+    start = min(range(len(cycle)), key=cycle.__getitem__)
+    return tuple(cycle[start:]) + tuple(cycle[:start])
+
+
+class _Labels:
+    """
+    Две лучшие метки расстояния на вершину с разными вершинами-родителями.
+    Этого достаточно для путей без разворота (u -> v -> u): при переходе v -> u
+    используется лучшая метка v, пришедшая не из u.
+    """
+    __slots__ = ("distance", "parent", "edge")
+
+    def __init__(self, vertex_count: int):
+        # Слот 0 - лучшая метка, слот 1 - вторая; все вершины стартуют от супер-источника с расстоянием 0
+        self.distance = [[0.0] * vertex_count, [_INF] * vertex_count]
+        self.parent = [[_SOURCE] * vertex_count, [_SOURCE] * vertex_count]
+        self.edge = [[-1] * vertex_count, [-1] * vertex_count]
+
+    def slot_towards(self, vertex: int, next_vertex: int) -> int:
+        """Слот метки vertex, которую можно продлить в next_vertex без разворота."""
+        return 0 if self.parent[0][vertex] != next_vertex else 1
+
+    def relax(self, source: int, target: int, weight: float, index: int) -> bool:
+        slot = self.slot_towards(source, target)
+        candidate = self.distance[slot][source] + weight
+        distance, parent, edge = self.distance, self.parent, self.edge
+        if parent[0][target] == source:
+            if candidate < distance[0][target] - _EPSILON:
+                distance[0][target] = candidate
+                edge[0][target] = index
+                return True
+            return False
+        if candidate < distance[0][target] - _EPSILON:
+            # Прежняя лучшая метка (от другого родителя) становится второй
+            distance[1][target] = distance[0][target]
+            parent[1][target] = parent[0][target]
+            edge[1][target] = edge[0][target]
+            distance[0][target] = candidate
+            parent[0][target] = source
+            edge[0][target] = index
+            return True
+        if candidate < distance[1][target] - _EPSILON:
+            distance[1][target] = candidate
+            parent[1][target] = source
+            edge[1][target] = index
+            return True
+        return False
+
+
+def _closed_walk(labels: _Labels, vertex: int, slot: int, visited: Set[Tuple[int, int]]) -> Optional[List[int]]:
+    """Идет от метки по родителям; если встречает уже пройденную на этом пути метку - возвращает ребра замкнутого обхода."""
+    position: Dict[Tuple[int, int], int] = {}
+    path_edges: List[int] = []
+    state = (vertex, slot)
+    while state not in position:
+        if state in visited:
+            visited.update(position)
+            return None
+        position[state] = len(path_edges)
+        v, s = state
+        parent = labels.parent[s][v]
+        if parent == _SOURCE:
+            visited.update(position)
+            return None
+        path_edges.append(labels.edge[s][v])
+        state = (parent, labels.slot_towards(parent, v))
+    visited.update(position)
+    # Ребра собраны от конца к началу
+    return path_edges[position[state]:][::-1]
+
+
+def _simple_cycles(walk: List[int], edges: Sequence[Edge]) -> List[List[int]]:
+    """Разбивает замкнутый обход на простые циклы (по первому повтору вершины)."""
+    cycles: List[List[int]] = []
+    stack_vertices: List[int] = []
+    stack_edges: List[int] = []
+    position: Dict[int, int] = {}
+    for index in walk:
+        source, target, _ = edges[index]
+        if source not in position:
+            position[source] = len(stack_vertices)
+            stack_vertices.append(source)
+        stack_edges.append(index)
+        if target in position:
+            start = position[target]
+            cycles.append(stack_edges[start:])
+            for v in stack_vertices[start + 1:]:
+                del position[v]
+            del stack_vertices[start + 1:]
+            del stack_edges[start:]
+    return cycles
+
+
+def _search_round(vertex_count: int, active_edges: List[Tuple[int, int, float, int]],
+                  edges: Sequence[Edge]) -> List[List[int]]:
+    """
+    Один Bellman-Ford без разворотов от виртуального супер-источника.
+    Останавливается, когда проход ничего не изменил (отрицательных циклов нет) или когда в графе
+    родителей нашелся отрицательный цикл.
+    """
+    labels = _Labels(vertex_count)
+    max_passes = 2 * len(active_edges) + vertex_count
+    for _ in range(max_passes):
+        relaxed: List[int] = []
+        for source, target, weight, index in active_edges:
+            if labels.relax(source, target, weight, index):
+                relaxed.append(target)
+        if not relaxed:
+            return []
+
+        cycles: List[List[int]] = []
+        visited: Set[Tuple[int, int]] = set()
+        for vertex in relaxed:
+            for slot in (0, 1):
+                walk = _closed_walk(labels, vertex, slot, visited)
+                if walk is None:
+                    continue
+                for cycle in _simple_cycles(walk, edges):
+                    if sum(edges[i][2] for i in cycle) < -_EPSILON:
+                        cycles.append(cycle)
+        if cycles:
+            return cycles
+    return []
+
+
+def find_negative_cycles(vertex_count: int, edges: Sequence[Edge], max_length: int,
+                         min_length: int = 3, max_rounds: int = 16) -> List[Tuple[int, ...]]:
+    """
+    Ищет отрицательные циклы (арбитражные петли) в графе валют; возвращает циклы как индексы ребер.
+
+    Из параллельных ребер между одной парой валют в поиске участвует только лучшее (минимальный вес).
+    Каждый раунд - один Bellman-Ford от супер-источника с ранней остановкой. Пути без разворотов
+    исключают петли из двух сделок (u -> v -> u), которые иначе забивают граф родителей.
+    Найденные циклы канонизируются и дедуплицируются, после чего у каждого из них исключается самое
+    выгодное ребро (активным становится следующее параллельное) и поиск повторяется.
+    Возвращаются только циклы длиной от min_length до max_length ребер.
+    """
+    if vertex_count == 0 or not edges:
+        return []
+
+    # Для каждой пары (источник, назначение) - ребра по убыванию веса; активно последнее (лучшее)
+    parallel: Dict[Tuple[int, int], List[int]] = {}
+    for index, (source, target, _) in enumerate(edges):
+        if source != target:
+            parallel.setdefault((source, target), []).append(index)
+    for indexes in parallel.values():
+        indexes.sort(key=lambda i: edges[i][2], reverse=True)
+
+    found: Set[Tuple[int, ...]] = set()
+    result: List[Tuple[int, ...]] = []
+    for _ in range(max_rounds):
+        active_edges = [
+            (edges[indexes[-1]][0], edges[indexes[-1]][1], edges[indexes[-1]][2], indexes[-1])
+            for indexes in parallel.values() if indexes
+        ]
+        cycles = _search_round(vertex_count, active_edges, edges)
+        new_cycles = {canonical_cycle(cycle) for cycle in cycles} - found
+        if not new_cycles:
+            break
+        for canonical in sorted(new_cycles):
+            found.add(canonical)
+            if min_length <= len(canonical) <= max_length:
+                result.append(canonical)
+            best_edge = min(canonical, key=lambda i: edges[i][2])
+            candidates = parallel[(edges[best_edge][0], edges[best_edge][1])]
+            if candidates and candidates[-1] == best_edge:
+                candidates.pop()
+    return result
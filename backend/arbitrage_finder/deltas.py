@@ -0,0 +1,135 @@
+# backend/arbitrage_finder/deltas.py
+"""
+Протокол потока возможностей: у каждой возможности стабильный id, изменения передаются
+дельтами с последовательными номерами, периодически - полными снимками для ресинхронизации.
+
+Сообщения (JSON):
+  {"type": "snapshot", "kind", "epoch", "seq", "opportunities": [...]}
+  {"type": "delta", "kind", "epoch", "seq", "added": [...], "updated": [...], "removed": [id, ...]}
+Дельта с номером seq применяется к состоянию с номером seq - 1 той же эпохи (epoch меняется
+при перезапуске поиска); при разрыве последовательности нужно дождаться снимка или запросить его.
+"""
+import time
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Protocol
+
+import orjson
+
+Payload = Dict[str, Any]
+
+
+class OpportunityState:
+    """Текущий набор возможностей одного вида (id -> payload) с номером последнего примененного сообщения."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.epoch: Optional[str] = None
+        self.seq = 0
+        self.opportunities: Dict[str, Payload] = {}
+        # False, если пропущено сообщение: состояние неверно до следующего снимка
+        self.synced = False
+
+    def apply(self, message: Dict[str, Any]) -> bool:
+        """Применяет снимок или дельту; возвращает False, если сообщение устарело или нарушена последовательность."""
+        if message["type"] == "snapshot":
+            if self.synced and message["epoch"] == self.epoch and message["seq"] <= self.seq:
+                return False
+            self.epoch, self.seq = message["epoch"], message["seq"]
+            self.opportunities = {payload["id"]: payload for payload in message["opportunities"]}
+            self.synced = True
+            return True
+        if message["epoch"] == self.epoch and message["seq"] <= self.seq:
+            return False
+        if not self.synced or message["epoch"] != self.epoch or message["seq"] != self.seq + 1:
+            self.synced = False
+            return False
+        for payload in message["added"]:
+            self.opportunities[payload["id"]] = payload
+        for payload in message["updated"]:
+            self.opportunities[payload["id"]] = payload
+        for opportunity_id_ in message["removed"]:
+            self.opportunities.pop(opportunity_id_, None)
+        self.seq = message["seq"]
+        return True
+
+    def delta_message(self, previous: Dict[str, Payload]) -> Dict[str, Any]:
+        """Дельта от набора previous к текущему состоянию с текущим номером."""
+        current = self.opportunities
+        return {
+            "type": "delta",
+            "kind": self.kind,
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "added": [payload for key, payload in current.items() if key not in previous],
+            "updated": [payload for key, payload in current.items() if key in previous and previous[key] != payload],
+            "removed": [key for key in previous if key not in current],
+        }
+
+    def snapshot_message(self) -> Dict[str, Any]:
+        return {
+            "type": "snapshot",
+            "kind": self.kind,
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "opportunities": list(self.opportunities.values()),
+        }
+
+
+class EncodedOpportunity(Protocol):
+    """Возможность с уже закодированным JSON (OpportunityCexCex, OpportunityCexCexCex)."""
+
+    @property
+    def id(self) -> str: ...
+
+    def to_json(self) -> bytes: ...
+
+
+class StreamMessage(NamedTuple):
+    type: str
+    data: bytes
+
+
+class OpportunityStream:
+    """
+    Сторона публикации: сравнивает новый набор возможностей с опубликованным и формирует
+    дельту (или ничего, если изменений нет). Раз в snapshot_interval секунд вместо дельты
+    публикуется полный снимок.
+    Состояние хранит JSON возможностей, а сообщения собираются склейкой этих байтов без повторного кодирования.
+    """
+
+    def __init__(self, kind: str, epoch: str, snapshot_interval: float):
+        self.kind = kind
+        self.epoch = epoch
+        self.seq = 0
+        self.opportunities: Dict[str, bytes] = {}
+        self._snapshot_interval = snapshot_interval
+        # Первая публикация всегда снимок
+        self._last_snapshot_at = float("-inf")
+
+    def _header(self, message_type: str) -> bytes:
+        # Заголовок сообщения без закрывающей скобки, к нему дописываются списки возможностей
+        return orjson.dumps({"type": message_type, "kind": self.kind, "epoch": self.epoch, "seq": self.seq})[:-1]
+
+    def snapshot_message(self) -> bytes:
+        return b"".join((self._header("snapshot"), b',"opportunities":[', b",".join(self.opportunities.values()), b"]}"))
+
+    def update(self, opportunities: Iterable[EncodedOpportunity], now: Optional[float] = None) -> Optional[StreamMessage]:
+        now = time.monotonic() if now is None else now
+        previous = self.opportunities
+        current = {opp.id: opp.to_json() for opp in opportunities}
+        snapshot_due = now - self._last_snapshot_at >= self._snapshot_interval
+        if current == previous and not snapshot_due:
+            return None
+        self.opportunities = current
+        self.seq += 1
+        if snapshot_due:
+            self._last_snapshot_at = now
+            return StreamMessage("snapshot", self.snapshot_message())
+        added = [encoded for key, encoded in current.items() if key not in previous]
+        updated = [encoded for key, encoded in current.items() if key in previous and previous[key] != encoded]
+        removed = [key for key in previous if key not in current]
+        return StreamMessage("delta", b"".join((
+            self._header("delta"),
+            b',"added":[', b",".join(added),
+            b'],"updated":[', b",".join(updated),
+            b'],"removed":', orjson.dumps(removed), b"}",
+        )))
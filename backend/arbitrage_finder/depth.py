@@ -0,0 +1,164 @@
+# backend/arbitrage_finder/depth.py
+from array import array
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from backend.core.constants import USD_QUOTE_CURRENCIES
+from backend.core.types import L2Book
+
+# Остаток уровня меньше этой доли считается исчерпанным (погрешность float)
+_EPSILON = 1e-12
+
+
+class CexCexFill(NamedTuple):
+    """Результат прохода по стаканам для CEX-CEX: объем в base и суммы в quote с учетом комиссий."""
+    size: float
+    cost: float
+    revenue: float
+
+    @property
+    def profit_percent(self) -> float:
+        return (self.revenue - self.cost) / self.cost * 100 if self.cost > 0 else 0.0
+
+
+class CycleFill(NamedTuple):
+    """Результат прохода по стаканам цикла: вложено и получено в стартовой валюте, оборот в quote по ногам."""
+    amount_in: float
+    amount_out: float
+    quote_volumes: Tuple[float, ...]
+
+    @property
+    def profit_percent(self) -> float:
+        return (self.amount_out / self.amount_in - 1) * 100 if self.amount_in > 0 else 0.0
+
+
+# Нога цикла для прохода по глубине: (стакан, покупка ли base за quote, taker комиссия в долях)
+DepthLeg = Tuple[L2Book, bool, float]
+
+
+def sweep_cex_cex(buy_book: L2Book, sell_book: L2Book, buy_fee: float, sell_fee: float) -> CexCexFill:
+    """
+    Максимальный прибыльный объем CEX-CEX: два указателя по ask покупаемого и bid продаваемого стакана.
+    Уровни берутся, пока ask * (1 + buy_fee) < bid * (1 - sell_fee); за шаг исчерпывается хотя бы
+    один уровень, поэтому проход O(уровней) и без аллокаций на уровень.
+    """
+    ask_prices, ask_sizes = buy_book.ask_prices, buy_book.ask_sizes
+    bid_prices, bid_sizes = sell_book.bid_prices, sell_book.bid_sizes
+    ask_count, bid_count = len(ask_prices), len(bid_prices)
+    i = j = 0
+    ask_left = ask_sizes[0] if ask_count else 0.0
+    bid_left = bid_sizes[0] if bid_count else 0.0
+    size = cost = revenue = 0.0
+    while i < ask_count and j < bid_count:
+        unit_cost = ask_prices[i] * (1 + buy_fee)
+        unit_revenue = bid_prices[j] * (1 - sell_fee)
+        if unit_revenue <= unit_cost:
+            break
+        step = ask_left if ask_left < bid_left else bid_left
+        size += step
+        cost += step * unit_cost
+        revenue += step * unit_revenue
+        ask_left -= step
+        bid_left -= step
+        if ask_left <= _EPSILON * ask_sizes[i]:
+            i += 1
+            ask_left = ask_sizes[i] if i < ask_count else 0.0
+        if bid_left <= _EPSILON * bid_sizes[j]:
+            j += 1
+            bid_left = bid_sizes[j] if j < bid_count else 0.0
+    return CexCexFill(size, cost, revenue)
+
+
+def sweep_cycle(legs: Sequence[DepthLeg]) -> Optional[CycleFill]:
+    """
+    Максимальный прибыльный объем цикла сделок с учетом глубины стаканов.
+
+    Покупка base за quote идет по ask: курс (1 - fee) / ask, емкость уровня в quote = ask * объем.
+    Продажа base за quote идет по bid: курс bid * (1 - fee), емкость уровня в base = объем.
+    На каждом шаге берется объем стартовой валюты, который исчерпывает ближайший уровень одной из ног,
+    пока произведение текущих курсов всех ног больше 1. Каждый шаг исчерпывает уровень, поэтому проход
+    O(суммы уровней); память - несколько списков длины числа ног на весь проход.
+    Возвращает None, если у какой-то ноги пустой стакан.
+    """
+    count = len(legs)
+    prices: List[array] = []
+    sizes: List[array] = []
+    for book, is_buy, _ in legs:
+        side_prices = book.ask_prices if is_buy else book.bid_prices
+        if not side_prices:
+            return None
+        prices.append(side_prices)
+        sizes.append(book.ask_sizes if is_buy else book.bid_sizes)
+
+    level = [0] * count
+    # Остаток емкости текущего уровня во входной валюте ноги
+    left = [0.0] * count
+    rate = [0.0] * count
+    quote_volumes = [0.0] * count
+    for k, (_, is_buy, fee) in enumerate(legs):
+        price, size = prices[k][0], sizes[k][0]
+        left[k] = price * size if is_buy else size
+        rate[k] = (1 - fee) / price if is_buy else price * (1 - fee)
+
+    amount_in = amount_out = 0.0
+    while True:
+        # Сколько стартовой валюты исчерпает уровень каждой ноги при текущих курсах
+        factor = 1.0
+        step = float('inf')
+        for k in range(count):
+            capacity = left[k] / factor
+            if capacity < step:
+                step = capacity
+            factor *= rate[k]
+        if factor <= 1.0 or step <= 0:
+            break
+
+        amount_in += step
+        amount_out += step * factor
+        factor = 1.0
+        exhausted = False
+        for k in range(count):
+            is_buy = legs[k][1]
+            leg_input = step * factor
+            # Оборот ноги в quote: на покупке вход уже в quote, на продаже - объем base по цене bid
+            quote_volumes[k] += leg_input if is_buy else leg_input * prices[k][level[k]]
+            factor *= rate[k]
+            left[k] -= leg_input
+            price = prices[k][level[k]]
+            full = price * sizes[k][level[k]] if is_buy else sizes[k][level[k]]
+            if left[k] <= _EPSILON * full:
+                level[k] += 1
+                if level[k] >= len(prices[k]):
+                    exhausted = True
+                    continue
+                price, size = prices[k][level[k]], sizes[k][level[k]]
+                left[k] = price * size if is_buy else size
+                rate[k] = (1 - legs[k][2]) / price if is_buy else price * (1 - legs[k][2])
+        if exhausted:
+            break
+    return CycleFill(amount_in, amount_out, tuple(quote_volumes))
+
+
+def cycle_depth(cycle: Sequence[Tuple[str, str, str]],
+                get_book: Callable[[str, str], Optional[L2Book]],
+                fee_rates: Callable[[str, str], Tuple[float, float]]) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Проход цикла по глубине стаканов: (оборот в USD по первой ноге, котируемой в долларовом стейблкоине,
+    средневзвешенная чистая прибыль в процентах). (None, None), если стакана какой-то ноги нет.
+    fee_rates(биржа, пара) -> (taker комиссия покупки, продажи) в долях.
+    """
+    legs: List[DepthLeg] = []
+    for exchange_id, pair, action in cycle:
+        book = get_book(exchange_id, pair)
+        if book is None:
+            return None, None
+        buy_fee, sell_fee = fee_rates(exchange_id, pair)
+        is_buy = action == 'buy'
+        legs.append((book, is_buy, buy_fee if is_buy else sell_fee))
+    fill = sweep_cycle(legs)
+    if fill is None or fill.amount_in <= 0:
+        return None, None
+    volume_usd = next(
+        (volume for (_, pair, _), volume in zip(cycle, fill.quote_volumes) if pair.split('/')[1] in USD_QUOTE_CURRENCIES),
+        None
+    )
+    return volume_usd, fill.profit_percent
@@ -0,0 +1,76 @@
+# backend/arbitrage_finder/executor.py
+import asyncio
+import multiprocessing
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, Tuple
+
+from backend.monitoring import scan_queue_time, scan_compute_time
+from backend.utils.logger import logger
+
+
+def _timed_call(fn: Callable[..., Any], args: Tuple[Any, ...]) -> Tuple[Any, float, float]:
+    """Выполняется в воркере: (результат, время начала по часам системы, длительность расчета)."""
+    started_at = time.time()
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, started_at, time.perf_counter() - start
+
+
+class ScanExecutor:
+    """
+    Выполняет CPU-тяжелые сканирования вне event loop: в пуле процессов ("process")
+    или прямо в loop ("inline", для маленьких конфигураций и отладки).
+    Число одновременных сканирований ограничено семафором; время ожидания в очереди
+    и время расчета пишутся в отдельные гистограммы.
+    """
+
+    def __init__(self, mode: str, workers: int, max_concurrent: int):
+        self._mode = mode
+        self._workers = workers
+        self._max_concurrent = max_concurrent
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Семафор привязан к event loop, поэтому создается отдельно для каждого loop;
+        # запись удаляется вместе с loop
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self._max_concurrent)
+        return semaphore
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: воркеры не наследуют event loop, соединения Redis и бирж родительского процесса
+            self._pool = ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"Запущен пул сканирования: {self._workers} процессов, до {self._max_concurrent} сканирований одновременно.")
+        return self._pool
+
+    async def run(self, kind: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """Выполняет fn(*args) (fn и аргументы должны сериализоваться pickle) и возвращает результат."""
+        submitted_at = time.time()
+        async with self._get_semaphore():
+            if self._mode == "process":
+                try:
+                    result, started_at, compute_seconds = await asyncio.get_running_loop().run_in_executor(
+                        self._get_pool(), _timed_call, fn, args
+                    )
+                except BrokenProcessPool:
+                    # Воркер пула упал: пул больше не принимает задачи, следующее сканирование создаст новый
+                    logger.error("Пул сканирования сломан (процесс воркера завершился аварийно), пул будет пересоздан.")
+                    self.shutdown()
+                    raise
+            else:
+                result, started_at, compute_seconds = _timed_call(fn, args)
+        scan_queue_time.labels(type=kind).observe(max(0.0, started_at - submitted_at))
+        scan_compute_time.labels(type=kind).observe(compute_seconds)
+        return result
+
+    def shutdown(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
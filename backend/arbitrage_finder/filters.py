@@ -0,0 +1,136 @@
+# backend/arbitrage_finder/filters.py
+"""
+Фильтры возможностей на стороне сервера (пара, биржа, минимальная прибыль, минимальный объем, top-N)
+и индекс последнего набора возможностей, по которому они вычисляются без полного прохода на каждый запрос.
+"""
+from bisect import bisect_right
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+# Ключи возможности для индекса: (пары, биржи, прибыль в процентах, оборот в USD)
+OpportunityKeys = Tuple[Tuple[str, ...], Tuple[str, ...], float, Optional[float]]
+
+
+def _optional_float(value: Any) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def opportunity_keys(kind: str, opp: Any) -> OpportunityKeys:
+    """Ключи объекта возможности из finder (OpportunityCexCex / OpportunityCexCexCex)."""
+    if kind == "cex_cex":
+        return (opp.pair,), (opp.buy_exchange, opp.sell_exchange), float(opp.profit_percent), _optional_float(opp.volume_usd)
+    return (tuple(pair for _, pair, _ in opp.cycle), tuple(exchange_id for exchange_id, _, _ in opp.cycle),
+            float(opp.profit_percent), _optional_float(opp.volume_usd))
+
+
+def payload_keys(kind: str, payload: Dict[str, Any]) -> OpportunityKeys:
+    """Ключи возможности в формате сообщений потока (deltas.py)."""
+    if kind == "cex_cex":
+        pairs: Tuple[str, ...] = (payload["pair"],)
+        exchanges: Tuple[str, ...] = (payload["buy_exchange"], payload["sell_exchange"])
+    else:
+        pairs = tuple(pair for _, pair, _ in payload["cycle"])
+        exchanges = tuple(exchange_id for exchange_id, _, _ in payload["cycle"])
+    return pairs, exchanges, float(payload["profit_percent"]), _optional_float(payload.get("volume_usd"))
+
+
+class OpportunityFilter(NamedTuple):
+    """Фильтр возможностей; None - условие не задано. Пара и биржа сравниваются точно, без учета регистра."""
+    pair: Optional[str] = None
+    exchange: Optional[str] = None
+    min_profit: Optional[float] = None
+    min_volume: Optional[float] = None
+    top: Optional[int] = None
+
+    @classmethod
+    def create(cls, pair: Optional[str] = None, exchange: Optional[str] = None, min_profit: Optional[float] = None,
+               min_volume: Optional[float] = None, top: Optional[int] = None) -> "OpportunityFilter":
+        """Нормализует и проверяет условия; ValueError при некорректных значениях."""
+        if top is not None and (isinstance(top, bool) or int(top) != top or top < 1):
+            raise ValueError("top должен быть целым числом >= 1")
+        return cls(
+            pair=(pair.strip().upper() or None) if pair is not None else None,
+            exchange=(exchange.strip().lower() or None) if exchange is not None else None,
+            min_profit=float(min_profit) if min_profit is not None else None,
+            min_volume=float(min_volume) if min_volume is not None else None,
+            top=int(top) if top is not None else None,
+        )
+
+    @classmethod
+    def from_message(cls, message: Dict[str, Any]) -> "OpportunityFilter":
+        """Фильтр из сообщения подписки WebSocket: {"type": "subscribe", "pair": ..., "top": ...}."""
+        unknown = set(message) - {"type", *cls._fields}
+        if unknown:
+            raise ValueError(f"неизвестные поля фильтра: {', '.join(sorted(unknown))}")
+        for name in ("pair", "exchange"):
+            if message.get(name) is not None and not isinstance(message[name], str):
+                raise ValueError(f"{name} должен быть строкой")
+        for name in ("min_profit", "min_volume", "top"):
+            if message.get(name) is not None and (isinstance(message[name], bool) or not isinstance(message[name], (int, float))):
+                raise ValueError(f"{name} должен быть числом")
+        return cls.create(**{name: message.get(name) for name in cls._fields})
+
+    @property
+    def is_empty(self) -> bool:
+        return self == _NO_FILTER
+
+
+_NO_FILTER = OpportunityFilter()
+
+
+class OpportunityIndex:
+    """
+    Индекс набора возможностей: порядок по убыванию прибыли и списки позиций (в этом порядке) по паре и по бирже.
+    Выборка начинается с самого короткого подходящего списка и останавливается на пороге прибыли или после top-N.
+    Строится один раз на версию набора и разделяется всеми запросами и подписчиками.
+    """
+
+    def __init__(self, keys: Sequence[OpportunityKeys]):
+        # Позиция (ранг) -> индекс возможности во входном наборе
+        self._order = sorted(range(len(keys)), key=lambda i: -keys[i][2])
+        # Ключи по рангам; пары и биржи приведены к регистру фильтра
+        self._keys = [
+            (tuple(pair.upper() for pair in keys[i][0]), tuple(exchange_id.lower() for exchange_id in keys[i][1]),
+             keys[i][2], keys[i][3])
+            for i in self._order
+        ]
+        # Прибыль по рангам со знаком минус (по возрастанию) для бинарного поиска порога
+        self._neg_profits = [-key[2] for key in self._keys]
+        self._by_pair: Dict[str, List[int]] = {}
+        self._by_exchange: Dict[str, List[int]] = {}
+        for rank, (pairs, exchanges, _, _) in enumerate(self._keys):
+            for pair in set(pairs):
+                self._by_pair.setdefault(pair, []).append(rank)
+            for exchange_id in set(exchanges):
+                self._by_exchange.setdefault(exchange_id, []).append(rank)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def select(self, opportunity_filter: OpportunityFilter) -> List[int]:
+        """Индексы подходящих возможностей во входном наборе, по убыванию прибыли."""
+        f = opportunity_filter
+        # Ранги < limit проходят порог минимальной прибыли
+        limit = len(self._keys) if f.min_profit is None else bisect_right(self._neg_profits, -f.min_profit)
+        candidates: Sequence[int] = range(limit)
+        if f.pair is not None:
+            candidates = self._by_pair.get(f.pair, ())
+        if f.exchange is not None:
+            by_exchange = self._by_exchange.get(f.exchange, ())
+            if f.pair is None or len(by_exchange) < len(candidates):
+                candidates = by_exchange
+
+        selected: List[int] = []
+        for rank in candidates:
+            if rank >= limit:
+                break
+            pairs, exchanges, _, volume_usd = self._keys[rank]
+            if f.pair is not None and f.pair not in pairs:
+                continue
+            if f.exchange is not None and f.exchange not in exchanges:
+                continue
+            if f.min_volume is not None and (volume_usd is None or volume_usd < f.min_volume):
+                continue
+            selected.append(self._order[rank])
+            if f.top is not None and len(selected) >= f.top:
+                break
+        return selected
@@ -1,19 +1,41 @@
 # backend/arbitrage_finder/finder.py
 import asyncio
-from typing import List, Dict, Any, Optional, Tuple
-from decimal import Decimal, InvalidOperation
-import math
-import redis.asyncio as redis
-import json
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Set, NamedTuple, Protocol
+from decimal import Decimal
+import orjson
 import time
-from backend.monitoring import arbitrage_cex_cex_count, arbitrage_cex_cex_cex_count, arbitrage_search_time
+import numpy as np
+from backend.monitoring import arbitrage_cex_cex_count, arbitrage_cex_cex_cex_count, arbitrage_search_time, arbitrage_triangle_index_size, \
+    opportunity_stream_messages, opportunity_stream_bytes, arbitrage_detection_latency, market_quotes_stale, \
+    arbitrage_stage_time
 
-from backend.core.config import settings, commissions_config
+from backend.core.config import settings, commissions_config, parse_commission_rate
+from backend.core.types import MarketKey, MarketSnapshot, L2Book, quote_time
 from backend.data_processor.processor import data_processor
+from backend.data_processor.streams import MarketStreamConsumer
+from backend.data_collector.collector import data_collector
+from backend.arbitrage_finder.vectorized import VectorizedCexCexEngine
+from backend.arbitrage_finder.cycle_scan import CycleMarket, CycleScanInput, scan_cycles
+from backend.arbitrage_finder.executor import ScanExecutor
+from backend.arbitrage_finder.deltas import OpportunityStream
+from backend.arbitrage_finder.triangles import TriangleIndex
+from backend.arbitrage_finder.depth import sweep_cex_cex, cycle_depth
+from backend.core.constants import MIN_TRIANGULAR_CYCLE_LENGTH
 from backend.utils.logger import logger
 
+def _decimal_str(value: Optional[Decimal]) -> Optional[str]:
+    return str(value) if value is not None else None
+
 class OpportunityCexCex:
-    def __init__(self, pair: str, buy_exchange: str, sell_exchange: str, buy_price: Decimal, sell_price: Decimal, profit_percent: Decimal, volume_usd: Optional[Decimal] = None):
+    """
+    Найденная CEX-CEX возможность. JSON (to_json) кодируется один раз после завершения расчета
+    и без изменений используется для публикации в Redis, ответов REST и сообщений WebSocket.
+    """
+    __slots__ = ("pair", "buy_exchange", "sell_exchange", "buy_price", "sell_price", "profit_percent",
+                 "volume_usd", "max_size", "net_profit_percent", "_json")
+
+    def __init__(self, pair: str, buy_exchange: str, sell_exchange: str, buy_price: Decimal, sell_price: Decimal, profit_percent: Decimal, volume_usd: Optional[Decimal] = None,
+                 max_size: Optional[Decimal] = None, net_profit_percent: Optional[Decimal] = None):
         self.pair = pair
         self.buy_exchange = buy_exchange
         self.sell_exchange = sell_exchange
@@ -21,256 +43,782 @@ class OpportunityCexCex:
         self.sell_price = sell_price
         self.profit_percent = profit_percent
         self.volume_usd = volume_usd
+        # Расчет по глубине стаканов: максимальный прибыльный объем (base) и средневзвешенная чистая прибыль
+        self.max_size = max_size
+        self.net_profit_percent = net_profit_percent
+        self._json: Optional[bytes] = None
+
+    @property
+    def id(self) -> str:
+        """Стабильный идентификатор возможности в потоке дельт."""
+        return f"{self.pair}|{self.buy_exchange}|{self.sell_exchange}"
+
+    def to_json(self) -> bytes:
+        if self._json is None:
+            self._json = orjson.dumps({
+                "id": self.id,
+                "pair": self.pair,
+                "buy_exchange": self.buy_exchange,
+                "sell_exchange": self.sell_exchange,
+                "buy_price": str(self.buy_price),
+                "sell_price": str(self.sell_price),
+                "profit_percent": str(self.profit_percent),
+                "volume_usd": _decimal_str(self.volume_usd),
+                "max_size": _decimal_str(self.max_size),
+                "net_profit_percent": _decimal_str(self.net_profit_percent),
+            })
+        return self._json
 
     def __repr__(self):
         return (f"CEX-CEX Opportunity: {self.pair} | Buy on {self.buy_exchange} @ {self.buy_price} "
                 f"| Sell on {self.sell_exchange} @ {self.sell_price} | Profit: {self.profit_percent:.4f}% "
-                f"| Volume(USD): {self.volume_usd}")
+                f"| Volume(USD): {self.volume_usd} | Max size: {self.max_size} | Net profit: {self.net_profit_percent}")
 
 class OpportunityCexCexCex:
-    def __init__(self, cycle: List[Tuple[str, str, str]], profit_percent: Decimal, volume_usd: Optional[Decimal] = None):
+    """Найденный цикл из трех и более сделок; JSON кодируется один раз, как у OpportunityCexCex."""
+    __slots__ = ("cycle", "profit_percent", "volume_usd", "net_profit_percent", "_json")
+
+    def __init__(self, cycle: List[Tuple[str, str, str]], profit_percent: Decimal, volume_usd: Optional[Decimal] = None,
+                 net_profit_percent: Optional[Decimal] = None):
         self.cycle = cycle
         self.profit_percent = profit_percent
         self.volume_usd = volume_usd
+        # Средневзвешенная чистая прибыль при проходе максимального прибыльного объема по глубине стаканов
+        self.net_profit_percent = net_profit_percent
+        self._json: Optional[bytes] = None
+
+    @property
+    def id(self) -> str:
+        """Стабильный идентификатор: последовательность сделок цикла."""
+        return ">".join(f"{exchange_id}:{pair}:{action}" for exchange_id, pair, action in self.cycle)
+
+    def to_json(self) -> bytes:
+        if self._json is None:
+            self._json = orjson.dumps({
+                "id": self.id,
+                "cycle": self.cycle,
+                "profit_percent": str(self.profit_percent),
+                "volume_usd": _decimal_str(self.volume_usd),
+                "net_profit_percent": _decimal_str(self.net_profit_percent),
+            })
+        return self._json
 
     def __repr__(self):
         cycle_str = " -> ".join([f"{action} {pair} on {exchange}" for exchange, pair, action in self.cycle])
         return (f"CEX-CEX-CEX Opportunity: {cycle_str} | Profit: {self.profit_percent:.4f}% "
-                f"| Volume(USD): {self.volume_usd}")
-
-def parse_commission_rate(commission_str: Optional[str]) -> Decimal:
-    if commission_str is None:
-        return Decimal(0)
-    try:
-        if commission_str.endswith('%'):
-            return Decimal(commission_str[:-1].strip()) / Decimal(100)
-        return Decimal(0)
-    except (InvalidOperation, ValueError):
-        logger.warning(f"Не удалось распарсить строку комиссии: '{commission_str}'. Считаем 0%.")
-        return Decimal(0)
+                f"| Volume(USD): {self.volume_usd} | Net profit: {self.net_profit_percent}")
+
+def _to_decimal(value: Optional[float]) -> Optional[Decimal]:
+    return Decimal(str(value)) if value is not None else None
+
+def get_taker_fee_rates(exchange_id: str, pair: str) -> Tuple[Decimal, Decimal]:
+    """Возвращает (taker_buy_rate, taker_sell_rate) для биржи и пары из скомпилированной таблицы комиссий."""
+    rates = commissions_config.fee_table.rates(exchange_id, pair)
+    return rates.taker_buy, rates.taker_sell
+
+class PublishedResult(NamedTuple):
+    """Последний опубликованный результат поиска одного вида арбитража."""
+    kind: str
+    version: int
+    published_at: float
+    opportunities: List[Any]
+    etag: str
+
+
+class MarketSource(Protocol):
+    """Состояние рынков в памяти, из которого берутся срезы (MarketStreamConsumer, воспроизведение записи)."""
+
+    def snapshot(self, keys: Optional[Iterable[MarketKey]] = None) -> MarketSnapshot: ...
+
 
 class ArbitrageFinder:
     def __init__(self):
         self._min_profit_percent = Decimal(settings.MIN_PROFIT_PERCENT)
-        self._redis_client = redis.from_url(
-            f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.REDIS_DB}",
-            encoding="utf-8",
-            decode_responses=True
-        )
-        self._pubsub = self._redis_client.pubsub()
         self._running = False
-
-    async def find_cex_cex_opportunities(self) -> List[OpportunityCexCex]:
-        start_time = time.time()
+        self._tasks: List[asyncio.Task] = []
+        # Текущие CEX-CEX возможности по парам для инкрементального режима
+        self._cex_cex_by_pair: Dict[str, List[OpportunityCexCex]] = {}
+        self._cex_cex_engine = settings.CEX_CEX_ENGINE
+        self._vectorized_engine = VectorizedCexCexEngine(self._float_fee_rates)
+        # Индекс треугольников и текущие треугольные возможности (по индексу треугольника)
+        self._triangle_index = TriangleIndex(self._float_fee_rates)
+        self._triangles_found: Dict[int, OpportunityCexCexCex] = {}
+        # Последние стаканы рынков индекса треугольников для расчета по глубине
+        self._books: Dict[MarketKey, L2Book] = {}
+        # Последние опубликованные результаты по видам арбитража и общий счетчик версий.
+        # Идентификатор запуска в ETag исключает совпадение версий после перезапуска процесса
+        self._latest: Dict[str, PublishedResult] = {}
+        self._result_version = 0
+        self._boot_id = format(time.time_ns(), "x")
+        # Выполняющиеся пересчеты по запросу: параллельные запросы ждут один и тот же
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Состояние потоков возможностей для публикации дельтами (эпоха потока - идентификатор запуска)
+        self._opportunity_streams: Dict[str, OpportunityStream] = {
+            kind: OpportunityStream(kind, self._boot_id, settings.OPPORTUNITY_SNAPSHOT_INTERVAL)
+            for kind in ("cex_cex", "cex_cex_cex")
+        }
+        # Версия результата, совпадающая с опубликованным состоянием потока (пересчет по запросу поток не обновляет)
+        self._stream_versions: Dict[str, int] = {}
+        # Поиск циклов выполняется вне event loop
+        self._scan_executor = ScanExecutor(settings.SCAN_EXECUTOR, settings.SCAN_POOL_WORKERS, settings.SCAN_MAX_CONCURRENT)
+        # Самое раннее время котировки по рынкам из загруженных срезов (для поиска устаревших в инкрементальных режимах)
+        self._quote_times: Dict[MarketKey, float] = {}
+        # Последнее обработанное время записи в кэш по (вид записи, рынок) и еще не учтенные в метрике обновления
+        self._consumed_cached_at: Dict[Tuple[str, MarketKey], float] = {}
+        self._undetected: List[Tuple[str, float]] = []
+        # Состояние рынков в памяти (Redis Streams в режиме "stream", воспроизводимая запись); None - срезы из ключей Redis
+        self._market_source: Optional[MarketSource] = None
+        # False - источник воспроизводит запись: время котировок не сравнивается с текущим
+        self._live_source = True
+
+    @staticmethod
+    def _float_fee_rates(exchange_id: str, pair: str) -> Tuple[float, float]:
+        rates = commissions_config.fee_table.rates(exchange_id, pair)
+        return rates.taker_buy_float, rates.taker_sell_float
+
+    def _configured_pairs_by_exchange(self) -> Dict[str, List[str]]:
+        return {
+            exc: commissions_config.get_all_exchange_symbols(exc)
+            for exc in settings.EXCHANGES
+        }
+
+    def _triangle_universe(self) -> Dict[str, List[str]]:
+        """Настроенные пары, ограниченные загруженными рынками бирж (если коллектор уже их определил)."""
+        watched_symbols = data_collector.watched_symbols
+        universe = self._configured_pairs_by_exchange()
+        if not watched_symbols:
+            return universe
+        return {
+            exchange_id: [pair for pair in pairs if pair in watched_symbols.get(exchange_id, ())]
+            for exchange_id, pairs in universe.items()
+        }
+
+    def _market_keys(self, configured_pairs_by_exchange: Dict[str, List[str]]) -> List[MarketKey]:
+        return [
+            (exchange_id, pair)
+            for exchange_id, pairs in configured_pairs_by_exchange.items()
+            for pair in pairs
+        ]
+
+    def set_market_source(self, source: Optional[MarketSource], live: bool = True):
+        """
+        Срезы рынков из состояния в памяти вместо ключей Redis (None - снова из Redis).
+        live=False - воспроизведение записанных данных: котировки не отбрасываются как устаревшие
+        по текущему времени и не учитываются в метриках задержки.
+        """
+        self._market_source = source
+        self._live_source = live
+
+    async def get_market_snapshot(self) -> MarketSnapshot:
+        """Получает срез всех настроенных рынков одним запросом к Redis."""
+        return await self._load_snapshot(self._market_keys(self._configured_pairs_by_exchange()))
+
+    async def _load_snapshot(self, keys: List[MarketKey]) -> MarketSnapshot:
+        """
+        Срез рынков: из памяти потребителя стримов в режиме "stream", иначе из ключей Redis.
+        Котировки старше MAX_QUOTE_AGE_MS исключаются, поэтому ни один способ поиска не рассматривает такие ноги.
+        """
+        with arbitrage_stage_time.labels(stage="fetch").time():
+            if self._market_source is not None:
+                snapshot = self._market_source.snapshot(keys)
+            else:
+                snapshot = await data_processor.get_market_snapshot(keys)
+            if not self._live_source:
+                return snapshot
+            if settings.MAX_QUOTE_AGE_MS > 0:
+                snapshot, stale = snapshot.without_stale(settings.MAX_QUOTE_AGE_MS)
+                for exchange_id, _ in stale:
+                    market_quotes_stale.labels(exchange=exchange_id).inc()
+            self._track_quotes(snapshot)
+        return snapshot
+
+    def _track_quotes(self, snapshot: MarketSnapshot):
+        """Запоминает время котировок среза (для отслеживания устаревания) и новые записи для метрики задержки обнаружения."""
+        for kind, records in (("orderbook", snapshot.orderbooks), ("ticker", snapshot.tickers)):
+            for market, record in records.items():
+                quoted_at = quote_time(record)
+                if quoted_at is not None:
+                    previous = self._quote_times.get(market)
+                    self._quote_times[market] = quoted_at if previous is None else min(previous, quoted_at)
+                cached_at = record.get('cachedAt')
+                if cached_at is not None and cached_at > self._consumed_cached_at.get((kind, market), 0):
+                    self._consumed_cached_at[(kind, market)] = cached_at
+                    self._undetected.append((market[0], cached_at))
+
+    def _observe_detection_latency(self):
+        """Задержка от записи обновлений в кэш до завершения поиска, который их обработал."""
+        now_ms = time.time() * 1000
+        for exchange_id, cached_at in self._undetected:
+            arbitrage_detection_latency.labels(exchange=exchange_id).observe(max(0.0, (now_ms - cached_at) / 1000))
+        self._undetected = []
+
+    def _expired_markets(self) -> Set[MarketKey]:
+        """
+        Рынки, котировки которых устарели с момента загрузки: в инкрементальных режимах они не обновляются сами,
+        поэтому пересчитываются как обновившиеся - при загрузке устаревшие записи отбрасываются и возможности по ним пропадают.
+        """
+        if settings.MAX_QUOTE_AGE_MS <= 0:
+            return set()
+        deadline = time.time() * 1000 - settings.MAX_QUOTE_AGE_MS
+        expired = {market for market, quoted_at in self._quote_times.items() if quoted_at < deadline}
+        for market in expired:
+            del self._quote_times[market]
+        return expired
+
+    async def find_cex_cex_opportunities(self, snapshot: Optional[MarketSnapshot] = None) -> List[OpportunityCexCex]:
+        if snapshot is None:
+            snapshot = await self.get_market_snapshot()
         with arbitrage_search_time.labels(type="cex_cex").time():
-            opportunities: List[OpportunityCexCex] = []
             exchanges = settings.EXCHANGES
-            configured_pairs_by_exchange = {
-                exc: commissions_config.get_all_exchange_symbols(exc)
-                for exc in exchanges
-            }
+            configured_pairs_by_exchange = self._configured_pairs_by_exchange()
 
             logger.info("Начало поиска CEX-CEX арбитража...")
-            all_configured_pairs = set()
-            for symbols in configured_pairs_by_exchange.values():
-                all_configured_pairs.update(symbols)
-
-            for pair in all_configured_pairs:
-                for buy_exchange_id in exchanges:
-                    for sell_exchange_id in exchanges:
-                        if buy_exchange_id == sell_exchange_id:
-                            continue
-                        if pair not in configured_pairs_by_exchange.get(buy_exchange_id, []):
-                            continue
-                        if pair not in configured_pairs_by_exchange.get(sell_exchange_id, []):
-                            continue
-
-                        buy_orderbook_data = await data_processor.get_orderbook(buy_exchange_id, pair)
-                        sell_orderbook_data = await data_processor.get_orderbook(sell_exchange_id, pair)
-
-                        if not buy_orderbook_data:
-                            buy_ticker_data = await data_processor.get_ticker(buy_exchange_id, pair)
-                            if buy_ticker_data:
-                                buy_ask = Decimal(str(buy_ticker_data.get('ask', 0)))
-                                buy_ask_volume = Decimal(0)
-                            else:
-                                buy_ask = Decimal(0)
-                                buy_ask_volume = Decimal(0)
-                        else:
-                            buy_ask = Decimal(str(buy_orderbook_data.get('ask', 0)))
-                            buy_ask_volume = Decimal(str(buy_orderbook_data.get('askVolume', 0)))
-
-                        if not sell_orderbook_data:
-                            sell_ticker_data = await data_processor.get_ticker(sell_exchange_id, pair)
-                            if sell_ticker_data:
-                                sell_bid = Decimal(str(sell_ticker_data.get('bid', 0)))
-                                sell_bid_volume = Decimal(0)
-                            else:
-                                sell_bid = Decimal(0)
-                                sell_bid_volume = Decimal(0)
-                        else:
-                            sell_bid = Decimal(str(sell_orderbook_data.get('bid', 0)))
-                            sell_bid_volume = Decimal(str(sell_orderbook_data.get('bidVolume', 0)))
-
-                        if buy_ask <= Decimal(0) or sell_bid <= Decimal(0):
-                            continue
-
-                        buy_commission_str = commissions_config.get_commission(buy_exchange_id, pair, 'taker_buy_rate')
-                        sell_commission_str = commissions_config.get_commission(sell_exchange_id, pair, 'taker_sell_rate') or \
-                                             commissions_config.get_commission(sell_exchange_id, pair, 'taker_order_rate')
-                        buy_fee_rate = parse_commission_rate(buy_commission_str)
-                        sell_fee_rate = parse_commission_rate(sell_commission_str)
-
-                        cost = buy_ask * (Decimal(1) + buy_fee_rate)
-                        revenue = sell_bid * (Decimal(1) - sell_fee_rate)
-
-                        if revenue > cost:
-                            absolute_profit = revenue - cost
-                            profit_percent = (absolute_profit / cost) * Decimal(100)
-                            available_volume = min(buy_ask_volume, sell_bid_volume)
-                            potential_volume_usd = available_volume * (buy_ask + sell_bid) / Decimal(2) if available_volume > 0 else None
-
-                            if profit_percent >= self._min_profit_percent:
-                                opportunities.append(OpportunityCexCex(
-                                    pair=pair,
-                                    buy_exchange=buy_exchange_id.upper(),
-                                    sell_exchange=sell_exchange_id.upper(),
-                                    buy_price=buy_ask,
-                                    sell_price=sell_bid,
-                                    profit_percent=profit_percent,
-                                    volume_usd=potential_volume_usd
-                                ))
+            with arbitrage_stage_time.labels(stage="search").time():
+                opportunities = self._scan_cex_cex(snapshot, exchanges, configured_pairs_by_exchange)
 
             logger.info(f"Поиск CEX-CEX арбитража завершен. Найдено {len(opportunities)} возможностей.")
             arbitrage_cex_cex_count.inc(len(opportunities))
             opportunities.sort(key=lambda opp: opp.profit_percent, reverse=True)
             return opportunities
 
-    async def find_cex_cex_cex_opportunities(self) -> List[OpportunityCexCexCex]:
-        start_time = time.time()
-        with arbitrage_search_time.labels(type="cex_cex_cex").time():
-            opportunities: List[OpportunityCexCexCex] = []
-            exchanges = settings.EXCHANGES
-            configured_pairs_by_exchange = {
-                exc: commissions_config.get_all_exchange_symbols(exc)
-                for exc in exchanges
-            }
-
-            logger.info("Начало поиска CEX-CEX-CEX арбитража...")
-            graph = []
-            currencies = set()
-            for exchange_id in exchanges:
-                for pair in configured_pairs_by_exchange.get(exchange_id, []):
-                    base, quote = pair.split('/')
-                    currencies.add(base)
-                    currencies.add(quote)
-                    orderbook_data = await data_processor.get_orderbook(exchange_id, pair)
-                    if not orderbook_data:
+    def _scan_cex_cex(self, snapshot: MarketSnapshot, exchanges: List[str],
+                      configured_pairs_by_exchange: Dict[str, List[str]],
+                      pairs: Optional[Iterable[str]] = None) -> List[OpportunityCexCex]:
+        if self._cex_cex_engine == "numpy":
+            opportunities = self._scan_cex_cex_vectorized(snapshot, exchanges, configured_pairs_by_exchange, pairs)
+        else:
+            opportunities = self._scan_cex_cex_decimal(snapshot, exchanges, configured_pairs_by_exchange, pairs)
+        self._apply_cex_cex_depth(opportunities, snapshot)
+        return opportunities
+
+    @staticmethod
+    def _apply_cex_cex_depth(opportunities: List[OpportunityCexCex], snapshot: MarketSnapshot):
+        """
+        Для найденных по лучшим ценам возможностей проходит глубину стаканов: максимальный прибыльный объем,
+        средневзвешенная чистая прибыль и оборот (стоимость покупки с комиссией) вместо объема лучшего уровня.
+        """
+        fee_table = commissions_config.fee_table
+        depth = settings.ORDERBOOK_DEPTH
+        for opp in opportunities:
+            buy_exchange_id, sell_exchange_id = opp.buy_exchange.lower(), opp.sell_exchange.lower()
+            buy_book = snapshot.get_book(buy_exchange_id, opp.pair, depth)
+            sell_book = snapshot.get_book(sell_exchange_id, opp.pair, depth)
+            if buy_book is None or sell_book is None:
+                continue
+            fill = sweep_cex_cex(
+                buy_book, sell_book,
+                fee_table.rates(buy_exchange_id, opp.pair).taker_buy_float,
+                fee_table.rates(sell_exchange_id, opp.pair).taker_sell_float,
+            )
+            if fill.size <= 0:
+                continue
+            opp.max_size = Decimal(str(fill.size))
+            opp.volume_usd = Decimal(str(fill.cost))
+            opp.net_profit_percent = Decimal(str(fill.profit_percent))
+
+    def _scan_cex_cex_vectorized(self, snapshot: MarketSnapshot, exchanges: List[str],
+                                 configured_pairs_by_exchange: Dict[str, List[str]],
+                                 pairs: Optional[Iterable[str]] = None) -> List[OpportunityCexCex]:
+        results = self._vectorized_engine.scan(
+            snapshot, exchanges, configured_pairs_by_exchange, float(self._min_profit_percent), pairs,
+            fee_version=commissions_config.fee_table.version
+        )
+        return [
+            OpportunityCexCex(
+                pair=pair,
+                buy_exchange=buy_exchange_id.upper(),
+                sell_exchange=sell_exchange_id.upper(),
+                buy_price=Decimal(str(buy_ask)),
+                sell_price=Decimal(str(sell_bid)),
+                profit_percent=Decimal(str(profit_percent)),
+                volume_usd=Decimal(str(volume_usd)) if volume_usd is not None else None
+            )
+            for pair, buy_exchange_id, sell_exchange_id, buy_ask, sell_bid, profit_percent, volume_usd in results
+        ]
+
+    def _scan_cex_cex_decimal(self, snapshot: MarketSnapshot, exchanges: List[str],
+                              configured_pairs_by_exchange: Dict[str, List[str]],
+                              pairs: Optional[Iterable[str]] = None) -> List[OpportunityCexCex]:
+        """Эталонная реализация на Decimal; используется для сверки с векторизованным движком."""
+        opportunities: List[OpportunityCexCex] = []
+        # Одна версия таблицы комиссий на весь проход
+        fee_table = commissions_config.fee_table
+        all_configured_pairs = set()
+        for symbols in configured_pairs_by_exchange.values():
+            all_configured_pairs.update(symbols)
+        if pairs is not None:
+            all_configured_pairs.intersection_update(pairs)
+
+        for pair in all_configured_pairs:
+            for buy_exchange_id in exchanges:
+                for sell_exchange_id in exchanges:
+                    if buy_exchange_id == sell_exchange_id:
                         continue
-                    ask = Decimal(str(orderbook_data.get('ask', 0)))
-                    bid = Decimal(str(orderbook_data.get('bid', 0)))
-                    ask_volume = Decimal(str(orderbook_data.get('askVolume', 0)))
-                    bid_volume = Decimal(str(orderbook_data.get('bidVolume', 0)))
-                    if ask <= 0 or bid <= 0:
+                    if pair not in configured_pairs_by_exchange.get(buy_exchange_id, []):
                         continue
+                    if pair not in configured_pairs_by_exchange.get(sell_exchange_id, []):
+                        continue
+
+                    buy_orderbook_data = snapshot.get_orderbook(buy_exchange_id, pair)
+                    sell_orderbook_data = snapshot.get_orderbook(sell_exchange_id, pair)
 
-                    buy_fee = parse_commission_rate(commissions_config.get_commission(exchange_id, pair, 'taker_buy_rate'))
-                    sell_fee = parse_commission_rate(commissions_config.get_commission(exchange_id, pair, 'taker_sell_rate') or
-                                                    commissions_config.get_commission(exchange_id, pair, 'taker_order_rate'))
-
-                    if ask > 0:
-                        weight_buy = -math.log(float((Decimal(1) - buy_fee) / ask))
-                        graph.append((exchange_id, base, quote, weight_buy, ask, ask_volume, 'buy'))
-                    if bid > 0:
-                        weight_sell = -math.log(float(bid * (Decimal(1) - sell_fee)))
-                        graph.append((exchange_id, quote, base, weight_sell, bid, bid_volume, 'sell'))
-
-            for start_currency in currencies:
-                distances = {currency: float('inf') for currency in currencies}
-                distances[start_currency] = 0
-                predecessors = {currency: None for currency in currencies}
-                actions = {currency: None for currency in currencies}
-                exchanges_used = {currency: None for currency in currencies}
-                volumes = {currency: None for currency in currencies}
-                prices = {currency: None for currency in currencies}
-
-                for _ in range(len(currencies) - 1):
-                    for exchange_id, source, target, weight, price, volume, action in graph:
-                        if distances[source] + weight < distances[target]:
-                            distances[target] = distances[source] + weight
-                            predecessors[target] = source
-                            actions[target] = action
-                            exchanges_used[target] = exchange_id
-                            volumes[target] = volume
-                            prices[target] = price
-
-                for exchange_id, source, target, weight, price, volume, action in graph:
-                    if distances[source] + weight < distances[target]:
-                        cycle = []
-                        current = target
-                        seen = set()
-                        while current not in seen:
-                            seen.add(current)
-                            cycle.append((exchanges_used[current], f"{predecessors[current]}/{current}", actions[current]))
-                            current = predecessors[current]
-                        cycle.append((exchanges_used[current], f"{predecessors[current]}/{current}", actions[current]))
-                        cycle.reverse()
-
-                        profit = -distances[target]
-                        profit_percent = (math.exp(-profit) - 1) * 100
-                        if profit_percent >= float(self._min_profit_percent):
-                            volume_usd = None
-                            min_volume = min(volumes[c] for c in volumes if volumes[c] is not None and c in seen)
-                            if min_volume > 0:
-                                avg_price = sum(prices[c] for c in prices if prices[c] is not None and c in seen) / len(seen)
-                                volume_usd = min_volume * avg_price
-
-                            opportunities.append(OpportunityCexCexCex(
-                                cycle=cycle,
-                                profit_percent=Decimal(str(profit_percent)),
-                                volume_usd=volume_usd
+                    if not buy_orderbook_data:
+                        buy_ticker_data = snapshot.get_ticker(buy_exchange_id, pair)
+                        if buy_ticker_data:
+                            buy_ask = Decimal(str(buy_ticker_data.get('ask', 0)))
+                            buy_ask_volume = Decimal(0)
+                        else:
+                            buy_ask = Decimal(0)
+                            buy_ask_volume = Decimal(0)
+                    else:
+                        buy_ask = Decimal(str(buy_orderbook_data.get('ask', 0)))
+                        buy_ask_volume = Decimal(str(buy_orderbook_data.get('askVolume', 0)))
+
+                    if not sell_orderbook_data:
+                        sell_ticker_data = snapshot.get_ticker(sell_exchange_id, pair)
+                        if sell_ticker_data:
+                            sell_bid = Decimal(str(sell_ticker_data.get('bid', 0)))
+                            sell_bid_volume = Decimal(0)
+                        else:
+                            sell_bid = Decimal(0)
+                            sell_bid_volume = Decimal(0)
+                    else:
+                        sell_bid = Decimal(str(sell_orderbook_data.get('bid', 0)))
+                        sell_bid_volume = Decimal(str(sell_orderbook_data.get('bidVolume', 0)))
+
+                    if buy_ask <= Decimal(0) or sell_bid <= Decimal(0):
+                        continue
+
+                    buy_fee_rate = fee_table.rates(buy_exchange_id, pair).taker_buy
+                    sell_fee_rate = fee_table.rates(sell_exchange_id, pair).taker_sell
+
+                    cost = buy_ask * (Decimal(1) + buy_fee_rate)
+                    revenue = sell_bid * (Decimal(1) - sell_fee_rate)
+
+                    if revenue > cost:
+                        absolute_profit = revenue - cost
+                        profit_percent = (absolute_profit / cost) * Decimal(100)
+                        available_volume = min(buy_ask_volume, sell_bid_volume)
+                        potential_volume_usd = available_volume * (buy_ask + sell_bid) / Decimal(2) if available_volume > 0 else None
+
+                        if profit_percent >= self._min_profit_percent:
+                            opportunities.append(OpportunityCexCex(
+                                pair=pair,
+                                buy_exchange=buy_exchange_id.upper(),
+                                sell_exchange=sell_exchange_id.upper(),
+                                buy_price=buy_ask,
+                                sell_price=sell_bid,
+                                profit_percent=profit_percent,
+                                volume_usd=potential_volume_usd
                             ))
+        return opportunities
+
+    def _cycle_scan_input(self, snapshot: MarketSnapshot, exchanges: List[str],
+                          configured_pairs_by_exchange: Dict[str, List[str]]) -> CycleScanInput:
+        """Компактные входные данные для поиска циклов в пуле: лучшие цены и комиссии рынков."""
+        fee_table = commissions_config.fee_table
+        markets: List[CycleMarket] = []
+        for exchange_id in exchanges:
+            for pair in configured_pairs_by_exchange.get(exchange_id, []):
+                orderbook_data = snapshot.get_orderbook(exchange_id, pair)
+                if not orderbook_data:
+                    continue
+                ask = float(orderbook_data.get('ask') or 0)
+                bid = float(orderbook_data.get('bid') or 0)
+                if ask <= 0 or bid <= 0:
+                    continue
+                rates = fee_table.rates(exchange_id, pair)
+                markets.append((
+                    exchange_id, pair, ask, bid,
+                    float(orderbook_data.get('askVolume') or 0), float(orderbook_data.get('bidVolume') or 0),
+                    rates.taker_buy_float, rates.taker_sell_float,
+                ))
+        return CycleScanInput(
+            markets=markets,
+            max_length=settings.MAX_CYCLE_LENGTH,
+            # Циклы из двух сделок - это CEX-CEX арбитраж, здесь ищем петли от трех сделок
+            min_length=MIN_TRIANGULAR_CYCLE_LENGTH,
+            max_rounds=settings.CYCLE_SEARCH_MAX_ROUNDS,
+            min_profit_percent=float(self._min_profit_percent),
+        )
+
+    async def find_cex_cex_cex_opportunities(self, snapshot: Optional[MarketSnapshot] = None) -> List[OpportunityCexCexCex]:
+        if snapshot is None:
+            snapshot = await self.get_market_snapshot()
+        with arbitrage_search_time.labels(type="cex_cex_cex").time():
+            logger.info("Начало поиска CEX-CEX-CEX арбитража...")
+            with arbitrage_stage_time.labels(stage="graph_build").time():
+                scan_input = self._cycle_scan_input(snapshot, settings.EXCHANGES, self._configured_pairs_by_exchange())
+            # Построение графа и Bellman-Ford - в пуле процессов, event loop в это время обслуживает I/O
+            with arbitrage_stage_time.labels(stage="search").time():
+                results = await self._scan_executor.run("cex_cex_cex", scan_cycles, scan_input)
+            # По глубине считаются только найденные циклы; стакан строится из среза один раз на рынок
+            depth = settings.ORDERBOOK_DEPTH
+            opportunities = []
+            for trades, profit_percent, volume_usd in results:
+                depth_volume_usd, net_profit_percent = cycle_depth(
+                    trades, lambda exchange_id, pair: snapshot.get_book(exchange_id, pair, depth), self._float_fee_rates
+                )
+                opportunities.append(OpportunityCexCexCex(
+                    cycle=trades,
+                    profit_percent=Decimal(str(profit_percent)),
+                    volume_usd=_to_decimal(volume_usd if depth_volume_usd is None else depth_volume_usd),
+                    net_profit_percent=_to_decimal(net_profit_percent)
+                ))
 
             logger.info(f"Поиск CEX-CEX-CEX арбитража завершен. Найдено {len(opportunities)} возможностей.")
             arbitrage_cex_cex_cex_count.inc(len(opportunities))
             opportunities.sort(key=lambda opp: opp.profit_percent, reverse=True)
             return opportunities
 
+    def _store_result(self, kind: str, opportunities: List[Any]) -> PublishedResult:
+        self._result_version += 1
+        result = PublishedResult(
+            kind=kind,
+            version=self._result_version,
+            published_at=time.time(),
+            opportunities=opportunities,
+            etag=f'"{self._boot_id}-{self._result_version}"',
+        )
+        self._latest[kind] = result
+        return result
+
+    def latest_result(self, kind: str) -> Optional[PublishedResult]:
+        return self._latest.get(kind)
+
+    async def get_result(self, kind: str, fresh: bool = False) -> PublishedResult:
+        """
+        Результат для API: последний опубликованный фоновым поиском, без пересчета.
+        Пересчет выполняется, если запрошен fresh, результата еще нет или фоновый поиск в этом процессе
+        не запущен и результат старше API_RESULT_MAX_AGE. Одновременные запросы ждут один пересчет.
+        """
+        latest = self._latest.get(kind)
+        if not fresh and latest is not None and (
+                self._running or time.time() - latest.published_at <= settings.API_RESULT_MAX_AGE):
+            return latest
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(kind)
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = loop.create_task(self._recompute(kind), name=f"recompute_{kind}")
+            self._inflight[kind] = task
+        # shield: отмена одного ожидающего запроса не отменяет общий пересчет
+        return await asyncio.shield(task)
+
+    async def _recompute(self, kind: str) -> PublishedResult:
+        try:
+            if kind == "cex_cex":
+                opportunities = await self.find_cex_cex_opportunities()
+            else:
+                opportunities = await self.find_cex_cex_cex_opportunities()
+            self._observe_detection_latency()
+            return self._store_result(kind, opportunities)
+        finally:
+            if self._inflight.get(kind) is asyncio.current_task():
+                del self._inflight[kind]
+
+    async def _publish(self, kind: str, opportunities: List[Any]):
+        """
+        Публикует изменения относительно прошлой публикации: дельту, периодически полный снимок,
+        или ничего, если набор возможностей не изменился (тогда и версия результата для REST остается прежней,
+        если последний результат - это опубликованный в поток, а не пересчитанный по запросу с другим набором).
+        Текущий снимок хранится в хранилище (в Redis - ключ arbitrage:<вид>:snapshot) для ресинхронизации подписчиков.
+        """
+        stream = self._opportunity_streams[kind]
+        message = stream.update(opportunities)
+        latest = self._latest.get(kind)
+        if message is None and latest is not None and latest.version == self._stream_versions.get(kind):
+            self._latest[kind] = latest._replace(published_at=time.time(), opportunities=opportunities)
+            opportunity_stream_messages.labels(type=kind, message="suppressed").inc()
+            return
+        self._stream_versions[kind] = self._store_result(kind, opportunities).version
+        if message is None:
+            opportunity_stream_messages.labels(type=kind, message="suppressed").inc()
+            return
+        snapshot = message.data if message.type == "snapshot" else stream.snapshot_message()
+        # Канал публикуется через хранилище рыночных данных: pubsub Redis или получатели в памяти процесса
+        await data_processor.store.publish(f"arbitrage:{kind}", message.data, snapshot)
+        opportunity_stream_messages.labels(type=kind, message=message.type).inc()
+        opportunity_stream_bytes.labels(type=kind).inc(len(message.data))
+
+    async def _publish_cex_cex(self, opportunities: List[OpportunityCexCex]):
+        with arbitrage_stage_time.labels(stage="publish").time():
+            await self._publish("cex_cex", opportunities)
+
+    async def _publish_cex_cex_cex(self, opportunities: List[OpportunityCexCexCex]):
+        with arbitrage_stage_time.labels(stage="publish").time():
+            await self._publish("cex_cex_cex", opportunities)
+
     async def start_finding_loop(self):
         self._running = True
+        mode = settings.FINDER_MODE
+        if mode == "stream" and settings.MARKET_DATA_STORE != "redis":
+            # Стримы пишет только хранилище Redis; в памяти процесса обновления доступны инкрементальному режиму
+            logger.warning("FINDER_MODE=stream требует MARKET_DATA_STORE=redis, используется инкрементальный режим.")
+            mode = "incremental"
+        if mode == "incremental":
+            logger.info("Фоновый поиск арбитража запущен в инкрементальном режиме.")
+            self._tasks = [asyncio.create_task(self._incremental_loop(), name="incremental_arbitrage")]
+        elif mode == "stream":
+            logger.info("Фоновый поиск арбитража запущен в режиме чтения Redis Streams.")
+            self._tasks = [asyncio.create_task(self._stream_loop(), name="stream_arbitrage")]
+        else:
+            self._tasks = [asyncio.create_task(self._polling_loop(), name="polling_arbitrage")]
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _polling_loop(self):
         while self._running:
             try:
-                cex_cex_opps = await self.find_cex_cex_opportunities()
-                cex_cex_data = [
-                    {
-                        "pair": opp.pair,
-                        "buy_exchange": opp.buy_exchange,
-                        "sell_exchange": opp.sell_exchange,
-                        "buy_price": str(opp.buy_price),
-                        "sell_price": str(opp.sell_price),
-                        "profit_percent": str(opp.profit_percent),
-                        "volume_usd": str(opp.volume_usd) if opp.volume_usd else None
-                    } for opp in cex_cex_opps
-                ]
-                await self._redis_client.publish("arbitrage:cex_cex", json.dumps(cex_cex_data))
-
-                cex_cex_cex_opps = await self.find_cex_cex_cex_opportunities()
-                cex_cex_cex_data = [
-                    {
-                        "cycle": opp.cycle,
-                        "profit_percent": str(opp.profit_percent),
-                        "volume_usd": str(opp.volume_usd) if opp.volume_usd else None
-                    } for opp in cex_cex_cex_opps
-                ]
-                await self._redis_client.publish("arbitrage:cex_cex_cex", json.dumps(cex_cex_cex_data))
-
-                await asyncio.sleep(5)
+                # Один срез на оба вида поиска: один сетевой запрос вместо запроса на каждую комбинацию
+                snapshot = await self.get_market_snapshot()
+                cex_cex_opps = await self.find_cex_cex_opportunities(snapshot)
+                await self._publish_cex_cex(cex_cex_opps)
+
+                cex_cex_cex_opps = await self.find_cex_cex_cex_opportunities(snapshot)
+                await self._publish_cex_cex_cex(cex_cex_cex_opps)
+                self._observe_detection_latency()
+
+                await asyncio.sleep(settings.FINDER_POLL_INTERVAL)
             except Exception as e:
                 logger.error(f"Ошибка в фоновом поиске арбитража: {e}", exc_info=True)
-                await asyncio.sleep(5)
+                await asyncio.sleep(settings.FINDER_POLL_INTERVAL)
+
+    async def _incremental_loop(self):
+        """
+        Пересчитывает CEX-CEX по парам, рынки которых обновились, и треугольники из индекса,
+        затронутые этими рынками; изменения публикуются сразу.
+        """
+        coalesce_seconds = settings.FINDER_COALESCE_MS / 1000
+        try:
+            await self._full_recompute()
+        except Exception as e:
+            logger.error(f"Ошибка начального поиска арбитража в инкрементальном режиме: {e}", exc_info=True)
+
+        while self._running:
+            try:
+                dirty_markets = await self._wait_dirty_or_expired(coalesce_seconds)
+                if dirty_markets:
+                    await self._process_and_publish(dirty_markets)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка в инкрементальном поиске арбитража: {e}", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def _wait_dirty_or_expired(self, coalesce_seconds: float) -> Set[MarketKey]:
+        """Обновившиеся рынки; не дольше половины MAX_QUOTE_AGE_MS, чтобы вовремя добавить устаревшие."""
+        timeout = settings.MAX_QUOTE_AGE_MS / 2000 if settings.MAX_QUOTE_AGE_MS > 0 else None
+        try:
+            dirty_markets = await asyncio.wait_for(data_processor.wait_dirty_markets(coalesce_seconds), timeout)
+        except asyncio.TimeoutError:
+            dirty_markets = set()
+        return dirty_markets | self._expired_markets()
+
+    async def _stream_loop(self):
+        """
+        Инкрементальный поиск по Redis Streams: обновления читаются блокирующим XREAD с последнего ID
+        в состояние рынков в памяти, срезы для пересчета берутся из него без запросов к ключам Redis.
+        """
+        consumer = MarketStreamConsumer(settings.EXCHANGES)
+        try:
+            await consumer.bootstrap(self._market_keys(self._configured_pairs_by_exchange()))
+            self.set_market_source(consumer)
+            await self._full_recompute()
+        except Exception as e:
+            logger.error(f"Ошибка начального поиска арбитража в режиме стримов: {e}", exc_info=True)
+
+        try:
+            while self._running:
+                try:
+                    dirty_markets = await consumer.read(settings.MARKET_STREAM_BLOCK_MS) | self._expired_markets()
+                    if self._market_source is None:
+                        # Начальная загрузка не удалась - состояние стримов неполное, повторяем ее
+                        await consumer.bootstrap(self._market_keys(self._configured_pairs_by_exchange()))
+                        self.set_market_source(consumer)
+                        await self._full_recompute()
+                    elif dirty_markets:
+                        await self._process_and_publish(dirty_markets)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Ошибка в поиске арбитража по стримам: {e}", exc_info=True)
+                    await asyncio.sleep(1)
+        finally:
+            self.set_market_source(None)
+            await consumer.close()
+
+    async def _full_recompute(self):
+        """Начальное состояние: полный пересчет по всем парам и всем треугольникам."""
+        snapshot = await self.get_market_snapshot()
+        opportunities = await self.find_cex_cex_opportunities(snapshot)
+        self._cex_cex_by_pair = self._group_by_pair(opportunities)
+        await self._publish_cex_cex(opportunities)
+        self.rebuild_triangle_index(snapshot)
+        await self._publish_cex_cex_cex(self.current_cex_cex_cex_opportunities())
+        self._observe_detection_latency()
+
+    async def _process_and_publish(self, dirty_markets: Set[MarketKey]):
+        changed = await self.process_dirty_markets(dirty_markets)
+        if "cex_cex" in changed:
+            await self._publish_cex_cex(self.current_cex_cex_opportunities())
+        if "cex_cex_cex" in changed:
+            await self._publish_cex_cex_cex(self.current_cex_cex_cex_opportunities())
+        self._observe_detection_latency()
+
+    async def process_dirty_markets(self, dirty_markets: Set[MarketKey]) -> Set[str]:
+        """
+        Пересчитывает CEX-CEX возможности для пар из dirty_markets по всем биржам
+        и треугольники, в которых участвуют dirty_markets.
+        Возвращает виды арбитража ("cex_cex", "cex_cex_cex"), набор возможностей которых изменился.
+        """
+        changed: Set[str] = set()
+        if self._triangle_index.build(self._triangle_universe(), commissions_config.fee_table.version):
+            # Набор рынков изменился: индекс перестроен, треугольники пересчитываются полностью
+            self.rebuild_triangle_index(await self.get_market_snapshot())
+            changed.add("cex_cex_cex")
+
+        configured_pairs_by_exchange = self._configured_pairs_by_exchange()
+        pairs = {symbol for _, symbol in dirty_markets}
+        keys = [
+            (exchange_id, pair)
+            for exchange_id, configured_pairs in configured_pairs_by_exchange.items()
+            for pair in configured_pairs if pair in pairs
+        ]
+        if not keys:
+            return changed
+
+        snapshot = await self._load_snapshot(keys)
+        with arbitrage_search_time.labels(type="cex_cex_incremental").time(), arbitrage_stage_time.labels(stage="search").time():
+            opportunities = self._scan_cex_cex(snapshot, settings.EXCHANGES, configured_pairs_by_exchange, pairs)
+        updated = self._group_by_pair(opportunities)
+
+        added = 0
+        for pair in pairs:
+            new_opportunities = updated.get(pair, [])
+            old_opportunities = self._cex_cex_by_pair.get(pair, [])
+            if self._opportunity_keys(new_opportunities) != self._opportunity_keys(old_opportunities):
+                changed.add("cex_cex")
+            # Счетчик найденных - только возможности, которых не было после прошлого пересчета
+            added += len({opp.id for opp in new_opportunities} - {opp.id for opp in old_opportunities})
+            if new_opportunities:
+                self._cex_cex_by_pair[pair] = new_opportunities
+            else:
+                self._cex_cex_by_pair.pop(pair, None)
+        if added:
+            arbitrage_cex_cex_count.inc(added)
+
+        with arbitrage_search_time.labels(type="cex_cex_cex_incremental").time():
+            with arbitrage_stage_time.labels(stage="graph_build").time():
+                for market in dirty_markets:
+                    self._update_triangle_market(snapshot, market)
+            with arbitrage_stage_time.labels(stage="search").time():
+                if self._evaluate_triangles(self._triangle_index.triangles_for_markets(dirty_markets)):
+                    changed.add("cex_cex_cex")
+        return changed
+
+    def rebuild_triangle_index(self, snapshot: MarketSnapshot):
+        """Строит индекс треугольников (если изменился набор рынков), загружает цены из среза и считает все треугольники."""
+        index = self._triangle_index
+        with arbitrage_stage_time.labels(stage="graph_build").time():
+            if index.build(self._triangle_universe(), commissions_config.fee_table.version):
+                logger.info(f"Индекс треугольников перестроен: {len(index)} треугольников по {len(index.markets)} рынкам.")
+            arbitrage_triangle_index_size.set(len(index))
+            self._books = {}
+            for market in index.markets:
+                self._update_triangle_market(snapshot, market)
+        # Номера треугольников после перестройки индекса другие: прежние возможности сравниваются по id
+        known_ids = {opp.id for opp in self._triangles_found.values()}
+        self._triangles_found = {}
+        with arbitrage_stage_time.labels(stage="search").time():
+            self._evaluate_triangles(np.arange(len(index), dtype=np.int32), known_ids)
+
+    def _update_triangle_market(self, snapshot: MarketSnapshot, market: MarketKey):
+        orderbook_data = snapshot.get_orderbook(*market) or {}
+        book = snapshot.get_book(*market, settings.ORDERBOOK_DEPTH)
+        if book is not None:
+            self._books[market] = book
+        else:
+            self._books.pop(market, None)
+        self._triangle_index.update_market(
+            market,
+            ask=float(orderbook_data.get('ask') or 0),
+            bid=float(orderbook_data.get('bid') or 0),
+            ask_volume=float(orderbook_data.get('askVolume') or 0),
+            bid_volume=float(orderbook_data.get('bidVolume') or 0),
+        )
+
+    def _evaluate_triangles(self, triangle_ids: np.ndarray, known_ids: Optional[Set[str]] = None) -> bool:
+        """
+        Пересчитывает заданные треугольники; возвращает True, если набор треугольных возможностей изменился.
+        known_ids - id возможностей, уже учтенных счетчиком найденных помимо текущего набора.
+        """
+        if len(triangle_ids) == 0:
+            return False
+        index = self._triangle_index
+        profits = index.evaluate(triangle_ids)
+        profitable = profits >= float(self._min_profit_percent)
+
+        changed = False
+        added = 0
+        found = self._triangles_found
+        for triangle_id in triangle_ids[~profitable]:
+            if found.pop(int(triangle_id), None) is not None:
+                changed = True
+        for triangle_id, profit_percent in zip(triangle_ids[profitable], profits[profitable]):
+            triangle_id = int(triangle_id)
+            profit_percent = Decimal(str(float(profit_percent)))
+            cycle = index.cycle(triangle_id)
+            volume_usd, net_profit_percent = cycle_depth(
+                cycle, lambda exchange_id, pair: self._books.get((exchange_id, pair)), self._float_fee_rates
+            )
+            if volume_usd is None:
+                volume_usd = index.volume_usd(triangle_id)
+            volume_usd, net_profit_percent = _to_decimal(volume_usd), _to_decimal(net_profit_percent)
+            previous = found.get(triangle_id)
+            if (previous is not None and previous.profit_percent == profit_percent
+                    and previous.volume_usd == volume_usd and previous.net_profit_percent == net_profit_percent):
+                continue
+            opportunity = OpportunityCexCexCex(
+                cycle=cycle, profit_percent=profit_percent, volume_usd=volume_usd, net_profit_percent=net_profit_percent
+            )
+            # Обновление цены уже найденного треугольника - не новая возможность
+            if previous is None and (known_ids is None or opportunity.id not in known_ids):
+                added += 1
+            found[triangle_id] = opportunity
+            changed = True
+        if added:
+            arbitrage_cex_cex_cex_count.inc(added)
+        return changed
+
+    def current_cex_cex_cex_opportunities(self) -> List[OpportunityCexCexCex]:
+        opportunities = list(self._triangles_found.values())
+        opportunities.sort(key=lambda opp: opp.profit_percent, reverse=True)
+        return opportunities
+
+    def current_cex_cex_opportunities(self) -> List[OpportunityCexCex]:
+        opportunities = [opp for pair_opportunities in self._cex_cex_by_pair.values() for opp in pair_opportunities]
+        opportunities.sort(key=lambda opp: opp.profit_percent, reverse=True)
+        return opportunities
+
+    @staticmethod
+    def _group_by_pair(opportunities: List[OpportunityCexCex]) -> Dict[str, List[OpportunityCexCex]]:
+        by_pair: Dict[str, List[OpportunityCexCex]] = {}
+        for opp in opportunities:
+            by_pair.setdefault(opp.pair, []).append(opp)
+        return by_pair
+
+    @staticmethod
+    def _opportunity_keys(opportunities: List[OpportunityCexCex]) -> Set[Tuple[Any, ...]]:
+        return {
+            (opp.buy_exchange, opp.sell_exchange, opp.buy_price, opp.sell_price, opp.profit_percent, opp.volume_usd,
+             opp.max_size, opp.net_profit_percent)
+            for opp in opportunities
+        }
 
     async def stop_finding_loop(self):
         self._running = False
-        await self._redis_client.close()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._scan_executor.shutdown()
 
 arbitrage_finder = ArbitrageFinder()
\ No newline at end of file
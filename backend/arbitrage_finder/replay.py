@@ -0,0 +1,164 @@
+# backend/arbitrage_finder/replay.py
+"""
+Воспроизведение журнала рыночных данных (data_processor/recorder.py) через инкрементальный поиск.
+
+    python -m backend.arbitrage_finder.replay <директория или сегмент> [--speed 1|10|max] [--output opportunities.jsonl]
+
+Обновления объединяются в пачки по времени записи (окно FINDER_COALESCE_MS, как в инкрементальном режиме),
+после каждой пачки пересчитываются затронутые пары и треугольники. Пачки определяются только временем
+записи, поэтому при любой скорости результат одинаков: один и тот же журнал с теми же комиссиями дает
+побайтно тот же вывод. Это позволяет профилировать поиск и сравнивать изменения на реальном трафике.
+Вывод - JSON Lines: {"t": время пачки (мс), "kind": вид, "opportunities": [...]} при каждом изменении набора.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, Any, Iterable, Iterator, List, NamedTuple, Optional
+
+import orjson
+
+from backend.core.config import settings
+from backend.core.types import MarketKey, MarketSnapshot
+from backend.data_processor.recorder import RecordedUpdate, read_recording
+from backend.arbitrage_finder.finder import ArbitrageFinder
+from backend.utils.logger import logger
+
+
+class ReplayMarketState:
+    """Последние стаканы и тикеры воспроизводимого журнала; источник срезов для ArbitrageFinder."""
+
+    def __init__(self):
+        self._orderbooks: Dict[MarketKey, Dict[str, Any]] = {}
+        self._tickers: Dict[MarketKey, Dict[str, Any]] = {}
+
+    def apply(self, update: RecordedUpdate):
+        records = self._orderbooks if update.kind == "orderbook" else self._tickers
+        records[update.market] = update.decode()
+
+    def snapshot(self, keys: Optional[Iterable[MarketKey]] = None) -> MarketSnapshot:
+        if keys is None:
+            return MarketSnapshot(self._orderbooks, self._tickers)
+        keys = list(keys)
+        return MarketSnapshot(
+            {key: self._orderbooks[key] for key in keys if key in self._orderbooks},
+            {key: self._tickers[key] for key in keys if key in self._tickers},
+        )
+
+
+class ReplayResult(NamedTuple):
+    updates: int
+    batches: int
+    opportunity_events: int
+    # Длительность воспроизведения и записанного интервала, секунды
+    wall_seconds: float
+    recorded_seconds: float
+    # Время пересчета одной пачки, миллисекунды
+    scan_p50_ms: float
+    scan_p99_ms: float
+
+
+def _batches(updates: Iterator[RecordedUpdate], window_ms: float) -> Iterator[List[RecordedUpdate]]:
+    """Пачки обновлений: от первого обновления пачки не дальше window_ms по времени записи."""
+    batch: List[RecordedUpdate] = []
+    for update in updates:
+        if batch and update.recorded_at - batch[0].recorded_at > window_ms:
+            yield batch
+            batch = []
+        batch.append(update)
+    if batch:
+        yield batch
+
+
+async def replay(source: Path, speed: Optional[float] = None, window_ms: Optional[float] = None,
+                 output: Optional[BinaryIO] = None) -> ReplayResult:
+    """
+    Воспроизводит журнал source через новый экземпляр поиска.
+    speed - во сколько раз быстрее записи (1.0 - в реальном времени), None - без пауз, так быстро, как возможно.
+    """
+    window_ms = settings.FINDER_COALESCE_MS if window_ms is None else window_ms
+    finder = ArbitrageFinder()
+    state = ReplayMarketState()
+    finder.set_market_source(state, live=False)
+    published: Dict[str, List[bytes]] = {"cex_cex": [], "cex_cex_cex": []}
+    scan_times: List[float] = []
+    updates = batches = events = 0
+    first_recorded_at = last_recorded_at = None
+    started = time.monotonic()
+    try:
+        for batch in _batches(read_recording(source), window_ms):
+            batch_time = batch[0].recorded_at
+            if first_recorded_at is None:
+                first_recorded_at = batch_time
+            last_recorded_at = batch[-1].recorded_at
+            if speed is not None:
+                delay = (batch_time - first_recorded_at) / 1000 / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            for update in batch:
+                state.apply(update)
+            scan_started = time.perf_counter()
+            changed = await finder.process_dirty_markets({update.market for update in batch})
+            scan_times.append((time.perf_counter() - scan_started) * 1000)
+            updates += len(batch)
+            batches += 1
+            for kind in ("cex_cex", "cex_cex_cex"):
+                if kind not in changed:
+                    continue
+                opportunities = (finder.current_cex_cex_opportunities() if kind == "cex_cex"
+                                 else finder.current_cex_cex_cex_opportunities())
+                encoded = [opp.to_json() for opp in opportunities]
+                # Перестроение индекса треугольников помечает их измененными и без новых возможностей
+                if encoded == published[kind]:
+                    continue
+                published[kind] = encoded
+                events += 1
+                if output is not None:
+                    output.write(b"".join((
+                        orjson.dumps({"t": batch_time, "kind": kind})[:-1],
+                        b',"opportunities":[', b",".join(encoded), b"]}\n",
+                    )))
+    finally:
+        finder.set_market_source(None)
+        await finder.stop_finding_loop()
+    recorded_seconds = ((last_recorded_at - first_recorded_at) / 1000) if first_recorded_at is not None else 0.0
+    return ReplayResult(
+        updates=updates,
+        batches=batches,
+        opportunity_events=events,
+        wall_seconds=time.monotonic() - started,
+        recorded_seconds=recorded_seconds,
+        scan_p50_ms=statistics.median(scan_times) if scan_times else 0.0,
+        scan_p99_ms=sorted(scan_times)[int(0.99 * (len(scan_times) - 1))] if scan_times else 0.0,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Воспроизведение журнала рыночных данных через поиск арбитража")
+    parser.add_argument("source", type=Path, help="директория журнала или отдельный сегмент")
+    parser.add_argument("--speed", default="max", help="скорость относительно записи (1 - реальное время) или max")
+    parser.add_argument("--window-ms", type=float, default=None, help="окно объединения обновлений в пачку, мс")
+    parser.add_argument("--output", type=Path, default=None, help="файл для найденных возможностей (JSON Lines)")
+    args = parser.parse_args(argv)
+    speed = None if args.speed == "max" else float(args.speed)
+    if speed is not None and speed <= 0:
+        parser.error("--speed должен быть больше 0 или max")
+
+    output = open(args.output, "wb") if args.output is not None else None
+    try:
+        result = asyncio.run(replay(args.source, speed=speed, window_ms=args.window_ms, output=output))
+    finally:
+        if output is not None:
+            output.close()
+    logger.info(
+        f"Воспроизведено {result.updates} обновлений ({result.recorded_seconds:.1f} с записи) за {result.wall_seconds:.1f} с: "
+        f"{result.batches} пачек, {result.opportunity_events} изменений возможностей, "
+        f"пересчет пачки p50 {result.scan_p50_ms:.2f} мс, p99 {result.scan_p99_ms:.2f} мс."
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# backend/arbitrage_finder/triangles.py
+from typing import List, Dict, Optional, Tuple, Callable, Iterable
+
+import numpy as np
+
+from backend.core.constants import USD_QUOTE_CURRENCIES
+from backend.core.types import MarketKey
+
+BUY = 0
+SELL = 1
+_ACTIONS = ('buy', 'sell')
+
+# (индекс треугольника, прибыль в процентах)
+TriangleResult = Tuple[int, float]
+
+
+class TriangleIndex:
+    """
+    Индекс всех треугольников из трех сделок (биржа, пара, направление).
+
+    Строится один раз по набору рынков. Нога кодируется целым числом market_id * 2 + направление
+    (0 - покупка base за quote, 1 - продажа base за quote), треугольник - строка из трех ног
+    в массиве int32. Для каждого рынка хранится список треугольников, в которых он участвует,
+    поэтому при обновлении стакана пересчитываются только затронутые треугольники.
+    """
+
+    def __init__(self, fee_rates: Callable[[str, str], Tuple[float, float]]):
+        # fee_rates(exchange_id, pair) -> (taker_buy_rate, taker_sell_rate) в долях
+        self._fee_rates = fee_rates
+        self._universe: Optional[Tuple[Tuple[Tuple[str, Tuple[str, ...]], ...], int]] = None
+        self.markets: List[MarketKey] = []
+        self._market_ids: Dict[MarketKey, int] = {}
+        self.triangles = np.zeros((0, 3), dtype=np.int32)
+        # CSR: треугольники рынка m - _market_triangles[_market_offsets[m]:_market_offsets[m + 1]]
+        self._market_offsets = np.zeros(1, dtype=np.int64)
+        self._market_triangles = np.zeros(0, dtype=np.int32)
+        # Текущие данные по ногам
+        self._fee_factor = np.zeros(0)
+        self._leg_rate = np.zeros(0)
+        self._leg_price = np.zeros(0)
+        self._leg_volume = np.zeros(0)
+        self._leg_usd_quote = np.zeros(0, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.triangles)
+
+    def build(self, universe: Dict[str, List[str]], fee_version: int = 0) -> bool:
+        """
+        Перестраивает индекс по набору {биржа: [пары]}.
+        Ничего не делает и возвращает False, если набор рынков и версия комиссий не изменились.
+        """
+        markets_key = tuple(sorted((exchange_id, tuple(sorted(pairs))) for exchange_id, pairs in universe.items()))
+        universe_key = (markets_key, fee_version)
+        if universe_key == self._universe:
+            return False
+
+        markets: List[MarketKey] = [(exchange_id, pair) for exchange_id, pairs in markets_key for pair in pairs]
+        currency_index: Dict[str, int] = {}
+        fee_factor = np.zeros(2 * len(markets))
+        usd_quote = np.zeros(2 * len(markets), dtype=bool)
+        # Ноги, сгруппированные по направленному ребру валют (откуда, куда)
+        legs_by_edge: Dict[Tuple[int, int], List[int]] = {}
+        for market_id, (exchange_id, pair) in enumerate(markets):
+            base, quote = pair.split('/')
+            base_index = currency_index.setdefault(base, len(currency_index))
+            quote_index = currency_index.setdefault(quote, len(currency_index))
+            buy_fee, sell_fee = self._fee_rates(exchange_id, pair)
+            buy_leg, sell_leg = 2 * market_id + BUY, 2 * market_id + SELL
+            fee_factor[buy_leg] = 1 - buy_fee
+            fee_factor[sell_leg] = 1 - sell_fee
+            usd_quote[buy_leg] = usd_quote[sell_leg] = quote in USD_QUOTE_CURRENCIES
+            legs_by_edge.setdefault((quote_index, base_index), []).append(buy_leg)
+            legs_by_edge.setdefault((base_index, quote_index), []).append(sell_leg)
+
+        successors: Dict[int, List[int]] = {}
+        for source, target in legs_by_edge:
+            successors.setdefault(source, []).append(target)
+
+        # Каждый направленный цикл валют a -> b -> c -> a берем один раз: a - минимальная валюта цикла
+        blocks: List[np.ndarray] = []
+        for a, a_targets in successors.items():
+            for b in a_targets:
+                if b <= a:
+                    continue
+                for c in successors.get(b, []):
+                    if c <= a or c == b or (c, a) not in legs_by_edge:
+                        continue
+                    grid = np.meshgrid(
+                        legs_by_edge[(a, b)], legs_by_edge[(b, c)], legs_by_edge[(c, a)], indexing='ij'
+                    )
+                    blocks.append(np.stack([axis.ravel() for axis in grid], axis=1).astype(np.int32))
+        triangles = np.concatenate(blocks) if blocks else np.zeros((0, 3), dtype=np.int32)
+
+        # CSR индекс рынок -> треугольники
+        market_of_leg = (triangles // 2).ravel()
+        triangle_of_leg = np.repeat(np.arange(len(triangles), dtype=np.int32), 3)
+        order = np.argsort(market_of_leg, kind='stable')
+        counts = np.bincount(market_of_leg, minlength=len(markets))
+        offsets = np.zeros(len(markets) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        self._universe = universe_key
+        self.markets = markets
+        self._market_ids = {market: market_id for market_id, market in enumerate(markets)}
+        self.triangles = triangles
+        self._market_offsets = offsets
+        self._market_triangles = triangle_of_leg[order]
+        self._fee_factor = fee_factor
+        self._leg_rate = np.zeros(2 * len(markets))
+        self._leg_price = np.zeros(2 * len(markets))
+        self._leg_volume = np.zeros(2 * len(markets))
+        self._leg_usd_quote = usd_quote
+        return True
+
+    def update_market(self, market: MarketKey, ask: float, bid: float, ask_volume: float = 0.0, bid_volume: float = 0.0) -> bool:
+        """Обновляет курсы ног рынка; возвращает False, если рынок не входит в индекс."""
+        market_id = self._market_ids.get(market)
+        if market_id is None:
+            return False
+        buy_leg, sell_leg = 2 * market_id + BUY, 2 * market_id + SELL
+        self._leg_rate[buy_leg] = self._fee_factor[buy_leg] / ask if ask > 0 else 0.0
+        self._leg_rate[sell_leg] = bid * self._fee_factor[sell_leg] if bid > 0 else 0.0
+        self._leg_price[buy_leg], self._leg_volume[buy_leg] = ask, ask_volume
+        self._leg_price[sell_leg], self._leg_volume[sell_leg] = bid, bid_volume
+        return True
+
+    def triangles_for_markets(self, markets: Iterable[MarketKey]) -> np.ndarray:
+        """Индексы треугольников, в которых участвует хотя бы один из рынков."""
+        chunks = []
+        for market in markets:
+            market_id = self._market_ids.get(market)
+            if market_id is not None:
+                chunks.append(self._market_triangles[self._market_offsets[market_id]:self._market_offsets[market_id + 1]])
+        if not chunks:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(chunks))
+
+    def evaluate(self, triangle_ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """Прибыль треугольников в процентах (произведение курсов трех ног - 1); для всех, если ids не заданы."""
+        legs = self.triangles if triangle_ids is None else self.triangles[triangle_ids]
+        rates = self._leg_rate[legs]
+        return (rates[:, 0] * rates[:, 1] * rates[:, 2] - 1.0) * 100.0
+
+    def cycle(self, triangle_id: int) -> List[Tuple[str, str, str]]:
+        """Треугольник в виде [(биржа, пара, действие), ...]."""
+        result = []
+        for leg in self.triangles[triangle_id]:
+            exchange_id, pair = self.markets[leg // 2]
+            result.append((exchange_id, pair, _ACTIONS[leg % 2]))
+        return result
+
+    def volume_usd(self, triangle_id: int) -> Optional[float]:
+        """Оценка объема по ногам, котируемым в долларовых стейблкоинах."""
+        legs = self.triangles[triangle_id]
+        notionals = [
+            float(self._leg_price[leg] * self._leg_volume[leg])
+            for leg in legs if self._leg_usd_quote[leg] and self._leg_volume[leg] > 0
+        ]
+        return min(notionals) if notionals else None
@@ -0,0 +1,170 @@
+# backend/arbitrage_finder/vectorized.py
+from typing import List, Dict, Optional, Tuple, Callable, Iterable
+
+import numpy as np
+
+from backend.core.types import MarketKey, MarketSnapshot
+
+# (pair, buy_exchange, sell_exchange, buy_price, sell_price, profit_percent, volume_usd)
+VectorizedCexCexResult = Tuple[str, str, str, float, float, float, Optional[float]]
+
+_BOOK_FIELDS = ('ask', 'bid', 'askVolume', 'bidVolume')
+
+
+class VectorizedCexCexEngine:
+    """
+    CEX-CEX поиск на матрицах (биржи x пары).
+    Лучшие ask/bid, объемы и taker комиссии хранятся плотными массивами numpy,
+    а чистые спреды всех комбинаций покупка/продажа считаются одной broadcast операцией.
+    """
+
+    def __init__(self, fee_rates: Callable[[str, str], Tuple[float, float]]):
+        # fee_rates(exchange_id, pair) -> (taker_buy_rate, taker_sell_rate) в долях
+        self._fee_rates = fee_rates
+        self._universe: Optional[Tuple[Tuple[str, ...], Tuple[Tuple[str, ...], ...], int]] = None
+        self._exchanges: List[str] = []
+        self._pairs: List[str] = []
+        self._pair_index: Dict[str, int] = {}
+        self._keys_by_pair: List[List[Tuple[int, MarketKey]]] = []
+        self._keys: List[MarketKey] = []
+        self._flat_index = np.zeros(0, dtype=np.intp)
+        self._configured = np.zeros((0, 0), dtype=bool)
+        self._buy_fee = np.zeros((0, 0))
+        self._sell_fee = np.zeros((0, 0))
+        self._not_same_exchange = np.zeros((0, 0, 1), dtype=bool)
+
+    def _ensure_universe(self, exchanges: List[str], configured_pairs_by_exchange: Dict[str, List[str]],
+                         fee_version: int = 0):
+        """Перестраивает индексы и матрицы комиссий только при изменении набора бирж/пар или версии комиссий."""
+        universe = (
+            tuple(exchanges),
+            tuple(tuple(configured_pairs_by_exchange.get(exc, [])) for exc in exchanges),
+            fee_version,
+        )
+        if universe == self._universe:
+            return
+
+        pairs = sorted({pair for exc in exchanges for pair in configured_pairs_by_exchange.get(exc, [])})
+        pair_index = {pair: i for i, pair in enumerate(pairs)}
+        shape = (len(exchanges), len(pairs))
+
+        configured = np.zeros(shape, dtype=bool)
+        buy_fee = np.zeros(shape)
+        sell_fee = np.zeros(shape)
+        keys: List[MarketKey] = []
+        flat_index: List[int] = []
+        keys_by_pair: List[List[Tuple[int, MarketKey]]] = [[] for _ in pairs]
+        for e, exchange_id in enumerate(exchanges):
+            for pair in configured_pairs_by_exchange.get(exchange_id, []):
+                p = pair_index[pair]
+                configured[e, p] = True
+                buy_fee[e, p], sell_fee[e, p] = self._fee_rates(exchange_id, pair)
+                keys.append((exchange_id, pair))
+                flat_index.append(e * len(pairs) + p)
+                keys_by_pair[p].append((e, (exchange_id, pair)))
+
+        self._universe = universe
+        self._exchanges = list(exchanges)
+        self._pairs = pairs
+        self._pair_index = pair_index
+        self._keys_by_pair = keys_by_pair
+        self._keys = keys
+        self._flat_index = np.array(flat_index, dtype=np.intp)
+        self._configured = configured
+        self._buy_fee = buy_fee
+        self._sell_fee = sell_fee
+        self._not_same_exchange = ~np.eye(len(exchanges), dtype=bool)[:, :, None]
+
+    @staticmethod
+    def _load_prices(snapshot: MarketSnapshot, keys: List[MarketKey], flat_index: np.ndarray,
+                     shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Заполняет матрицы цен и объемов из среза: по одному проходу на поле и запись по плоским индексам."""
+        orderbooks = snapshot.orderbooks
+        tickers = snapshot.tickers
+        books: List[Dict] = []
+        for key in keys:
+            orderbook = orderbooks.get(key)
+            if orderbook:
+                books.append(orderbook)
+                continue
+            # Как и в Decimal реализации: без стакана берем цену из тикера, объем считаем нулевым
+            ticker = tickers.get(key)
+            books.append({'ask': ticker.get('ask'), 'bid': ticker.get('bid')} if ticker else {})
+
+        count = len(books)
+        matrices = []
+        for field in _BOOK_FIELDS:
+            matrix = np.zeros(shape)
+            matrix.flat[flat_index] = np.fromiter(
+                [book.get(field) or 0 for book in books], dtype=float, count=count
+            )
+            matrices.append(matrix)
+        ask, bid, ask_volume, bid_volume = matrices
+        return ask, bid, ask_volume, bid_volume
+
+    def _select_pairs(self, pairs: Iterable[str]) -> Tuple[np.ndarray, List[MarketKey], np.ndarray]:
+        """Возвращает колонки, ключи и плоские индексы подматрицы для подмножества пар."""
+        columns = sorted({self._pair_index[pair] for pair in pairs if pair in self._pair_index})
+        keys: List[MarketKey] = []
+        flat_index: List[int] = []
+        for position, column in enumerate(columns):
+            for e, key in self._keys_by_pair[column]:
+                keys.append(key)
+                flat_index.append(e * len(columns) + position)
+        return np.array(columns, dtype=np.intp), keys, np.array(flat_index, dtype=np.intp)
+
+    def scan(self, snapshot: MarketSnapshot, exchanges: List[str],
+             configured_pairs_by_exchange: Dict[str, List[str]],
+             min_profit_percent: float, pairs: Optional[Iterable[str]] = None,
+             fee_version: int = 0) -> List[VectorizedCexCexResult]:
+        """
+        Считает все CEX-CEX возможности по срезу.
+        Если передан pairs, пересчитываются только колонки этих пар (инкрементальный режим).
+        Смена fee_version (перезагрузка комиссий) перестраивает матрицы комиссий.
+        """
+        self._ensure_universe(exchanges, configured_pairs_by_exchange, fee_version)
+        if not self._keys:
+            return []
+
+        if pairs is None:
+            columns = np.arange(len(self._pairs), dtype=np.intp)
+            keys, flat_index = self._keys, self._flat_index
+        else:
+            columns, keys, flat_index = self._select_pairs(pairs)
+            if not keys:
+                return []
+
+        configured = self._configured[:, columns]
+        buy_fee = self._buy_fee[:, columns]
+        sell_fee = self._sell_fee[:, columns]
+        ask, bid, ask_volume, bid_volume = self._load_prices(snapshot, keys, flat_index, configured.shape)
+        cost = ask * (1.0 + buy_fee)
+        revenue = bid * (1.0 - sell_fee)
+        can_buy = configured & (ask > 0)
+        can_sell = configured & (bid > 0)
+
+        # Оси: [биржа покупки, биржа продажи, пара]
+        spread = revenue[None, :, :] - cost[:, None, :]
+        cost_b = np.broadcast_to(cost[:, None, :], spread.shape)
+        profit = np.divide(spread, cost_b, out=np.zeros_like(spread), where=cost_b > 0) * 100.0
+        mask = (
+            can_buy[:, None, :] & can_sell[None, :, :] & self._not_same_exchange
+            & (spread > 0) & (profit >= min_profit_percent)
+        )
+
+        results: List[VectorizedCexCexResult] = []
+        for b, s, p in zip(*np.nonzero(mask)):
+            buy_ask = float(ask[b, p])
+            sell_bid = float(bid[s, p])
+            available_volume = min(float(ask_volume[b, p]), float(bid_volume[s, p]))
+            volume_usd = available_volume * (buy_ask + sell_bid) / 2 if available_volume > 0 else None
+            results.append((
+                self._pairs[columns[p]],
+                self._exchanges[b],
+                self._exchanges[s],
+                buy_ask,
+                sell_bid,
+                float(profit[b, s, p]),
+                volume_usd,
+            ))
+        return results
@@ -1,11 +1,15 @@
 # backend/core/config.py
 
+import asyncio
 import json
 import os
+import sys
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, NamedTuple, Tuple
 from dotenv import load_dotenv
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+
+from backend.utils.logger import logger
 
 # Загружаем переменные окружения из .env файла
 load_dotenv()
@@ -15,37 +19,193 @@ BASE_DIR = Path(__file__).resolve().parent.parent.parent
 CONFIG_DIR = BASE_DIR / "backend" / "config"
 COMMISSIONS_DIR = CONFIG_DIR / "commissions"
 
+def parse_commission_rate(commission_str: Optional[str]) -> Decimal:
+    """Переводит строку комиссии вида "0.1%" в долю (Decimal("0.001")); нераспознанные значения - 0."""
+    if commission_str is None:
+        return Decimal(0)
+    try:
+        if commission_str.endswith('%'):
+            return Decimal(commission_str[:-1].strip()) / Decimal(100)
+        return Decimal(0)
+    except (InvalidOperation, ValueError):
+        logger.warning(f"Не удалось распарсить строку комиссии: '{commission_str}'. Считаем 0%.")
+        return Decimal(0)
+
+
+class FeeRates(NamedTuple):
+    """Taker комиссии рынка в долях: Decimal для эталонных расчетов и float для numpy движков."""
+    taker_buy: Decimal
+    taker_sell: Decimal
+    taker_buy_float: float
+    taker_sell_float: float
+
+
+_ZERO_FEE_RATES = FeeRates(Decimal(0), Decimal(0), 0.0, 0.0)
+
+
+class FeeTable:
+    """
+    Скомпилированная таблица комиссий.
+    Строки комиссий разобраны один раз, биржи и символы интернированы и пронумерованы,
+    taker_sell_rate уже откачен на taker_order_rate. Таблица неизменяема: при перезагрузке
+    конфигурации собирается новая и подменяется целиком.
+    """
+    __slots__ = ("version", "exchange_ids", "symbol_ids", "_rates", "_symbols_by_exchange")
+
+    def __init__(self, data: Dict[str, Dict[str, Dict[str, str]]], version: int = 0):
+        self.version = version
+        self.exchange_ids: Dict[str, int] = {}
+        self.symbol_ids: Dict[str, int] = {}
+        self._rates: Dict[Tuple[int, int], FeeRates] = {}
+        self._symbols_by_exchange: Dict[str, Tuple[str, ...]] = {}
+        for exchange, symbols in data.items():
+            exchange = sys.intern(exchange.lower())
+            exchange_id = self.exchange_ids.setdefault(exchange, len(self.exchange_ids))
+            exchange_symbols = []
+            for symbol, commissions in symbols.items():
+                symbol = sys.intern(symbol.upper())
+                symbol_id = self.symbol_ids.setdefault(symbol, len(self.symbol_ids))
+                exchange_symbols.append(symbol)
+                taker_buy = parse_commission_rate(commissions.get('taker_buy_rate'))
+                taker_sell = parse_commission_rate(
+                    commissions.get('taker_sell_rate') or commissions.get('taker_order_rate')
+                )
+                self._rates[(exchange_id, symbol_id)] = FeeRates(taker_buy, taker_sell, float(taker_buy), float(taker_sell))
+            self._symbols_by_exchange[exchange] = tuple(exchange_symbols)
+
+    def rates(self, exchange: str, symbol: str) -> FeeRates:
+        """Комиссии рынка; для ненастроенного рынка - нулевые, как и раньше при отсутствии строки комиссии."""
+        exchange_id = self.exchange_ids.get(exchange)
+        if exchange_id is None:
+            exchange_id = self.exchange_ids.get(exchange.lower())
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.symbol_ids.get(symbol.upper())
+        if exchange_id is None or symbol_id is None:
+            return _ZERO_FEE_RATES
+        return self._rates.get((exchange_id, symbol_id), _ZERO_FEE_RATES)
+
+    def symbols(self, exchange: str) -> Tuple[str, ...]:
+        return self._symbols_by_exchange.get(exchange.lower(), ())
+
+
 # --- Класс для загрузки и хранения комиссий ---
 class CommissionsConfig:
-    """Хранит загруженные данные по комиссиям."""
-    def __init__(self):
+    """Хранит загруженные данные по комиссиям и скомпилированную из них таблицу FeeTable."""
+    def __init__(self, commissions_dir: Path = COMMISSIONS_DIR):
+        self._commissions_dir = commissions_dir
         self._data: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self._fee_table = FeeTable({})
+        self._mtimes: Dict[str, float] = {}
         self._load_commissions()
 
-    def _load_commissions(self):
-        """Загружает комиссии из JSON файлов в директории config/commissions/."""
-        print(f"Загрузка комиссий из директории: {COMMISSIONS_DIR}")
+    @property
+    def fee_table(self) -> FeeTable:
+        return self._fee_table
 
-        if not COMMISSIONS_DIR.exists():
-            print(f"Внимание: Директория комиссий не найдена: {COMMISSIONS_DIR}")
-            return
+    def _file_mtimes(self) -> Dict[str, float]:
+        if not self._commissions_dir.exists():
+            return {}
+        mtimes = {}
+        for file_path in self._commissions_dir.glob("*.json"):
+            try:
+                mtimes[str(file_path)] = file_path.stat().st_mtime
+            except OSError:
+                continue
+        return mtimes
 
-        for file_path in COMMISSIONS_DIR.glob("*.json"):
+    def _read_commissions(self) -> Tuple[Dict[str, Dict[str, Dict[str, str]]], Dict[str, float]]:
+        """
+        Читает комиссии из JSON файлов в директории config/commissions/; возвращает данные и время изменения файлов.
+        Для файла, который не удалось прочитать (например, записан не до конца), сохраняются прежние комиссии
+        биржи и прежнее время изменения: файл перечитывается при следующей проверке, а пары биржи не пропадают.
+        """
+        data: Dict[str, Dict[str, Dict[str, str]]] = {}
+        mtimes = self._file_mtimes()
+        print(f"Загрузка комиссий из директории: {self._commissions_dir}")
+
+        if not self._commissions_dir.exists():
+            print(f"Внимание: Директория комиссий не найдена: {self._commissions_dir}")
+            return data, mtimes
+
+        for file_path in self._commissions_dir.glob("*.json"):
             exchange_name = file_path.stem.lower()
             try:
                 with open(file_path, 'r', encoding='utf-8') as f:
                     exchange_commissions = json.load(f)
-                    self._data[exchange_name] = exchange_commissions
-                    print(f"  Загружены комиссии для биржи: {exchange_name.upper()}")
+                if not isinstance(exchange_commissions, dict):
+                    raise ValueError("ожидается объект пар")
+                data[exchange_name] = exchange_commissions
+                print(f"  Загружены комиссии для биржи: {exchange_name.upper()}")
+                continue
             except FileNotFoundError:
+                # Файл удален во время чтения - биржа удаляется, как при удалении до проверки
                 print(f"  Ошибка: Файл комиссий не найден для биржи {exchange_name.upper()}")
+                mtimes.pop(str(file_path), None)
+                continue
             except json.JSONDecodeError:
                 print(f"  Ошибка: Некорректный JSON в файле {file_path}")
             except Exception as e:
                 print(f"  Неизвестная ошибка при загрузке комиссий из {file_path}: {e}")
+            self._keep_previous(file_path, exchange_name, data, mtimes)
 
-        if not self._data:
+        if not data:
              print("Внимание: Не загружено ни одной комиссии для бирж.")
+        return data, mtimes
+
+    def _keep_previous(self, file_path: Path, exchange_name: str, data: Dict[str, Dict[str, Dict[str, str]]],
+                       mtimes: Dict[str, float]):
+        if exchange_name in self._data:
+            data[exchange_name] = self._data[exchange_name]
+            print(f"  Для биржи {exchange_name.upper()} сохранены ранее загруженные комиссии")
+        previous_mtime = self._mtimes.get(str(file_path))
+        if previous_mtime is None:
+            mtimes.pop(str(file_path), None)
+        else:
+            mtimes[str(file_path)] = previous_mtime
+
+    def _apply(self, data: Dict[str, Dict[str, Dict[str, str]]], mtimes: Dict[str, float]) -> bool:
+        """Подменяет данные и таблицу вместе; при неизменившихся данных таблица (и ее версия) остается прежней."""
+        if data == self._data:
+            self._mtimes = mtimes
+            return False
+        fee_table = FeeTable(data, version=self._fee_table.version + 1)
+        self._data, self._fee_table, self._mtimes = data, fee_table, mtimes
+        return True
+
+    def _load_commissions(self):
+        """Загружает комиссии и компилирует таблицу."""
+        self._apply(*self._read_commissions())
+
+    def set_directory(self, commissions_dir: Path):
+        """Переключает директорию комиссий и сразу загружает ее (например, синтетические рынки бенчмарков)."""
+        self._commissions_dir = commissions_dir
+        self._load_commissions()
+
+    def reload_if_changed(self) -> bool:
+        """Перечитывает комиссии, если файлы добавлены, удалены или изменены. Возвращает True, если таблица подменена."""
+        if self._file_mtimes() == self._mtimes:
+            return False
+        reloaded = self._apply(*self._read_commissions())
+        if reloaded:
+            logger.info(f"Комиссии перезагружены (версия таблицы {self._fee_table.version}).")
+        return reloaded
+
+    async def watch(self, interval: float):
+        """
+        Фоновая проверка директории комиссий: измененные файлы перекомпилируются без перезапуска сервиса.
+        Проверка и чтение файлов выполняются в потоке, подмена таблицы - в event loop.
+        """
+        logger.info(f"Запущено отслеживание изменений комиссий в {self._commissions_dir} (интервал {interval} с).")
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await asyncio.to_thread(self._file_mtimes) == self._mtimes:
+                    continue
+                if self._apply(*await asyncio.to_thread(self._read_commissions)):
+                    logger.info(f"Комиссии перезагружены (версия таблицы {self._fee_table.version}).")
+            except Exception as e:
+                logger.error(f"Ошибка перезагрузки комиссий: {e}", exc_info=True)
 
     def get_commission(self, exchange: str, symbol: str, commission_type: str) -> Optional[str]:
         """Получает строковое значение комиссии для конкретной биржи, пары и типа."""
@@ -61,10 +221,7 @@ class CommissionsConfig:
 
     def get_all_exchange_symbols(self, exchange: str) -> List[str]:
         """Возвращает список всех символов (пар), для которых есть комиссии на указанной бирже."""
-        exchange_data = self._data.get(exchange.lower())
-        if not exchange_data:
-            return []
-        return list(exchange_data.keys())
+        return list(self._fee_table.symbols(exchange))
 
 # --- Класс для общих настроек приложения ---
 class Settings:
@@ -122,6 +279,105 @@ class Settings:
         print("Ошибка: Некорректное значение для MIN_PROFIT_PERCENT в .env. Используется значение по умолчанию 0.01.")
         MIN_PROFIT_PERCENT: Decimal = Decimal("0.01")
 
+    # Движок CEX-CEX поиска: "numpy" (векторизованный) или "decimal" (эталонный, для сверки)
+    CEX_CEX_ENGINE: str = os.getenv("CEX_CEX_ENGINE", "numpy").lower()
+
+    # Хранилище последних стаканов и тикеров: "redis" (ключи Redis, общие для процессов; нужно для COLLECTOR_MODE=external
+    # и FINDER_MODE=stream) или "memory" (в памяти процесса API, поиск читает записи без сериализации;
+    # возможности передаются рассылке WebSocket в этом же процессе, Redis не нужен).
+    MARKET_DATA_STORE: str = os.getenv("MARKET_DATA_STORE", "redis").lower()
+    # Буферизованная запись рыночных данных в хранилище: последнее обновление по ключу,
+    # сброс одним pipeline раз в REDIS_FLUSH_INTERVAL_MS или при REDIS_FLUSH_BATCH_SIZE ключах
+    REDIS_FLUSH_INTERVAL_MS: int = int(os.getenv("REDIS_FLUSH_INTERVAL_MS", 50))
+    REDIS_FLUSH_BATCH_SIZE: int = int(os.getenv("REDIS_FLUSH_BATCH_SIZE", 500))
+    # Время жизни рыночных данных в хранилище, секунды
+    MARKET_DATA_TTL: int = int(os.getenv("MARKET_DATA_TTL", 60))
+    # Каждое обновление также добавляется в Redis Stream биржи, ограниченный примерно MARKET_STREAM_MAXLEN записями
+    MARKET_STREAM_ENABLED: bool = os.getenv("MARKET_STREAM_ENABLED", "true").lower() in ("1", "true", "yes")
+    MARKET_STREAM_MAXLEN: int = int(os.getenv("MARKET_STREAM_MAXLEN", 10000))
+    # Сколько ждать новых записей в блокирующем XREAD, миллисекунды
+    MARKET_STREAM_BLOCK_MS: int = int(os.getenv("MARKET_STREAM_BLOCK_MS", 1000))
+
+    # Журнал всех обновлений рыночных данных на диске для воспроизведения (python -m backend.arbitrage_finder.replay);
+    # пустая строка - журнал не ведется. Новый сегмент - по размеру (МБ) или возрасту (сек);
+    # MARKET_RECORDER_MAX_SEGMENTS > 0 - хранить не больше стольких последних сегментов на процесс
+    MARKET_RECORDER_DIR: str = os.getenv("MARKET_RECORDER_DIR", "")
+    MARKET_RECORDER_SEGMENT_MB: float = float(os.getenv("MARKET_RECORDER_SEGMENT_MB", 64))
+    MARKET_RECORDER_SEGMENT_SECONDS: float = float(os.getenv("MARKET_RECORDER_SEGMENT_SECONDS", 3600))
+    MARKET_RECORDER_MAX_SEGMENTS: int = int(os.getenv("MARKET_RECORDER_MAX_SEGMENTS", 0))
+    # История лучших цен для /api/v1/history: файлы с отображением в память в HISTORY_DIR (пустая строка - не ведется),
+    # блоки по HISTORY_CHUNK_ROWS строк, запись на диск раз в HISTORY_FLUSH_INTERVAL секунд;
+    # ответ прореживается не больше чем до HISTORY_MAX_POINTS точек
+    HISTORY_DIR: str = os.getenv("HISTORY_DIR", "")
+    HISTORY_CHUNK_ROWS: int = int(os.getenv("HISTORY_CHUNK_ROWS", 4096))
+    HISTORY_FLUSH_INTERVAL: float = float(os.getenv("HISTORY_FLUSH_INTERVAL", 1.0))
+    HISTORY_MAX_POINTS: int = int(os.getenv("HISTORY_MAX_POINTS", 2000))
+
+    # Глубина стакана (число уровней на сторону), которую собирает коллектор и учитывает расчет по объему
+    ORDERBOOK_DEPTH: int = int(os.getenv("ORDERBOOK_DEPTH", 20))
+    # Подписки коллектора: "bulk" (watch_tickers / watch_order_book_for_symbols по всем парам биржи в одной задаче,
+    # если биржа их поддерживает, иначе задачи на пару) или "per_symbol" (две задачи на каждую пару)
+    COLLECTOR_WATCH_MODE: str = os.getenv("COLLECTOR_WATCH_MODE", "bulk").lower()
+    # Период логирования числа сообщений в секунду по биржам, секунды (0 - не логировать)
+    COLLECTOR_STATS_INTERVAL: float = float(os.getenv("COLLECTOR_STATS_INTERVAL", 60))
+    # Где работает коллектор: "inprocess" (в процессе API) или "external" (отдельный супервизор
+    # python -m backend.data_collector.supervisor; процесс API только обслуживает запросы).
+    # С внешним коллектором обновления рынков доходят до поиска только через Redis, поэтому FINDER_MODE
+    # должен быть "poll" или "stream"
+    COLLECTOR_MODE: str = os.getenv("COLLECTOR_MODE", "inprocess").lower()
+    # Число процессов-воркеров супервизора (биржи делятся между ними), по умолчанию - число ядер
+    COLLECTOR_WORKERS: int = int(os.getenv("COLLECTOR_WORKERS", 0)) or (os.cpu_count() or 1)
+    # Пауза перед перезапуском упавшего воркера, секунды
+    COLLECTOR_RESTART_DELAY: float = float(os.getenv("COLLECTOR_RESTART_DELAY", 5))
+    # Период записи состояния воркера в Redis; воркер без обновления дольше 3 периодов считается неживым
+    COLLECTOR_HEALTH_INTERVAL: float = float(os.getenv("COLLECTOR_HEALTH_INTERVAL", 5))
+    # Первый порт метрик Prometheus воркеров супервизора (воркер N слушает порт + N); 0 - метрики воркеров не публикуются
+    COLLECTOR_METRICS_PORT: int = int(os.getenv("COLLECTOR_METRICS_PORT", 0))
+
+    # Режим фонового поиска: "poll" (полный пересчет по таймеру), "incremental" (по обновлениям рынков
+    # в этом процессе) или "stream" (по обновлениям из Redis Streams, собственное состояние рынков в памяти)
+    FINDER_MODE: str = os.getenv("FINDER_MODE", "poll").lower()
+    FINDER_POLL_INTERVAL: float = float(os.getenv("FINDER_POLL_INTERVAL", 5))
+    # Окно объединения пачки обновлений в инкрементальном режиме, миллисекунды
+    FINDER_COALESCE_MS: int = int(os.getenv("FINDER_COALESCE_MS", 10))
+    # Сколько секунд REST эндпоинты отдают последний результат, если фоновый поиск в этом процессе
+    # не запущен; после этого следующий запрос запускает один общий пересчет
+    API_RESULT_MAX_AGE: float = float(os.getenv("API_RESULT_MAX_AGE", FINDER_POLL_INTERVAL))
+    # Размер очереди сообщений одного WebSocket клиента; при переполнении очередь очищается,
+    # и клиент получает текущий снимок вместо пропущенных дельт
+    WS_CLIENT_QUEUE_SIZE: int = int(os.getenv("WS_CLIENT_QUEUE_SIZE", 64))
+    # Максимальный возраст котировки (мс от получения коллектором): более старые стаканы и тикеры
+    # не участвуют в поиске арбитража; 0 - без ограничения
+    MAX_QUOTE_AGE_MS: float = float(os.getenv("MAX_QUOTE_AGE_MS", 5000))
+    # Адрес API при запуске через python -m backend.main
+    API_HOST: str = os.getenv("API_HOST", "0.0.0.0")
+    API_PORT: int = int(os.getenv("API_PORT", 8000))
+    # Сжатие сообщений WebSocket (permessage-deflate), если клиент его поддерживает:
+    # меньше трафика снимков ценой CPU на каждого клиента
+    WS_PER_MESSAGE_DEFLATE: bool = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() in ("1", "true", "yes")
+    # Интервал (сек) публикации полного снимка возможностей между дельтами для ресинхронизации клиентов
+    OPPORTUNITY_SNAPSHOT_INTERVAL: float = float(os.getenv("OPPORTUNITY_SNAPSHOT_INTERVAL", 30))
+
+    # Поиск циклов CEX-CEX-CEX: максимальное число сделок в цикле и число раундов поиска
+    MAX_CYCLE_LENGTH: int = int(os.getenv("MAX_CYCLE_LENGTH", 4))
+    CYCLE_SEARCH_MAX_ROUNDS: int = int(os.getenv("CYCLE_SEARCH_MAX_ROUNDS", 16))
+    # Где выполняется поиск циклов: "process" (пул процессов, event loop только ждет результат) или "inline"
+    SCAN_EXECUTOR: str = os.getenv("SCAN_EXECUTOR", "process").lower()
+    # Число процессов пула сканирования; по умолчанию - ядра минус одно под event loop
+    SCAN_POOL_WORKERS: int = int(os.getenv("SCAN_POOL_WORKERS", 0)) or max(1, (os.cpu_count() or 2) - 1)
+    # Максимум одновременно выполняемых сканирований; остальные ждут в очереди
+    SCAN_MAX_CONCURRENT: int = int(os.getenv("SCAN_MAX_CONCURRENT", 0)) or SCAN_POOL_WORKERS
+
+    # Кардинальность меток Prometheus: символ получает собственное значение метки, только если он в METRICS_SYMBOLS
+    # (через запятую) или, если список пуст, среди первых METRICS_MAX_SYMBOLS встреченных; остальные - "other"
+    METRICS_SYMBOLS: List[str] = [symbol.strip().upper() for symbol in os.getenv("METRICS_SYMBOLS", "").split(",") if symbol.strip()]
+    METRICS_MAX_SYMBOLS: int = int(os.getenv("METRICS_MAX_SYMBOLS", 100))
+    # Период измерения задержки event loop, секунды (0 - не измерять)
+    EVENT_LOOP_LAG_INTERVAL: float = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", 0.5))
+
+    # Период проверки изменений файлов комиссий, секунды (0 - без горячей перезагрузки)
+    COMMISSIONS_RELOAD_INTERVAL: float = float(os.getenv("COMMISSIONS_RELOAD_INTERVAL", 2))
+
 # --- Инициализация объектов конфигурации ---
 settings = Settings()
 commissions_config = CommissionsConfig()
\ No newline at end of file
@@ -0,0 +1,7 @@
+# backend/core/constants.py
+
+# Минимальное число сделок в цикле для CEX-CEX-CEX поиска (петли из двух сделок ищет CEX-CEX поиск)
+MIN_TRIANGULAR_CYCLE_LENGTH = 3
+
+# Валюты котировки, объем в которых считаем равным объему в долларах
+USD_QUOTE_CURRENCIES = frozenset({"USDT", "USDC", "USD", "BUSD", "FDUSD", "TUSD", "DAI"})
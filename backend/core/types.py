@@ -0,0 +1,125 @@
+# backend/core/types.py
+import time
+from array import array
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple, Mapping, Sequence
+
+# Ключ рынка: (идентификатор биржи, символ пары)
+MarketKey = Tuple[str, str]
+
+
+class L2Book:
+    """
+    Стакан глубиной до depth уровней в виде параллельных массивов цен и объемов (array('d')).
+    Уровни отсортированы от лучшего к худшему; память на стакан ограничена глубиной.
+    """
+    __slots__ = ("bid_prices", "bid_sizes", "ask_prices", "ask_sizes")
+
+    def __init__(self, bid_prices: array, bid_sizes: array, ask_prices: array, ask_sizes: array):
+        self.bid_prices = bid_prices
+        self.bid_sizes = bid_sizes
+        self.ask_prices = ask_prices
+        self.ask_sizes = ask_sizes
+
+    @staticmethod
+    def _side(levels: Optional[Sequence[Sequence[Any]]], depth: int) -> Tuple[array, array]:
+        prices, sizes = array('d'), array('d')
+        for level in (levels or ())[:depth]:
+            price, size = float(level[0] or 0), float(level[1] or 0)
+            if price > 0 and size > 0:
+                prices.append(price)
+                sizes.append(size)
+        return prices, sizes
+
+    @classmethod
+    def from_orderbook(cls, orderbook: Dict[str, Any], depth: int) -> "L2Book":
+        """
+        Строит стакан из записи хранилища: уровни 'bids'/'asks' ([цена, объем]),
+        а если их нет - один уровень из лучших цен 'bid'/'ask' и объемов.
+        """
+        bids = orderbook.get('bids')
+        if not bids:
+            bids = [(orderbook.get('bid'), orderbook.get('bidVolume'))]
+        asks = orderbook.get('asks')
+        if not asks:
+            asks = [(orderbook.get('ask'), orderbook.get('askVolume'))]
+        return cls(*cls._side(bids, depth), *cls._side(asks, depth))
+
+    def __repr__(self):
+        return f"L2Book(bids={len(self.bid_prices)}, asks={len(self.ask_prices)})"
+
+
+def _is_stale(record: Dict[str, Any], deadline: float) -> bool:
+    quoted_at = quote_time(record)
+    return quoted_at is not None and quoted_at < deadline
+
+
+def quote_time(record: Dict[str, Any]) -> Optional[float]:
+    """
+    Локальное время котировки (мс Unix): получение коллектором, а если его нет - запись в кэш.
+    timestamp биржи не используется: часы бирж расходятся, а старый timestamp у только что полученного
+    стакана означает лишь, что он не менялся. None - время неизвестно (записи старого формата).
+    """
+    received_at = record.get('receivedAt')
+    return received_at if received_at is not None else record.get('cachedAt')
+
+
+class MarketSnapshot:
+    """
+    Неизменяемый срез рыночных данных (стаканы и тикеры), полученный из хранилища за один запрос.
+    Каждый ключ декодируется один раз, поиск арбитража работает только с этим срезом.
+    """
+    __slots__ = ("_orderbooks", "_tickers", "taken_at", "_books")
+
+    def __init__(self, orderbooks: Dict[MarketKey, Dict[str, Any]], tickers: Dict[MarketKey, Dict[str, Any]],
+                 taken_at: Optional[float] = None):
+        self._orderbooks: Mapping[MarketKey, Dict[str, Any]] = MappingProxyType(dict(orderbooks))
+        self._tickers: Mapping[MarketKey, Dict[str, Any]] = MappingProxyType(dict(tickers))
+        self.taken_at = taken_at if taken_at is not None else time.time()
+        # Стаканы в виде массивов строятся лениво и только для рынков, по которым нужен расчет по глубине
+        self._books: Dict[MarketKey, Optional[L2Book]] = {}
+
+    @property
+    def orderbooks(self) -> Mapping[MarketKey, Dict[str, Any]]:
+        return self._orderbooks
+
+    @property
+    def tickers(self) -> Mapping[MarketKey, Dict[str, Any]]:
+        return self._tickers
+
+    def get_orderbook(self, exchange_id: str, symbol: str) -> Optional[Dict[str, Any]]:
+        return self._orderbooks.get((exchange_id, symbol))
+
+    def get_ticker(self, exchange_id: str, symbol: str) -> Optional[Dict[str, Any]]:
+        return self._tickers.get((exchange_id, symbol))
+
+    def get_book(self, exchange_id: str, symbol: str, depth: int) -> Optional[L2Book]:
+        """Стакан рынка в виде массивов уровней; строится один раз на срез."""
+        key = (exchange_id, symbol)
+        if key not in self._books:
+            orderbook = self._orderbooks.get(key)
+            self._books[key] = L2Book.from_orderbook(orderbook, depth) if orderbook else None
+        return self._books[key]
+
+    def without_stale(self, max_age_ms: float, now_ms: Optional[float] = None) -> Tuple["MarketSnapshot", List[MarketKey]]:
+        """
+        Срез без стаканов и тикеров старше max_age_ms и список рынков, у которых такие записи были.
+        Если устаревших записей нет, возвращается этот же срез.
+        """
+        deadline = (time.time() * 1000 if now_ms is None else now_ms) - max_age_ms
+        stale = [key for records in (self._orderbooks, self._tickers)
+                 for key, record in records.items() if _is_stale(record, deadline)]
+        if not stale:
+            return self, stale
+        snapshot = MarketSnapshot(
+            {key: record for key, record in self._orderbooks.items() if not _is_stale(record, deadline)},
+            {key: record for key, record in self._tickers.items() if not _is_stale(record, deadline)},
+            self.taken_at,
+        )
+        return snapshot, list(dict.fromkeys(stale))
+
+    def __len__(self) -> int:
+        return len(self._orderbooks) + len(self._tickers)
+
+    def __repr__(self):
+        return f"MarketSnapshot(orderbooks={len(self._orderbooks)}, tickers={len(self._tickers)}, taken_at={self.taken_at})"
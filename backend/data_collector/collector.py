@@ -1,10 +1,13 @@
 # backend/data_collector/collector.py
 import ccxt.pro as ccxt # Импортируем ccxtpro
 import asyncio
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Tuple
 
 from backend.core.config import settings, commissions_config
 from backend.data_processor.processor import data_processor # Импортируем экземпляр процессора
+from backend.monitoring import collector_messages, collector_symbol_messages, collector_reconnects, symbol_label, \
+    market_data_receive_latency
 from backend.utils.logger import logger # Убедитесь, что здесь импортируется настроенный логгер
 
 
@@ -13,17 +16,37 @@ class DataCollector:
     Собирает рыночные данные с бирж с использованием ccxtpro.
     Запускает асинхронные задачи наблюдения за тикерами и стаканами.
     """
-    def __init__(self):
+    def __init__(self, exchanges: Optional[List[str]] = None):
+        # Биржи этого коллектора (у воркера супервизора - его доля settings.EXCHANGES)
+        self._exchange_ids: List[str] = list(settings.EXCHANGES if exchanges is None else exchanges)
         self._exchanges: Dict[str, ccxt.Exchange] = {}
         self._collecting_tasks: List[asyncio.Task] = []
         self._watched_symbols: Dict[str, List[str]] = {}
+        # Число полученных сообщений по биржам с начала сбора (для логирования пропускной способности)
+        self._message_counts: Dict[str, int] = {}
+        # Счетчики сообщений по (биржа, символ, вид): метки вычисляются один раз на рынок, а не на каждое сообщение
+        self._symbol_counters: Dict[Tuple[str, str, str], Any] = {}
+
+    @property
+    def exchange_ids(self) -> List[str]:
+        return self._exchange_ids
+
+    @property
+    def message_counts(self) -> Dict[str, int]:
+        """Число полученных сообщений по биржам с начала сбора."""
+        return self._message_counts
+
+    @property
+    def watched_symbols(self) -> Dict[str, List[str]]:
+        """Пары с комиссиями, реально найденные в загруженных рынках бирж (биржа -> пары)."""
+        return self._watched_symbols
 
     async def load_exchanges(self):
         """Инициализирует экземпляры бирж и загружает их рынки."""
         logger.info("Загрузка бирж...")
         # Очищаем список загруженных бирж перед новой загрузкой на случай перезапуска
         self._exchanges = {}
-        for exchange_id in settings.EXCHANGES:
+        for exchange_id in self._exchange_ids:
             try:
                 exchange_class = getattr(ccxt, exchange_id)
                 exchange = exchange_class({
@@ -86,19 +109,19 @@ class DataCollector:
     async def start_collecting(self):
         """
         Запускает асинхронные задачи сбора данных для каждой биржи и пары в фоне.
-        Требует успешного подключения к Redis.
+        Требует успешного подключения к хранилищу рыночных данных.
         """
         # Убеждаемся, что биржи загружены перед началом сбора данных
         await self.load_exchanges()
 
-        # --- КРИТИЧНАЯ ПРОВЕРКА: УСПЕШНО ЛИ ПОДКЛЮЧЕН REDIS ---
-        # DataProcessor.connect_redis вызывается в startup_event FastAPI.
+        # --- КРИТИЧНАЯ ПРОВЕРКА: УСПЕШНО ЛИ ПОДКЛЮЧЕНО ХРАНИЛИЩЕ ---
+        # DataProcessor.connect вызывается в startup_event FastAPI.
         # Проверяем результат этого вызова перед запуском коллекторов.
         if not data_processor.is_connected:
-             logger.error("Redis клиент не подключен в DataProcessor. Невозможно запустить задачи сбора данных. Пожалуйста, убедитесь, что Redis запущен и доступен, и перезапустите приложение.")
+             logger.error(f"Хранилище рыночных данных ({settings.MARKET_DATA_STORE}) не подключено в DataProcessor. Невозможно запустить задачи сбора данных. Пожалуйста, убедитесь, что Redis запущен и доступен, и перезапустите приложение.")
              # Возвращаемся, не запуская collect_tasks.
              return
-        # logger.info("Redis клиент доступен. Запуск задач сбора данных...") # Лог перемещен ниже к запуску задач
+        # logger.info("Хранилище доступно. Запуск задач сбора данных...") # Лог перемещен ниже к запуску задач
 
         # Очищаем список задач на случай перезапуска или повторного вызова start_collecting
         if self._collecting_tasks:
@@ -135,13 +158,25 @@ class DataCollector:
              logger.warning("Нет бирж/пар с комиссиями, доступных на биржах, для наблюдения. Не запущено ни одной задачи сбора данных.")
              return # Выходим, если нечего наблюдать
 
-        # Запускаем задачи для каждой пары на каждой бирже
+        bulk_mode = settings.COLLECTOR_WATCH_MODE == "bulk"
+        self._message_counts = {}
         for exchange_id, symbols in self._watched_symbols.items():
              exchange = self._exchanges[exchange_id] # Берем экземпляр из словаря успешно загруженных бирж
 
+             # Bulk подписки: одна задача на биржу вместо двух задач на каждую пару
+             bulk_tickers = bulk_mode and bool(exchange.has.get('watchTickers'))
+             bulk_orderbooks = bulk_mode and bool(exchange.has.get('watchOrderBookForSymbols'))
+             if bulk_tickers or bulk_orderbooks:
+                 task = asyncio.create_task(
+                     self._watch_exchange_loop(exchange, symbols, bulk_tickers, bulk_orderbooks),
+                     name=f"watch_bulk_{exchange_id}"
+                 )
+                 self._collecting_tasks.append(task)
+
+             # Задачи на каждую пару - для того, что биржа не умеет получать bulk подпиской
              for symbol in symbols:
                  # Запускаем задачи только если биржа поддерживает соответствующий метод watch_*
-                 if exchange.has.get('watchTicker'):
+                 if not bulk_tickers and exchange.has.get('watchTicker'):
                     # Создаем задачу и добавляем в список запущенных. Даем задаче имя для отладки.
                     task = asyncio.create_task(self._watch_ticker_loop(exchange, symbol), name=f"watch_ticker_{exchange_id}_{symbol}")
                     self._collecting_tasks.append(task)
@@ -149,9 +184,9 @@ class DataCollector:
                    # logger.debug(f"[{exchange.id.upper()}] Не поддерживает watchTicker для {symbol}.")
 
 
-                 if exchange.has.get('watchOrderBook'):
-                    # Создаем задачу для наблюдения за стаканом (ограничение глубины 1)
-                    task = asyncio.create_task(self._watch_orderbook_loop(exchange, symbol, limit=1), name=f"watch_orderbook_{exchange_id}_{symbol}")
+                 if not bulk_orderbooks and exchange.has.get('watchOrderBook'):
+                    # Создаем задачу для наблюдения за стаканом глубиной ORDERBOOK_DEPTH уровней
+                    task = asyncio.create_task(self._watch_orderbook_loop(exchange, symbol, limit=settings.ORDERBOOK_DEPTH), name=f"watch_orderbook_{exchange_id}_{symbol}")
                     self._collecting_tasks.append(task)
                  # else:
                     # logger.debug(f"[{exchange.id.upper()}] Не поддерживает watchOrderBook для {symbol}.")
@@ -161,6 +196,8 @@ class DataCollector:
              logger.warning("Не запущено ни одной задачи сбора данных (после проверки поддержки watch методов и наличия пар).")
         else:
              logger.info(f"Запущено {len(self._collecting_tasks)} задач сбора данных в фоновом режиме.")
+             if settings.COLLECTOR_STATS_INTERVAL > 0:
+                  self._collecting_tasks.append(asyncio.create_task(self._stats_loop(settings.COLLECTOR_STATS_INTERVAL), name="collector_stats"))
 
 
     async def stop_collecting(self):
@@ -198,50 +235,178 @@ class DataCollector:
 
         await self.close_exchanges() # Закрываем соединения с биржами
 
+    def _count_message(self, exchange_id: str, symbol: str, kind: str):
+        collector_messages.labels(exchange=exchange_id, kind=kind).inc()
+        self._message_counts[exchange_id] = self._message_counts.get(exchange_id, 0) + 1
+        counter = self._symbol_counters.get((exchange_id, symbol, kind))
+        if counter is None:
+            counter = self._symbol_counters[(exchange_id, symbol, kind)] = collector_symbol_messages.labels(
+                exchange=exchange_id, symbol=symbol_label(symbol), kind=kind)
+        counter.inc()
+
+    @staticmethod
+    def _observe_receive_latency(exchange_id: str, timestamp: Optional[float], received_at: float):
+        # timestamp биржи может быть в будущем из-за расхождения часов; такие значения считаются нулевой задержкой
+        if timestamp:
+            market_data_receive_latency.labels(exchange=exchange_id).observe(max(0.0, (received_at - timestamp) / 1000))
+
+    async def _handle_ticker(self, exchange: ccxt.Exchange, symbol: str, ticker: Optional[Dict[str, Any]]):
+        received_at = time.time() * 1000
+        self._count_message(exchange.id, symbol, "ticker")
+        if ticker and ticker.get('symbol') == symbol and ticker.get('bid') is not None and ticker.get(
+                'ask') is not None:
+            self._observe_receive_latency(exchange.id, ticker.get('timestamp'), received_at)
+            await data_processor.cache_ticker(exchange.id, symbol, self._compact_ticker(ticker, received_at))
+        # else:
+        #     logger.debug(f"[{exchange.id.upper()}] Получен невалидный тикер для {symbol}: {ticker}")
+
+    async def _handle_orderbook(self, exchange: ccxt.Exchange, symbol: str, orderbook: Optional[Dict[str, Any]], depth: int):
+        received_at = time.time() * 1000
+        self._count_message(exchange.id, symbol, "orderbook")
+        # В стакане ccxt нет полей bid/ask - только списки уровней bids/asks
+        if orderbook and orderbook.get('symbol') == symbol and orderbook.get('bids') and orderbook.get('asks'):
+            self._observe_receive_latency(exchange.id, orderbook.get('timestamp'), received_at)
+            await data_processor.cache_orderbook(exchange.id, symbol, self._compact_orderbook(orderbook, depth, received_at))
+        # else:
+        #     logger.debug(f"[{exchange.id.upper()}] Получен невалидный стакан для {symbol}: {orderbook}")
+
+    async def _stats_loop(self, interval: float):
+        """Периодически логирует число полученных сообщений в секунду по каждой бирже."""
+        previous = dict(self._message_counts)
+        started = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            current = dict(self._message_counts)
+            rates = ", ".join(
+                f"{exchange_id.upper()}: {(count - previous.get(exchange_id, 0)) / (now - started):.1f}"
+                for exchange_id, count in sorted(current.items())
+            )
+            logger.info(f"Пропускная способность коллектора, сообщений/с: {rates or 'нет сообщений'}")
+            previous, started = current, now
+
+    @staticmethod
+    async def _watch_after(delay: float, watch):
+        await asyncio.sleep(delay)
+        return await watch()
+
+    async def _watch_exchange_loop(self, exchange: ccxt.Exchange, symbols: List[str],
+                                   watch_tickers: bool, watch_orderbooks: bool):
+        """
+        Одна задача на биржу: bulk подписки watch_tickers и watch_order_book_for_symbols по всем парам.
+        Оба ожидания идут одновременно; готовое обрабатывается и сразу запрашивается снова.
+        При ошибке подписка повторяется через 5 секунд, не останавливая другую.
+        """
+        logger.info(f"[{exchange.id.upper()}] Запуск bulk наблюдения по {len(symbols)} парам "
+                    f"(тикеры: {watch_tickers}, стаканы: {watch_orderbooks})")
+        depth = settings.ORDERBOOK_DEPTH
+        symbol_set = set(symbols)
+        watchers = {}
+        if watch_tickers:
+            watchers["ticker"] = lambda: exchange.watch_tickers(symbols)
+        if watch_orderbooks:
+            watchers["orderbook"] = lambda: exchange.watch_order_book_for_symbols(symbols, limit=depth)
+        pending: Dict[asyncio.Future, str] = {
+            asyncio.ensure_future(watch()): kind for kind, watch in watchers.items()
+        }
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    kind = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(
+                            f"[{exchange.id.upper()}] Ошибка в bulk подписке ({kind}): {e} (Type: {type(e).__name__}). Попытка переподключения через 5 секунд...")
+                        collector_reconnects.labels(exchange=exchange.id, kind=kind).inc()
+                        pending[asyncio.ensure_future(self._watch_after(5, watchers[kind]))] = kind
+                        continue
+                    pending[asyncio.ensure_future(watchers[kind]())] = kind
+                    try:
+                        if kind == "ticker":
+                            # watch_tickers возвращает словарь symbol -> тикер обновившихся пар
+                            for symbol, ticker in (result or {}).items():
+                                if symbol in symbol_set:
+                                    await self._handle_ticker(exchange, symbol, ticker)
+                        elif result and result.get('symbol') in symbol_set:
+                            # watch_order_book_for_symbols возвращает стакан пары, которая обновилась
+                            await self._handle_orderbook(exchange, result['symbol'], result, depth)
+                    except Exception as e:
+                        logger.error(f"[{exchange.id.upper()}] Ошибка обработки bulk обновления ({kind}): {e} (Type: {type(e).__name__})")
+        except asyncio.CancelledError:
+            logger.info(f"[{exchange.id.upper()}] Задача bulk наблюдения отменена.")
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
     async def _watch_ticker_loop(self, exchange: ccxt.Exchange, symbol: str):
         logger.info(f"[{exchange.id.upper()}] Запуск наблюдения за тикером: {symbol}")
         while True:
             try:
-                # Проверяем, что возвращает watch_ticker
-                ticker_iter = await exchange.watch_ticker(symbol)  # Добавляем await
-                async for ticker in ticker_iter:
-                    if ticker and ticker.get('symbol') == symbol and ticker.get('bid') is not None and ticker.get(
-                            'ask') is not None:
-                        await data_processor.cache_ticker(exchange.id, symbol, ticker)
-                    # else:
-                    #     logger.debug(f"[{exchange.id.upper()}] Получен невалидный тикер для {symbol}: {ticker}")
+                # watch_ticker возвращает очередное обновление тикера (а не асинхронный итератор)
+                ticker = await exchange.watch_ticker(symbol)
+                await self._handle_ticker(exchange, symbol, ticker)
             except asyncio.CancelledError:
                 logger.info(f"[{exchange.id.upper()}] Задача наблюдения за тикером {symbol} отменена.")
                 raise
             except Exception as e:
                 logger.error(
                     f"[{exchange.id.upper()}] Ошибка в _watch_ticker_loop для {symbol}: {e} (Type: {type(e).__name__}). Попытка переподключения через 5 секунд...")
+                collector_reconnects.labels(exchange=exchange.id, kind="ticker").inc()
                 await asyncio.sleep(5)
 
+    @staticmethod
+    def _compact_ticker(ticker: Dict[str, Any], received_at: float) -> Dict[str, Any]:
+        """Оставляет от тикера ccxt лучшие цены, их объемы, timestamp биржи и время получения (мс)."""
+        return {
+            'symbol': ticker.get('symbol'),
+            'timestamp': ticker.get('timestamp'),
+            'receivedAt': received_at,
+            'bid': ticker.get('bid'),
+            'bidVolume': ticker.get('bidVolume'),
+            'ask': ticker.get('ask'),
+            'askVolume': ticker.get('askVolume'),
+        }
+
+    @staticmethod
+    def _compact_orderbook(orderbook: Dict[str, Any], depth: int, received_at: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Оставляет от стакана ccxt лучшие цены и не более depth уровней [цена, объем] на сторону,
+        чтобы размер записи в хранилище был ограничен глубиной; добавляет время получения (мс).
+        """
+        bids = [[level[0], level[1]] for level in orderbook['bids'][:depth]]
+        asks = [[level[0], level[1]] for level in orderbook['asks'][:depth]]
+        return {
+            'symbol': orderbook.get('symbol'),
+            'timestamp': orderbook.get('timestamp'),
+            'receivedAt': received_at,
+            'bid': bids[0][0],
+            'bidVolume': bids[0][1],
+            'ask': asks[0][0],
+            'askVolume': asks[0][1],
+            'bids': bids,
+            'asks': asks,
+        }
+
     async def _watch_orderbook_loop(self, exchange: ccxt.Exchange, symbol: str, limit: Optional[int] = None):
         logger.info(f"[{exchange.id.upper()}] Запуск наблюдения за стаканом: {symbol} (limit={limit})")
+        depth = limit or settings.ORDERBOOK_DEPTH
         while True:
             try:
-                # Проверяем, что возвращает watch_order_book
-                orderbook_iter = await exchange.watch_order_book(symbol, limit=limit)  # Добавляем await
-                async for orderbook in orderbook_iter:
-                    if orderbook and orderbook.get('symbol') == symbol and orderbook.get(
-                            'bid') is not None and orderbook.get('ask') is not None:
-                        await data_processor.cache_orderbook(exchange.id, symbol, orderbook)
-                    # else:
-                    #     logger.debug(f"[{exchange.id.upper()}] Получен невалидный стакан для {symbol}: {orderbook}")
+                # watch_order_book возвращает очередное состояние стакана (а не асинхронный итератор)
+                orderbook = await exchange.watch_order_book(symbol, limit=limit)
+                await self._handle_orderbook(exchange, symbol, orderbook, depth)
             except asyncio.CancelledError:
                 logger.info(f"[{exchange.id.upper()}] Задача наблюдения за стаканом {symbol} отменена.")
                 raise
             except Exception as e:
                 logger.error(
                     f"[{exchange.id.upper()}] Ошибка в _watch_orderbook_loop для {symbol}: {e} (Type: {type(e).__name__}). Попытка переподключения через 5 секунд...")
+                collector_reconnects.labels(exchange=exchange.id, kind="orderbook").inc()
                 await asyncio.sleep(5)
 
-             # Эти строки теперь внутри except блока
-             # logger.warning(f"[{exchange.id.upper()}] Поток watch_order_book для {symbol} завершился. Переподключение через 5 секунд...")
-             # await asyncio.sleep(5)
-
 
 # Инициализируем экземпляр коллектора (синглтон)
 data_collector = DataCollector()
\ No newline at end of file
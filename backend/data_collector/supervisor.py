@@ -0,0 +1,261 @@
+# backend/data_collector/supervisor.py
+"""
+Супервизор коллектора: делит settings.EXCHANGES между процессами-воркерами, у каждого свой
+event loop, свои соединения с биржами и свой буферизованный writer в Redis. Упавший воркер
+перезапускается; состояние воркеров и супервизора пишется в хэш Redis COLLECTOR_HEALTH_KEY.
+
+Запуск: python -m backend.data_collector.supervisor (в API при этом COLLECTOR_MODE=external).
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import List, Dict, Any, Optional
+
+import redis.asyncio as redis
+
+from backend.core.config import settings
+from backend.utils.logger import logger
+
+COLLECTOR_HEALTH_KEY = "collector:health"
+_SUPERVISOR_FIELD = "supervisor"
+
+
+def partition_exchanges(exchanges: List[str], workers: int) -> List[List[str]]:
+    """Делит биржи между воркерами по кругу; воркеров не больше, чем бирж."""
+    count = max(1, min(workers, len(exchanges)))
+    return [exchanges[i::count] for i in range(count)]
+
+
+def _create_redis_client() -> redis.Redis:
+    return redis.Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        decode_responses=True
+    )
+
+
+async def _run_worker(worker_id: int, exchanges: List[str]) -> int:
+    """
+    Сбор данных воркера и периодическая запись его состояния. Возвращает код завершения процесса:
+    1, если запуск сбора завершился ошибкой - супервизор перезапустит воркер, а не будет считать его живым.
+    """
+    # Импорт внутри процесса воркера: синглтоны процессора создаются в его собственном интерпретаторе
+    from backend.data_collector.collector import DataCollector
+    from backend.data_processor.processor import data_processor
+    from backend.monitoring import monitor_event_loop_lag
+    from prometheus_client import start_http_server
+
+    if settings.COLLECTOR_METRICS_PORT > 0:
+        # Метрики коллектора (сообщения, переподключения, задержки Redis) живут в процессе воркера
+        start_http_server(settings.COLLECTOR_METRICS_PORT + worker_id)
+    collector = DataCollector(exchanges)
+    health_client = _create_redis_client()
+    started_at = time.time()
+    await data_processor.connect()
+    data_processor.start_writer()
+    collect_task = asyncio.create_task(collector.start_collecting(), name=f"collector_worker_{worker_id}")
+    loop_lag_task = None
+    if settings.EVENT_LOOP_LAG_INTERVAL > 0:
+        loop_lag_task = asyncio.create_task(monitor_event_loop_lag(settings.EVENT_LOOP_LAG_INTERVAL), name="event_loop_lag")
+    try:
+        while True:
+            error = collect_task.exception() if collect_task.done() and not collect_task.cancelled() else None
+            health = {
+                "worker": worker_id,
+                "pid": os.getpid(),
+                "exchanges": exchanges,
+                "watched_exchanges": sorted(collector.watched_symbols),
+                "messages": collector.message_counts,
+                "started_at": started_at,
+                "updated_at": time.time(),
+            }
+            if error is not None:
+                logger.error(f"Воркер коллектора {worker_id}: ошибка запуска сбора данных: {error} "
+                             f"(Type: {type(error).__name__}). Воркер завершается для перезапуска.",
+                             exc_info=error)
+                health["error"] = f"{type(error).__name__}: {error}"
+            try:
+                await health_client.hset(COLLECTOR_HEALTH_KEY, str(worker_id), json.dumps(health))
+            except Exception as e:
+                logger.error(f"Воркер коллектора {worker_id}: ошибка записи состояния в Redis: {e}")
+            if error is not None:
+                return 1
+            # Ошибка запуска сбора обрабатывается сразу, а не через период записи состояния
+            if not collect_task.done():
+                await asyncio.wait({collect_task}, timeout=settings.COLLECTOR_HEALTH_INTERVAL)
+            elif collect_task.cancelled() or collect_task.exception() is None:
+                await asyncio.sleep(settings.COLLECTOR_HEALTH_INTERVAL)
+    finally:
+        collect_task.cancel()
+        if loop_lag_task is not None:
+            loop_lag_task.cancel()
+        await collector.stop_collecting()
+        await data_processor.stop_writer()
+        await data_processor.disconnect()
+        await health_client.aclose()
+
+
+def worker_main(worker_id: int, exchanges: List[str]):
+    """
+    Точка входа процесса-воркера: свой event loop на свою группу бирж; SIGTERM - штатная остановка.
+    Ненулевой код завершения - сбор данных не запустился, супервизор перезапускает воркер.
+    """
+    logger.info(f"Воркер коллектора {worker_id} (pid {os.getpid()}) запущен для бирж: {exchanges}")
+
+    async def main() -> int:
+        task = asyncio.current_task()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        try:
+            return await _run_worker(worker_id, exchanges)
+        except asyncio.CancelledError:
+            logger.info(f"Воркер коллектора {worker_id} остановлен.")
+            return 0
+
+    sys.exit(asyncio.run(main()))
+
+
+class CollectorSupervisor:
+    """Запускает воркеры коллектора, перезапускает упавшие и публикует их состояние."""
+
+    def __init__(self, exchanges: Optional[List[str]] = None, workers: Optional[int] = None):
+        self._groups = partition_exchanges(
+            list(settings.EXCHANGES if exchanges is None else exchanges),
+            settings.COLLECTOR_WORKERS if workers is None else workers
+        )
+        # spawn: воркер стартует с чистого интерпретатора, без унаследованных loop и соединений
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._restarts: Dict[int, int] = {worker_id: 0 for worker_id in range(len(self._groups))}
+        self._exit_codes: Dict[int, Optional[int]] = {}
+        self._running = False
+
+    def _start_worker(self, worker_id: int):
+        process = self._context.Process(
+            target=worker_main, args=(worker_id, self._groups[worker_id]),
+            name=f"collector-worker-{worker_id}", daemon=True
+        )
+        process.start()
+        self._processes[worker_id] = process
+
+    async def run(self):
+        self._running = True
+        logger.info(f"Супервизор коллектора: {len(self._groups)} воркеров, группы бирж: {self._groups}")
+        client = _create_redis_client()
+        # Записи воркеров прошлого запуска больше не актуальны
+        await client.delete(COLLECTOR_HEALTH_KEY)
+        for worker_id in range(len(self._groups)):
+            self._start_worker(worker_id)
+        restart_at: Dict[int, float] = {}
+        try:
+            while self._running:
+                now = time.monotonic()
+                for worker_id, process in self._processes.items():
+                    if process.is_alive():
+                        continue
+                    if worker_id not in restart_at:
+                        self._exit_codes[worker_id] = process.exitcode
+                        logger.error(f"Воркер коллектора {worker_id} (pid {process.pid}) завершился с кодом {process.exitcode}. "
+                                     f"Перезапуск через {settings.COLLECTOR_RESTART_DELAY} с.")
+                        restart_at[worker_id] = now + settings.COLLECTOR_RESTART_DELAY
+                    elif now >= restart_at[worker_id]:
+                        del restart_at[worker_id]
+                        self._restarts[worker_id] += 1
+                        self._start_worker(worker_id)
+                try:
+                    await client.hset(COLLECTOR_HEALTH_KEY, _SUPERVISOR_FIELD, json.dumps(self.status()))
+                except Exception as e:
+                    logger.error(f"Супервизор коллектора: ошибка записи состояния в Redis: {e}")
+                await asyncio.sleep(1)
+        finally:
+            self.stop()
+            await client.aclose()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "updated_at": time.time(),
+            "workers": {
+                str(worker_id): {
+                    "pid": process.pid,
+                    "alive": process.is_alive(),
+                    "exchanges": self._groups[worker_id],
+                    "restarts": self._restarts[worker_id],
+                    "last_exit_code": self._exit_codes.get(worker_id),
+                }
+                for worker_id, process in self._processes.items()
+            },
+        }
+
+    def stop(self, timeout: float = 15.0):
+        """Останавливает воркеры: SIGTERM, ожидание, затем SIGKILL для не завершившихся."""
+        self._running = False
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for worker_id, process in self._processes.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Воркер коллектора {worker_id} не завершился за {timeout} с, принудительная остановка.")
+                process.kill()
+                process.join()
+
+
+async def read_collector_health(client: redis.Redis) -> Dict[str, Any]:
+    """
+    Сводное состояние коллектора из хэша Redis: воркер живой, если обновлял запись в последние
+    3 периода COLLECTOR_HEALTH_INTERVAL и не сообщил об ошибке (поле error). status - "ok" (все живы), "degraded" (часть) или "down".
+    """
+    records = await client.hgetall(COLLECTOR_HEALTH_KEY)
+    now = time.time()
+    stale_after = 3 * settings.COLLECTOR_HEALTH_INTERVAL
+    supervisor = None
+    workers = []
+    for field, value in records.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        record = json.loads(value)
+        if field == _SUPERVISOR_FIELD:
+            supervisor = record
+            continue
+        # Воркер с ошибкой запуска сбора данных неживой, даже если его запись свежая
+        record["alive"] = now - record.get("updated_at", 0) <= stale_after and not record.get("error")
+        record["messages_total"] = sum(record.get("messages", {}).values())
+        workers.append(record)
+    workers.sort(key=lambda record: record["worker"])
+    if supervisor is not None:
+        for record in workers:
+            supervisor_view = supervisor["workers"].get(str(record["worker"]), {})
+            record["restarts"] = supervisor_view.get("restarts", 0)
+            record["alive"] = record["alive"] and supervisor_view.get("alive", True)
+    alive = sum(record["alive"] for record in workers)
+    status = "ok" if workers and alive == len(workers) else ("degraded" if alive else "down")
+    return {"status": status, "workers_alive": alive, "workers": workers, "supervisor": supervisor}
+
+
+def main():
+    if settings.MARKET_DATA_STORE != "redis":
+        # Воркеры - отдельные процессы: их данные доходят до поиска в процессе API только через Redis
+        logger.error(f"Внешний коллектор требует MARKET_DATA_STORE=redis (задано {settings.MARKET_DATA_STORE!r}).")
+        sys.exit(1)
+    supervisor = CollectorSupervisor()
+
+    async def run():
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, task.cancel)
+        try:
+            await supervisor.run()
+        except asyncio.CancelledError:
+            logger.info("Супервизор коллектора остановлен.")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# backend/data_processor/history.py
+"""
+История лучших цен (время, bid, ask и их объемы) по рынкам в колоночных файлах с отображением в память.
+
+Файл рынка: <директория>/<биржа>/<символ>.tob. Заголовок HEADER_SIZE байт (HISTORY_MAGIC, версия,
+строк в блоке, записано строк), затем блоки фиксированной ширины: в блоке по chunk_rows значений
+(float64 little-endian) каждой колонки из COLUMNS подряд. Файл растет целыми блоками; число записанных
+строк в заголовке обновляется после данных, поэтому читатель из другого процесса видит только дописанные строки.
+Время строк файла не убывает: диапазон ищется бинарным поиском по отображенным колонкам, без чтения файла целиком.
+"""
+import math
+import struct
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.core.types import MarketKey
+from backend.utils.logger import logger
+
+HISTORY_MAGIC = b"TOBHST"
+HISTORY_VERSION = 1
+HISTORY_SUFFIX = ".tob"
+HEADER_SIZE = 64
+COLUMNS = ("ts", "bid", "ask", "bid_volume", "ask_volume")
+# Сигнатура, версия, строк в блоке, записано строк
+_HEADER = struct.Struct("<6sHIQ")
+_ROWS_OFFSET = _HEADER.size - 8
+_VALUE = np.dtype("<f8")
+# Файлы, открытые для записи: у каждого отображения свой дескриптор, поэтому их число ограничено
+_MAX_OPEN_WRITERS = 256
+
+
+def series_path(directory: Path, exchange_id: str, symbol: str) -> Path:
+    return Path(directory) / exchange_id / f"{symbol.replace('/', '-').replace(':', '_')}{HISTORY_SUFFIX}"
+
+
+def _read_header(header: bytes, path: Path) -> Tuple[int, int]:
+    magic, version, chunk_rows, rows = _HEADER.unpack(header[:_HEADER.size])
+    if magic != HISTORY_MAGIC or version != HISTORY_VERSION:
+        raise ValueError(f"{path} не является файлом истории лучших цен")
+    return chunk_rows, rows
+
+
+class _SeriesWriter:
+    """Дозапись строк в файл одного рынка через отображение в память."""
+
+    def __init__(self, path: Path, chunk_rows: int):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if not path.exists() or path.stat().st_size < HEADER_SIZE:
+            path.write_bytes(_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, chunk_rows, 0).ljust(HEADER_SIZE, b"\0"))
+        # Размер блока задан при создании файла
+        self.chunk_rows, self.rows = _read_header(path.read_bytes()[:HEADER_SIZE], path)
+        self._chunk_bytes = self.chunk_rows * _VALUE.itemsize * len(COLUMNS)
+        self._map: Optional[np.memmap] = None
+        self._remap()
+        self.last_ts = -math.inf
+        if self.rows:
+            chunk, offset = divmod(self.rows - 1, self.chunk_rows)
+            self.last_ts = float(self._column(chunk, 0)[offset])
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.flush()
+        self._map = np.memmap(self.path, dtype=np.uint8, mode="r+")
+        self._chunks = (len(self._map) - HEADER_SIZE) // self._chunk_bytes
+
+    def _column(self, chunk: int, column: int) -> np.ndarray:
+        offset = HEADER_SIZE + chunk * self._chunk_bytes + column * self.chunk_rows * _VALUE.itemsize
+        return np.ndarray((self.chunk_rows,), dtype=_VALUE, buffer=self._map, offset=offset)
+
+    def append(self, rows: np.ndarray):
+        """Дописывает строки (массив len(rows) x len(COLUMNS)); время, меньшее предыдущего, заменяется предыдущим."""
+        rows[:, 0] = np.maximum.accumulate(np.maximum(rows[:, 0], self.last_ts))
+        written = 0
+        while written < len(rows):
+            chunk, offset = divmod(self.rows, self.chunk_rows)
+            if chunk >= self._chunks:
+                with open(self.path, "r+b") as f:
+                    f.truncate(HEADER_SIZE + (chunk + 1) * self._chunk_bytes)
+                self._remap()
+            count = min(self.chunk_rows - offset, len(rows) - written)
+            for column in range(len(COLUMNS)):
+                self._column(chunk, column)[offset:offset + count] = rows[written:written + count, column]
+            written += count
+            self.rows += count
+        self.last_ts = float(rows[-1, 0])
+        # Число строк - после данных: читатель не увидит недописанных строк
+        np.ndarray((1,), dtype="<u8", buffer=self._map, offset=_ROWS_OFFSET)[0] = self.rows
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map = None
+
+
+class HistoryWriter:
+    """
+    Строки лучших цен из event loop копятся в буфере (append - только добавление в список),
+    flush записывает их в файлы рынков и вызывается вне event loop (в отдельном потоке).
+    """
+
+    def __init__(self, directory: Path, chunk_rows: int):
+        self._directory = Path(directory)
+        self._chunk_rows = chunk_rows
+        self._pending: Dict[MarketKey, List[Tuple[float, ...]]] = {}
+        self._lock = threading.Lock()
+        # Запись и закрытие файлов не пересекаются, даже если flush еще выполняется в потоке при остановке
+        self._write_lock = threading.Lock()
+        self._writers: "OrderedDict[MarketKey, _SeriesWriter]" = OrderedDict()
+        self.rows = 0
+
+    def append(self, exchange_id: str, symbol: str, data: Dict[str, Any]):
+        """Добавляет лучшие цены обновления; время - receivedAt (мс), а без него - текущее."""
+        received_at = data.get("receivedAt")
+        row = (
+            time.time() * 1000 if received_at is None else float(received_at),
+            *(math.nan if data.get(field) is None else float(data[field])
+              for field in ("bid", "ask", "bidVolume", "askVolume")),
+        )
+        with self._lock:
+            rows = self._pending.get((exchange_id, symbol))
+            if rows is None:
+                rows = self._pending[(exchange_id, symbol)] = []
+            rows.append(row)
+
+    def flush(self) -> int:
+        """Записывает накопленные строки; возвращает их число."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        written = 0
+        with self._write_lock:
+            for market, rows in pending.items():
+                try:
+                    self._writer(market).append(np.array(rows, dtype=_VALUE))
+                    written += len(rows)
+                except Exception as e:
+                    logger.error(f"Ошибка записи истории лучших цен {market[0]}:{market[1]}: {e}", exc_info=True)
+        self.rows += written
+        return written
+
+    def close(self):
+        self.flush()
+        with self._write_lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+
+    def _writer(self, market: MarketKey) -> _SeriesWriter:
+        writer = self._writers.get(market)
+        if writer is not None:
+            self._writers.move_to_end(market)
+            return writer
+        if len(self._writers) >= _MAX_OPEN_WRITERS:
+            _, oldest = self._writers.popitem(last=False)
+            oldest.close()
+        writer = self._writers[market] = _SeriesWriter(series_path(self._directory, *market), self._chunk_rows)
+        return writer
+
+
+class HistorySeries:
+    """Строки одного рынка, отображенные в память только для чтения; колонки отдаются представлениями без копирования."""
+
+    def __init__(self, path: Path):
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        self.chunk_rows, rows = _read_header(self._map[:HEADER_SIZE].tobytes(), path)
+        self._chunk_bytes = self.chunk_rows * _VALUE.itemsize * len(COLUMNS)
+        # Учитываются только блоки, целиком попавшие в отображение
+        self.rows = min(rows, (len(self._map) - HEADER_SIZE) // self._chunk_bytes * self.chunk_rows)
+
+    def _column(self, chunk: int, column: int) -> np.ndarray:
+        offset = HEADER_SIZE + chunk * self._chunk_bytes + column * self.chunk_rows * _VALUE.itemsize
+        return np.ndarray((min(self.chunk_rows, self.rows - chunk * self.chunk_rows),), dtype=_VALUE,
+                          buffer=self._map, offset=offset)
+
+    def slices(self, start_ms: float, end_ms: float) -> Iterator[Dict[str, np.ndarray]]:
+        """Строки с start_ms <= ts < end_ms по блокам: {колонка: представление}."""
+        chunks = -(-self.rows // self.chunk_rows)
+        if chunks == 0:
+            return
+        # Время первой строки каждого блока - шаг по файлу размером в блок
+        first_ts = np.ndarray((chunks,), dtype=_VALUE, buffer=self._map, offset=HEADER_SIZE, strides=(self._chunk_bytes,))
+        first_chunk = max(0, int(np.searchsorted(first_ts, start_ms, side="right")) - 1)
+        end_chunk = int(np.searchsorted(first_ts, end_ms, side="left"))
+        for chunk in range(first_chunk, end_chunk):
+            ts = self._column(chunk, 0)
+            low, high = np.searchsorted(ts, start_ms, side="left"), np.searchsorted(ts, end_ms, side="left")
+            if low < high:
+                yield {name: self._column(chunk, column)[low:high] for column, name in enumerate(COLUMNS)}
+
+
+def downsample(series: HistorySeries, start_ms: int, step_ms: int, buckets: int,
+               max_age_ms: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    bid и ask на конец каждого интервала [start_ms + i * step_ms, start_ms + (i + 1) * step_ms).
+    Котировка действует до следующей, но не дольше max_age_ms (0 - без ограничения); NaN - котировки нет.
+    """
+    bid, ask, quote_ts = (np.full(buckets, np.nan) for _ in range(3))
+    lookback = max_age_ms if max_age_ms > 0 else 0
+    for rows in series.slices(start_ms - lookback, start_ms + buckets * step_ms):
+        # Строки до start_ms (не старше max_age_ms) - начальное значение первого интервала
+        index = np.maximum((rows["ts"] - start_ms) // step_ms, 0).astype(np.intp)
+        # Время не убывает: последняя строка интервала - там, где меняется номер интервала
+        last = np.flatnonzero(np.diff(index, append=index[-1] + 1))
+        bid[index[last]] = rows["bid"][last]
+        ask[index[last]] = rows["ask"][last]
+        quote_ts[index[last]] = rows["ts"][last]
+    positions = np.arange(buckets)
+    filled = np.where(np.isnan(quote_ts), 0, positions)
+    np.maximum.accumulate(filled, out=filled)
+    bid, ask, quote_ts = bid[filled], ask[filled], quote_ts[filled]
+    if max_age_ms > 0:
+        stale = (filled != positions) & (start_ms + positions * step_ms - quote_ts > max_age_ms)
+        bid[stale] = np.nan
+        ask[stale] = np.nan
+    return bid, ask
+
+
+def spread_history(directory: Path, pair: str, exchanges: Optional[Sequence[str]], start_ms: int, end_ms: int,
+                   step_ms: int, max_age_ms: float) -> Dict[str, Any]:
+    """
+    Прореженные bid/ask пары на биржах exchanges (None - все биржи с историей пары) и спред
+    для каждой упорядоченной пары бирж: (bid продажи - ask покупки) / ask покупки, %.
+    Значения - массивы numpy (NaN - нет котировки) для сериализации orjson.
+    """
+    directory = Path(directory)
+    if exchanges is None:
+        exchanges = sorted(path.parent.name for path in directory.glob(f"*/{series_path(Path(), '', pair).name}"))
+    buckets = max(1, -(-(end_ms - start_ms) // step_ms))
+    quotes: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for exchange_id in exchanges:
+        path = series_path(directory, exchange_id, pair)
+        if path.exists():
+            quotes[exchange_id] = downsample(HistorySeries(path), start_ms, step_ms, buckets, max_age_ms)
+    spreads = []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for buy_exchange, (_, buy_ask) in quotes.items():
+            for sell_exchange, (sell_bid, _) in quotes.items():
+                if buy_exchange != sell_exchange:
+                    spreads.append({
+                        "buy_exchange": buy_exchange,
+                        "sell_exchange": sell_exchange,
+                        "spread_percent": (sell_bid - buy_ask) / buy_ask * 100,
+                    })
+    return {
+        "pair": pair,
+        "start": start_ms,
+        "end": end_ms,
+        "step_ms": step_ms,
+        "timestamps": start_ms + np.arange(buckets, dtype=np.int64) * step_ms,
+        "exchanges": {exchange_id: {"bid": bid, "ask": ask} for exchange_id, (bid, ask) in quotes.items()},
+        "spreads": spreads,
+    }
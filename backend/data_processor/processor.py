@@ -1,110 +1,264 @@
 # backend/data_processor/processor.py
-import redis.asyncio as redis
-import json
+import asyncio
+import time
+from pathlib import Path
 import ccxtpro
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Iterable, List, Set, Tuple
 
 from backend.core.config import settings
+from backend.core.types import MarketKey, MarketSnapshot
+from backend.data_processor.store import MarketDataStore, create_market_data_store, orderbook_key, ticker_key
+from backend.data_processor.recorder import MarketRecorder
+from backend.data_processor.history import HistoryWriter
+from backend.monitoring import redis_write_updates, redis_write_conflated, redis_write_dropped, redis_flush_batch_size, \
+    market_data_cache_latency
 from backend.utils.logger import logger
 
+
 class DataProcessor:
-    def __init__(self):
-        self._redis_client: Optional[redis.Redis] = None
+    def __init__(self, store: Optional[MarketDataStore] = None):
+        # Хранилище последних записей рынков (MARKET_DATA_STORE): Redis или память процесса
+        self._store = store if store is not None else create_market_data_store(settings.MARKET_DATA_STORE)
         self._exchange_instances: Dict[str, Any] = {}
+        # Рынки, обновившиеся с момента последнего чтения инкрементальным поиском
+        self._dirty_markets: Set[MarketKey] = set()
+        self._dirty_event = asyncio.Event()
+        # Буфер записи: ключ записи -> (последние данные, рынок). Пока writer не запущен, запись идет напрямую
+        self._pending: Dict[str, Tuple[Dict[str, Any], MarketKey, str]] = {}
+        self._batch_full = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        # Журнал обновлений на диске (MARKET_RECORDER_DIR); ведется, пока запущена буферизованная запись
+        self._recorder: Optional[MarketRecorder] = None
+        # История лучших цен (HISTORY_DIR): строки копятся в буфере, файлы пишет отдельная задача через поток
+        self._history: Optional[HistoryWriter] = None
+        self._history_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._store.is_connected
 
-    async def connect_redis(self):
-        """Подключается к Redis."""
+    @property
+    def store(self) -> MarketDataStore:
+        return self._store
+
+    async def connect(self):
+        """Подключается к хранилищу рыночных данных."""
         try:
-            if self._redis_client is None:
-                self._redis_client = redis.Redis(
-                    host=settings.REDIS_HOST,
-                    port=settings.REDIS_PORT,
-                    db=settings.REDIS_DB,
-                    decode_responses=True
-                )
-                await self._redis_client.ping()
-                logger.info("Успешно подключено к Redis")
+            await self._store.connect()
         except Exception as e:
-            logger.error(f"Ошибка подключения к Redis: {e}", exc_info=True)
-            self._redis_client = None
+            logger.error(f"Ошибка подключения к хранилищу рыночных данных ({settings.MARKET_DATA_STORE}): {e}", exc_info=True)
             raise
 
-    async def disconnect_redis(self):
-        """Отключается от Redis."""
+    async def disconnect(self):
+        """Отключается от хранилища рыночных данных."""
         try:
-            if self._redis_client is not None:
-                await self._redis_client.aclose()
-                logger.info("Отключено от Redis")
+            await self._store.disconnect()
         except Exception as e:
-            logger.error(f"Ошибка отключения от Redis: {e}", exc_info=True)
-        finally:
-            self._redis_client = None
+            logger.error(f"Ошибка отключения от хранилища рыночных данных: {e}", exc_info=True)
+
+    # Прежние имена времен, когда хранилищем был только Redis; подключают хранилище MARKET_DATA_STORE
+    connect_redis = connect
+    disconnect_redis = disconnect
 
     async def cache_orderbook(self, exchange_id: str, symbol: str, orderbook_data: Dict[str, Any]):
-        """Кэширует данные стакана в Redis."""
-        if self._redis_client is None:
-            logger.error("Redis клиент не инициализирован")
+        """Кэширует данные стакана в хранилище (через буфер записи, если он запущен)."""
+        return await self._cache(orderbook_key(exchange_id, symbol), exchange_id, symbol, orderbook_data, "orderbook")
+
+    @staticmethod
+    def _observe_cache_latency(updates: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Задержка от получения обновления коллектором до записи в хранилище, по биржам."""
+        now_ms = time.time() * 1000
+        histograms: Dict[str, Any] = {}
+        for exchange_id, data in updates:
+            received_at = data.get("receivedAt")
+            if received_at is None:
+                continue
+            histogram = histograms.get(exchange_id)
+            if histogram is None:
+                histogram = histograms[exchange_id] = market_data_cache_latency.labels(exchange=exchange_id)
+            histogram.observe(max(0.0, (now_ms - received_at) / 1000))
+
+    async def _cache(self, key: str, exchange_id: str, symbol: str, data: Dict[str, Any], kind: str) -> bool:
+        if not self._store.is_connected:
+            logger.error("Хранилище рыночных данных не подключено")
             return False
-        key = f"orderbook:{exchange_id}:{symbol}"
+        if self._recorder is not None:
+            self._recorder.record(kind, exchange_id, symbol, data)
+        if self._history is not None and kind == "orderbook":
+            self._history.append(exchange_id, symbol, data)
+        if self._writer_task is not None:
+            self._enqueue(key, (exchange_id, symbol), data, kind)
+            return True
         try:
-            serialized_data = json.dumps(orderbook_data)
-            await self._redis_client.set(key, serialized_data, ex=60)  # Храним 60 секунд
-            logger.debug(f"Успешно кэширован стакан для {exchange_id}:{symbol}")
+            await self._store.write(((kind, exchange_id, symbol, data),), time.time() * 1000)
+            self._observe_cache_latency(((exchange_id, data),))
+            self._mark_dirty(exchange_id, symbol)
+            logger.debug(f"Успешно кэширован {kind} для {exchange_id}:{symbol}")
             return True
         except Exception as e:
-            logger.error(f"Ошибка кэширования стакана для {exchange_id}:{symbol} в Redis: {e}", exc_info=True)
+            logger.error(f"Ошибка кэширования ({kind}) для {exchange_id}:{symbol} в хранилище: {e}", exc_info=True)
             return False
 
-    async def get_orderbook(self, exchange_id: str, symbol: str) -> Optional[Dict[str, Any]]:
-        """Получает данные стакана из Redis."""
-        if self._redis_client is None:
-            logger.error("Redis клиент не инициализирован")
-            return None
-        key = f"orderbook:{exchange_id}:{symbol}"
+    def _enqueue(self, key: str, market: MarketKey, data: Dict[str, Any], kind: str):
+        """Кладет обновление в буфер; более старое несброшенное обновление того же ключа заменяется."""
+        redis_write_updates.inc()
+        if key in self._pending:
+            redis_write_conflated.inc()
+        self._pending[key] = (data, market, kind)
+        if len(self._pending) >= settings.REDIS_FLUSH_BATCH_SIZE:
+            self._batch_full.set()
+
+    def start_writer(self):
+        """Запускает буферизованную запись: обновления объединяются по ключу и сбрасываются пачками."""
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer_loop(), name="redis_writer")
+        if self._recorder is None and settings.MARKET_RECORDER_DIR:
+            self._recorder = MarketRecorder(
+                Path(settings.MARKET_RECORDER_DIR),
+                segment_bytes=int(settings.MARKET_RECORDER_SEGMENT_MB * 1024 * 1024),
+                segment_seconds=settings.MARKET_RECORDER_SEGMENT_SECONDS,
+                max_segments=settings.MARKET_RECORDER_MAX_SEGMENTS,
+                depth=settings.ORDERBOOK_DEPTH,
+            )
+            logger.info(f"Журнал рыночных данных пишется в {settings.MARKET_RECORDER_DIR}")
+        if self._history is None and settings.HISTORY_DIR:
+            self._history = HistoryWriter(Path(settings.HISTORY_DIR), settings.HISTORY_CHUNK_ROWS)
+            self._history_task = asyncio.create_task(self._history_loop(self._history), name="history_writer")
+            logger.info(f"История лучших цен пишется в {settings.HISTORY_DIR}")
+
+    async def stop_writer(self):
+        """Останавливает буферизованную запись, сбрасывая накопленные обновления."""
+        recorder, self._recorder = self._recorder, None
+        if recorder is not None:
+            # Закрытие ждет записи последнего блока на диск - вне event loop
+            await asyncio.to_thread(recorder.close)
+        history, self._history = self._history, None
+        if history is not None:
+            history_task, self._history_task = self._history_task, None
+            history_task.cancel()
+            await asyncio.gather(history_task, return_exceptions=True)
+            await asyncio.to_thread(history.close)
+        task, self._writer_task = self._writer_task, None
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def _writer_loop(self):
+        interval = settings.REDIS_FLUSH_INTERVAL_MS / 1000
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_full.clear()
+            await self.flush()
+
+    @staticmethod
+    async def _history_loop(history: HistoryWriter):
+        while True:
+            await asyncio.sleep(settings.HISTORY_FLUSH_INTERVAL)
+            await asyncio.to_thread(history.flush)
+
+    async def flush(self) -> int:
+        """Записывает все накопленные ключи одной пачкой (в Redis - одним pipeline); возвращает число записанных ключей."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        if not self._store.is_connected:
+            redis_write_dropped.inc(len(pending))
+            return 0
         try:
-            serialized_data = await self._redis_client.get(key)
-            if serialized_data:
-                orderbook = json.loads(serialized_data)
-                logger.debug(f"Получен стакан для {exchange_id}:{symbol} из Redis")
-                return orderbook
-            logger.debug(f"Стакан для {exchange_id}:{symbol} не найден в Redis")
+            await self._store.write(
+                [(kind, exchange_id, symbol, data) for data, (exchange_id, symbol), kind in pending.values()],
+                time.time() * 1000, buffered=True,
+            )
+        except Exception as e:
+            redis_write_dropped.inc(len(pending))
+            logger.error(f"Ошибка сброса {len(pending)} ключей в хранилище: {e}", exc_info=True)
+            return 0
+        redis_flush_batch_size.observe(len(pending))
+        self._observe_cache_latency((exchange_id, data) for data, (exchange_id, _), _ in pending.values())
+        # Рынки помечаются обновившимися только после записи, чтобы поиск читал уже новые данные
+        for _, (exchange_id, symbol), _ in pending.values():
+            self._mark_dirty(exchange_id, symbol)
+        return len(pending)
+
+    async def _get(self, key: str, kind: str, exchange_id: str, symbol: str, name: str) -> Optional[Dict[str, Any]]:
+        if not self._store.is_connected:
+            logger.error("Хранилище рыночных данных не подключено")
             return None
+        pending = self._pending.get(key)
+        if pending is not None:
+            # Несброшенное обновление новее значения в хранилище
+            return pending[0]
+        try:
+            record = await self._store.get(kind, exchange_id, symbol)
         except Exception as e:
-            logger.error(f"Ошибка получения стакана для {exchange_id}:{symbol} из Redis: {e}", exc_info=True)
+            logger.error(f"Ошибка получения {name} для {exchange_id}:{symbol} из хранилища: {e}", exc_info=True)
             return None
+        if record is None:
+            logger.debug(f"Данные {name} для {exchange_id}:{symbol} не найдены в хранилище")
+        return record
+
+    async def get_orderbook(self, exchange_id: str, symbol: str) -> Optional[Dict[str, Any]]:
+        """Получает данные стакана из хранилища."""
+        return await self._get(orderbook_key(exchange_id, symbol), "orderbook", exchange_id, symbol, "стакана")
 
     async def cache_ticker(self, exchange_id: str, symbol: str, ticker_data: Dict[str, Any]):
-        """Кэширует данные тикера в Redis."""
-        if self._redis_client is None:
-            logger.error("Redis клиент не инициализирован")
-            return False
-        key = f"ticker:{exchange_id}:{symbol}"
-        try:
-            serialized_data = json.dumps(ticker_data)
-            await self._redis_client.set(key, serialized_data, ex=60)
-            logger.debug(f"Успешно кэширован тикер для {exchange_id}:{symbol}")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка кэширования тикера для {exchange_id}:{symbol} в Redis: {e}", exc_info=True)
-            return False
+        """Кэширует данные тикера в хранилище (через буфер записи, если он запущен)."""
+        return await self._cache(ticker_key(exchange_id, symbol), exchange_id, symbol, ticker_data, "ticker")
 
     async def get_ticker(self, exchange_id: str, symbol: str) -> Optional[Dict[str, Any]]:
-        """Получает данные тикера из Redis."""
-        if self._redis_client is None:
-            logger.error("Redis клиент не инициализирован")
-            return None
-        key = f"ticker:{exchange_id}:{symbol}"
+        """Получает данные тикера из хранилища."""
+        return await self._get(ticker_key(exchange_id, symbol), "ticker", exchange_id, symbol, "тикера")
+
+    def _mark_dirty(self, exchange_id: str, symbol: str):
+        self._dirty_markets.add((exchange_id, symbol))
+        self._dirty_event.set()
+
+    async def wait_dirty_markets(self, coalesce_seconds: float = 0.0) -> Set[MarketKey]:
+        """
+        Ждет обновления рынков и возвращает набор (биржа, символ), изменившихся с прошлого вызова.
+        После первого обновления ждет coalesce_seconds, чтобы объединить пачку обновлений в один пересчет.
+        """
+        await self._dirty_event.wait()
+        if coalesce_seconds > 0:
+            await asyncio.sleep(coalesce_seconds)
+        dirty, self._dirty_markets = self._dirty_markets, set()
+        self._dirty_event.clear()
+        return dirty
+
+    async def get_market_snapshot(self, keys: Iterable[MarketKey]) -> MarketSnapshot:
+        """
+        Получает стаканы и тикеры для набора (биржа, символ) одним запросом к хранилищу
+        (в Redis - один MGET, каждый ключ декодируется один раз) и возвращает неизменяемый срез.
+        """
+        market_keys: List[MarketKey] = list(dict.fromkeys(keys))
+        if not self._store.is_connected:
+            logger.error("Хранилище рыночных данных не подключено")
+            return MarketSnapshot({}, {})
+        if not market_keys:
+            return MarketSnapshot({}, {})
         try:
-            serialized_data = await self._redis_client.get(key)
-            if serialized_data:
-                ticker = json.loads(serialized_data)
-                logger.debug(f"Получен тикер для {exchange_id}:{symbol} из Redis")
-                return ticker
-            logger.debug(f"Тикер для {exchange_id}:{symbol} не найден в Redis")
-            return None
+            orderbooks, tickers = await self._store.get_many(market_keys)
         except Exception as e:
-            logger.error(f"Ошибка получения тикера для {exchange_id}:{symbol} из Redis: {e}", exc_info=True)
-            return None
+            logger.error(f"Ошибка получения среза рыночных данных из хранилища: {e}", exc_info=True)
+            return MarketSnapshot({}, {})
+
+        taken_at = time.time()
+        if self._pending:
+            # Несброшенные обновления буфера новее значений в хранилище
+            for market_key in market_keys:
+                pending = self._pending.get(orderbook_key(*market_key))
+                if pending is not None:
+                    orderbooks[market_key] = pending[0]
+                pending = self._pending.get(ticker_key(*market_key))
+                if pending is not None:
+                    tickers[market_key] = pending[0]
+        logger.debug(f"Получен срез рыночных данных: {len(orderbooks)} стаканов, {len(tickers)} тикеров")
+        return MarketSnapshot(orderbooks, tickers, taken_at)
 
     def get_exchange(self, exchange_id: str) -> Optional[Any]:
         """Возвращает экземпляр биржи."""
@@ -0,0 +1,196 @@
+# backend/data_processor/recorder.py
+"""
+Запись всех обновлений рыночных данных на диск для воспроизведения (arbitrage_finder/replay.py).
+
+Журнал - сегменты market-<время начала, мс>-<pid>.mdlog в одной директории, только дозапись.
+Сегмент: заголовок SEGMENT_MAGIC, затем блоки: длина сжатых данных и их CRC32 (uint32 little-endian)
+и zlib-сжатая последовательность кадров. Кадр: время записи (double, мс Unix), длины биржи, символа
+и записи (uint8, uint16, uint32), затем сами байты; запись - в формате records.py.
+Недописанный блок в конце сегмента (остановка процесса посреди записи) при чтении пропускается.
+
+Сжатие и запись на диск выполняются в отдельном потоке, event loop только добавляет кадр в буфер.
+Буфер сбрасывается блоком по размеру или по flush_interval, проверяемому при следующем обновлении и при остановке.
+"""
+import heapq
+import itertools
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, BinaryIO
+
+from backend.core.types import MarketKey
+from backend.data_processor.records import RECORD_ORDERBOOK, encode_orderbook, encode_ticker, decode_record
+from backend.utils.logger import logger
+
+SEGMENT_MAGIC = b"MDLOG\x01"
+SEGMENT_SUFFIX = ".mdlog"
+_BLOCK_HEADER = struct.Struct("<II")
+_FRAME_HEADER = struct.Struct("<dBHI")
+_COMPRESSION_LEVEL = 3
+
+
+class RecordedUpdate(NamedTuple):
+    recorded_at: float
+    kind: str
+    market: MarketKey
+    record: bytes
+
+    def decode(self) -> Dict[str, Any]:
+        return decode_record(self.record)
+
+
+class MarketRecorder:
+    """
+    Дописывает обновления рынков в сегменты журнала. Новый сегмент начинается, когда текущий больше
+    segment_bytes или старше segment_seconds; при max_segments > 0 самые старые сегменты этого процесса удаляются.
+    """
+
+    def __init__(self, directory: Path, segment_bytes: int, segment_seconds: float, max_segments: int = 0,
+                 block_bytes: int = 256 * 1024, flush_interval: float = 1.0, depth: int = 0xFFFF):
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._segment_bytes = segment_bytes
+        self._segment_seconds = segment_seconds
+        self._max_segments = max_segments
+        self._block_bytes = block_bytes
+        self._flush_interval = flush_interval
+        self._depth = depth
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._buffer_started = 0.0
+        self._lock = threading.Lock()
+        # Один поток: блоки пишутся в порядке поступления
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="market_recorder")
+        self._file: Optional[BinaryIO] = None
+        self._file_opened_at = 0.0
+        self._segment_started_ms = 0
+        self._segments: List[Path] = []
+        self.updates = 0
+
+    def record(self, kind: str, exchange_id: str, symbol: str, data: Dict[str, Any], recorded_at: Optional[float] = None):
+        """Добавляет обновление в журнал (kind - "orderbook" или "ticker")."""
+        recorded_at = time.time() * 1000 if recorded_at is None else recorded_at
+        record = (encode_orderbook(data, self._depth, recorded_at) if kind == "orderbook"
+                  else encode_ticker(data, recorded_at))
+        exchange_bytes, symbol_bytes = exchange_id.encode(), symbol.encode()
+        frame = b"".join((
+            _FRAME_HEADER.pack(recorded_at, len(exchange_bytes), len(symbol_bytes), len(record)),
+            exchange_bytes, symbol_bytes, record,
+        ))
+        with self._lock:
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+            self._buffer.append(frame)
+            self._buffered += len(frame)
+            self.updates += 1
+            full = (self._buffered >= self._block_bytes
+                    or time.monotonic() - self._buffer_started >= self._flush_interval)
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Передает накопленные кадры на сжатие и запись."""
+        with self._lock:
+            if not self._buffer:
+                return
+            payload, self._buffer, self._buffered = b"".join(self._buffer), [], 0
+        self._executor.submit(self._write_block, payload)
+
+    def close(self):
+        """Записывает остаток буфера и закрывает текущий сегмент."""
+        self.flush()
+        self._executor.shutdown(wait=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write_block(self, payload: bytes):
+        try:
+            compressed = zlib.compress(payload, _COMPRESSION_LEVEL)
+            segment = self._current_segment()
+            segment.write(_BLOCK_HEADER.pack(len(compressed), zlib.crc32(compressed)))
+            segment.write(compressed)
+            segment.flush()
+        except Exception as e:
+            logger.error(f"Ошибка записи журнала рыночных данных: {e}", exc_info=True)
+
+    def _current_segment(self) -> BinaryIO:
+        segment = self._file
+        if segment is not None and (segment.tell() >= self._segment_bytes
+                                    or time.monotonic() - self._file_opened_at >= self._segment_seconds):
+            segment.close()
+            segment = self._file = None
+        if segment is None:
+            # Время начала строго растет: сегменты, начатые в одну миллисекунду, не сливаются в один файл
+            self._segment_started_ms = max(int(time.time() * 1000), self._segment_started_ms + 1)
+            path = self._directory / f"market-{self._segment_started_ms:013d}-{os.getpid()}{SEGMENT_SUFFIX}"
+            segment = self._file = open(path, "ab")
+            if segment.tell() == 0:
+                segment.write(SEGMENT_MAGIC)
+            self._file_opened_at = time.monotonic()
+            self._segments.append(path)
+            logger.info(f"Журнал рыночных данных: новый сегмент {path.name}")
+            if self._max_segments > 0:
+                while len(self._segments) > self._max_segments:
+                    oldest = self._segments.pop(0)
+                    try:
+                        oldest.unlink()
+                    except OSError as e:
+                        logger.warning(f"Не удалось удалить старый сегмент журнала {oldest}: {e}")
+        return segment
+
+
+def read_segment(path: Path) -> Iterator[RecordedUpdate]:
+    """Обновления одного сегмента по порядку записи; поврежденный или недописанный хвост пропускается."""
+    with open(path, "rb") as segment:
+        if segment.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            raise ValueError(f"{path} не является сегментом журнала рыночных данных")
+        while True:
+            header = segment.read(_BLOCK_HEADER.size)
+            if len(header) < _BLOCK_HEADER.size:
+                return
+            length, crc = _BLOCK_HEADER.unpack(header)
+            compressed = segment.read(length)
+            if len(compressed) < length or zlib.crc32(compressed) != crc:
+                logger.warning(f"Журнал {path.name}: поврежденный или недописанный блок в конце сегмента пропущен.")
+                return
+            payload = zlib.decompress(compressed)
+            offset = 0
+            while offset < len(payload):
+                recorded_at, exchange_length, symbol_length, record_length = _FRAME_HEADER.unpack_from(payload, offset)
+                offset += _FRAME_HEADER.size
+                exchange_id = payload[offset:offset + exchange_length].decode()
+                offset += exchange_length
+                symbol = payload[offset:offset + symbol_length].decode()
+                offset += symbol_length
+                record = payload[offset:offset + record_length]
+                offset += record_length
+                # Тип записи - 4-й байт заголовка records.py
+                kind = "orderbook" if record[3] == RECORD_ORDERBOOK else "ticker"
+                yield RecordedUpdate(recorded_at, kind, (exchange_id, symbol), record)
+
+
+def recording_segments(source: Path) -> List[Path]:
+    """Сегменты журнала: файл source или все сегменты директории source."""
+    source = Path(source)
+    if source.is_file():
+        return [source]
+    return sorted(source.glob(f"*{SEGMENT_SUFFIX}"))
+
+
+def read_recording(source: Path) -> Iterator[RecordedUpdate]:
+    """
+    Все обновления журнала по времени записи. Сегменты одного процесса идут друг за другом,
+    а журналы разных процессов (воркеров коллектора) сливаются по времени.
+    """
+    by_writer: Dict[str, List[Path]] = {}
+    for path in recording_segments(source):
+        by_writer.setdefault(path.stem.rsplit("-", 1)[-1], []).append(path)
+    streams: Iterable[Iterator[RecordedUpdate]] = [
+        itertools.chain.from_iterable(read_segment(path) for path in sorted(paths)) for paths in by_writer.values()
+    ]
+    return heapq.merge(*streams, key=lambda update: update.recorded_at)
@@ -0,0 +1,156 @@
+# backend/data_processor/records.py
+import json
+import math
+import struct
+import sys
+from array import array
+from typing import Dict, Any, Optional, Sequence, Tuple, Union
+
+# Бинарная запись рыночных данных в Redis.
+# Заголовок: magic, версия формата, тип записи, timestamp биржи, время получения (receivedAt),
+# время записи в кэш (cachedAt), ask, askVolume, bid, bidVolume, число уровней bids и asks;
+# затем массивы double: цены bids, объемы bids, цены asks, объемы asks.
+# Времена - миллисекунды Unix. Отсутствующие значения хранятся как NaN. Все числа - little-endian.
+# Версия 1 (без receivedAt и cachedAt) читается для ключей, записанных до обновления.
+RECORD_MAGIC = b"MD"
+RECORD_VERSION = 2
+RECORD_ORDERBOOK = 1
+RECORD_TICKER = 2
+
+_HEADER = struct.Struct("<2sBBdddddddHH")
+_HEADER_V1 = struct.Struct("<2sBBdddddHH")
+_MAX_LEVELS = 0xFFFF
+_NAN = float("nan")
+_SWAP_BYTES = sys.byteorder != "little"
+
+Levels = Sequence[Sequence[Any]]
+
+
+def _number(value: Any) -> float:
+    return _NAN if value is None else float(value)
+
+
+def _optional(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def _split_levels(levels: Optional[Levels], depth: int) -> Tuple[array, array]:
+    prices, sizes = array("d"), array("d")
+    for level in (levels or ())[:depth]:
+        prices.append(float(level[0]))
+        sizes.append(float(level[1]))
+    return prices, sizes
+
+
+def _encode(kind: int, data: Dict[str, Any], bids: Optional[Levels], asks: Optional[Levels], depth: int,
+            cached_at: Optional[float]) -> bytes:
+    bid_prices, bid_sizes = _split_levels(bids, depth)
+    ask_prices, ask_sizes = _split_levels(asks, depth)
+    # Лучшие цены берем из записи, а если их нет - из первого уровня
+    ask = data.get("ask", ask_prices[0] if ask_prices else None)
+    ask_volume = data.get("askVolume", ask_sizes[0] if ask_sizes else None)
+    bid = data.get("bid", bid_prices[0] if bid_prices else None)
+    bid_volume = data.get("bidVolume", bid_sizes[0] if bid_sizes else None)
+    header = _HEADER.pack(
+        RECORD_MAGIC, RECORD_VERSION, kind,
+        _number(data.get("timestamp")), _number(data.get("receivedAt")), _number(cached_at),
+        _number(ask), _number(ask_volume), _number(bid), _number(bid_volume),
+        len(bid_prices), len(ask_prices),
+    )
+    if _SWAP_BYTES:
+        for levels in (bid_prices, bid_sizes, ask_prices, ask_sizes):
+            levels.byteswap()
+    return b"".join((header, bid_prices.tobytes(), bid_sizes.tobytes(), ask_prices.tobytes(), ask_sizes.tobytes()))
+
+
+def encode_orderbook(orderbook: Dict[str, Any], depth: int = _MAX_LEVELS, cached_at: Optional[float] = None) -> bytes:
+    """
+    Кодирует стакан: лучшие цены, timestamp, receivedAt, время записи cached_at (мс)
+    и не более depth уровней на сторону; прочие поля (info и т.п.) отбрасываются.
+    """
+    return _encode(RECORD_ORDERBOOK, orderbook, orderbook.get("bids"), orderbook.get("asks"), min(depth, _MAX_LEVELS), cached_at)
+
+
+def encode_ticker(ticker: Dict[str, Any], cached_at: Optional[float] = None) -> bytes:
+    """Кодирует тикер: только ask/bid, их объемы, timestamp, receivedAt и время записи cached_at (мс)."""
+    return _encode(RECORD_TICKER, ticker, None, None, 0, cached_at)
+
+
+def _record(data: Dict[str, Any], bids: Optional[Levels], asks: Optional[Levels], depth: int,
+            cached_at: Optional[float]) -> Dict[str, Any]:
+    bid_levels = [(float(level[0]), float(level[1])) for level in (bids or ())[:depth]]
+    ask_levels = [(float(level[0]), float(level[1])) for level in (asks or ())[:depth]]
+    ask = data.get("ask", ask_levels[0][0] if ask_levels else None)
+    ask_volume = data.get("askVolume", ask_levels[0][1] if ask_levels else None)
+    bid = data.get("bid", bid_levels[0][0] if bid_levels else None)
+    bid_volume = data.get("bidVolume", bid_levels[0][1] if bid_levels else None)
+    timestamp = data.get("timestamp")
+    record: Dict[str, Any] = {
+        "timestamp": None if timestamp is None else int(timestamp),
+        "receivedAt": _optional(_number(data.get("receivedAt"))),
+        "cachedAt": _optional(_number(cached_at)),
+        "ask": _optional(_number(ask)),
+        "askVolume": _optional(_number(ask_volume)),
+        "bid": _optional(_number(bid)),
+        "bidVolume": _optional(_number(bid_volume)),
+    }
+    if bids is not None or asks is not None:
+        record["bids"] = bid_levels
+        record["asks"] = ask_levels
+    return record
+
+
+def orderbook_record(orderbook: Dict[str, Any], depth: int = _MAX_LEVELS, cached_at: Optional[float] = None) -> Dict[str, Any]:
+    """Запись стакана в том же виде, что decode_record(encode_orderbook(...)), без кодирования в байты."""
+    return _record(orderbook, orderbook.get("bids") or (), orderbook.get("asks") or (), min(depth, _MAX_LEVELS), cached_at)
+
+
+def ticker_record(ticker: Dict[str, Any], cached_at: Optional[float] = None) -> Dict[str, Any]:
+    """Запись тикера в том же виде, что decode_record(encode_ticker(...)), без кодирования в байты."""
+    return _record(ticker, None, None, 0, cached_at)
+
+
+def decode_record(value: Union[bytes, str]) -> Dict[str, Any]:
+    """
+    Декодирует запись в dict с полями timestamp, receivedAt, cachedAt, ask, askVolume, bid, bidVolume
+    (и bids/asks для стакана).
+    Значения старого формата (JSON) декодируются как раньше - для чтения ключей, записанных до миграции.
+    """
+    if isinstance(value, str) or value[:1] == b"{":
+        return json.loads(value)
+    if len(value) < _HEADER_V1.size:
+        raise ValueError(f"Слишком короткая запись: {len(value)} байт")
+    magic, version = value[:2], value[2]
+    if magic != RECORD_MAGIC:
+        raise ValueError(f"Неизвестный формат записи: {magic!r}")
+    if version == RECORD_VERSION:
+        if len(value) < _HEADER.size:
+            raise ValueError(f"Слишком короткая запись: {len(value)} байт")
+        header = _HEADER
+        (_, _, kind, timestamp, received_at, cached_at,
+         ask, ask_volume, bid, bid_volume, bid_count, ask_count) = header.unpack_from(value)
+    elif version == 1:
+        header = _HEADER_V1
+        _, _, kind, timestamp, ask, ask_volume, bid, bid_volume, bid_count, ask_count = header.unpack_from(value)
+        received_at = cached_at = _NAN
+    else:
+        raise ValueError(f"Неподдерживаемая версия записи: {version}")
+    record: Dict[str, Any] = {
+        # timestamp ccxt - целые миллисекунды
+        "timestamp": None if math.isnan(timestamp) else int(timestamp),
+        "receivedAt": _optional(received_at),
+        "cachedAt": _optional(cached_at),
+        "ask": _optional(ask),
+        "askVolume": _optional(ask_volume),
+        "bid": _optional(bid),
+        "bidVolume": _optional(bid_volume),
+    }
+    if kind == RECORD_ORDERBOOK:
+        levels = array("d")
+        levels.frombytes(value[header.size:header.size + 16 * (bid_count + ask_count)])
+        if _SWAP_BYTES:
+            levels.byteswap()
+        bid_end = 2 * bid_count
+        record["bids"] = list(zip(levels[:bid_count], levels[bid_count:bid_end]))
+        record["asks"] = list(zip(levels[bid_end:bid_end + ask_count], levels[bid_end + ask_count:]))
+    return record
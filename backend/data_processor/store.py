@@ -0,0 +1,298 @@
+# backend/data_processor/store.py
+"""
+Хранилища последних стаканов и тикеров рынков для DataProcessor (MARKET_DATA_STORE):
+"redis" - ключи Redis в бинарном формате records.py (и Redis Streams для FINDER_MODE=stream),
+"memory" - записи в памяти процесса, срез отдается без сериализации.
+Через хранилище же публикуются потоки возможностей поиска (каналы arbitrage:<вид>) для рассылки WebSocket.
+"""
+import asyncio
+import time
+import weakref
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import redis.asyncio as redis
+
+from backend.core.config import settings
+from backend.core.types import MarketKey
+from backend.data_processor.records import encode_orderbook, encode_ticker, decode_record, orderbook_record, \
+    ticker_record
+from backend.monitoring import redis_operation_time
+from backend.utils.logger import logger
+
+# Обновление рынка: (вид записи "orderbook" или "ticker", биржа, символ, данные)
+MarketUpdate = Tuple[str, str, str, Dict[str, Any]]
+# Стаканы и тикеры среза по рынкам
+MarketRecords = Tuple[Dict[MarketKey, Dict[str, Any]], Dict[MarketKey, Dict[str, Any]]]
+# Получатель сообщений каналов возможностей в процессе: (канал, сообщение)
+ChannelListener = Callable[[str, bytes], None]
+
+
+def orderbook_key(exchange_id: str, symbol: str) -> str:
+    return f"orderbook:{exchange_id}:{symbol}"
+
+
+def ticker_key(exchange_id: str, symbol: str) -> str:
+    return f"ticker:{exchange_id}:{symbol}"
+
+
+def market_stream_key(exchange_id: str) -> str:
+    return f"stream:market:{exchange_id}"
+
+
+# Тип записи в поле "k" сообщения стрима
+STREAM_KIND_ORDERBOOK = b"o"
+STREAM_KIND_TICKER = b"t"
+
+
+class MarketDataStore(ABC):
+    """Последние записи рынков: запись пачкой, чтение одной записи и среза по набору рынков."""
+
+    @property
+    @abstractmethod
+    def is_connected(self) -> bool: ...
+
+    @abstractmethod
+    async def connect(self): ...
+
+    @abstractmethod
+    async def disconnect(self): ...
+
+    @abstractmethod
+    async def write(self, updates: Sequence[MarketUpdate], cached_at: float, buffered: bool = False):
+        """
+        Сохраняет обновления; cached_at - время записи в кэш (мс Unix), попадает в записи как cachedAt.
+        buffered - пачка из буфера записи DataProcessor, а не одно обновление напрямую.
+        """
+
+    @abstractmethod
+    async def get(self, kind: str, exchange_id: str, symbol: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def get_many(self, market_keys: List[MarketKey]) -> MarketRecords:
+        """Стаканы и тикеры рынков market_keys (без повторов); отсутствующие рынки пропускаются."""
+
+    @abstractmethod
+    async def publish(self, channel: str, message: bytes, snapshot: bytes):
+        """Публикует сообщение канала возможностей и сохраняет текущий снимок канала для ресинхронизации подписчиков."""
+
+
+class RedisMarketDataStore(MarketDataStore):
+    """Записи в ключах Redis с TTL MARKET_DATA_TTL; каждое обновление также добавляется в стрим биржи."""
+
+    def __init__(self):
+        # Соединения redis.asyncio привязаны к loop, в котором созданы: клиент на каждый loop,
+        # запись удаляется вместе с loop
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, redis.Redis]" = weakref.WeakKeyDictionary()
+        self._connected = False
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    @staticmethod
+    def _create_redis_client() -> redis.Redis:
+        return redis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB,
+            # Рыночные данные хранятся в бинарном формате (records.py)
+            decode_responses=False
+        )
+
+    def _get_client(self) -> redis.Redis:
+        """
+        Возвращает клиент Redis для текущего event loop.
+        При вызове из другого loop (например, из TestClient) создается отдельный клиент этого loop,
+        клиент прежнего loop остается ему, а не теряется с открытыми соединениями.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = self._create_redis_client()
+        return client
+
+    async def connect(self):
+        if not self._connected:
+            client = self._get_client()
+            try:
+                await client.ping()
+            except Exception:
+                self._clients.pop(asyncio.get_running_loop(), None)
+                await client.aclose()
+                raise
+            self._connected = True
+            logger.info("Успешно подключено к Redis")
+
+    async def disconnect(self):
+        self._connected = False
+        clients = list(self._clients.items())
+        self._clients.clear()
+        current_loop = asyncio.get_running_loop()
+        for loop, client in clients:
+            if loop is current_loop:
+                await client.aclose()
+            elif loop.is_running():
+                # Клиент другого работающего loop закрывается в нем самом
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        if clients:
+            logger.info("Отключено от Redis")
+
+    @staticmethod
+    def _queue_write(pipeline: Any, exchange_id: str, symbol: str, kind: str, record: bytes):
+        """Добавляет в pipeline запись последнего значения и сообщение в стрим биржи."""
+        key = orderbook_key(exchange_id, symbol) if kind == "orderbook" else ticker_key(exchange_id, symbol)
+        pipeline.set(key, record, ex=settings.MARKET_DATA_TTL)
+        if settings.MARKET_STREAM_ENABLED:
+            pipeline.xadd(
+                market_stream_key(exchange_id),
+                {
+                    "k": STREAM_KIND_ORDERBOOK if kind == "orderbook" else STREAM_KIND_TICKER,
+                    "s": symbol,
+                    "d": record,
+                },
+                maxlen=settings.MARKET_STREAM_MAXLEN,
+                approximate=True,
+            )
+
+    async def write(self, updates: Sequence[MarketUpdate], cached_at: float, buffered: bool = False):
+        pipeline = self._get_client().pipeline(transaction=False)
+        for kind, exchange_id, symbol, data in updates:
+            record = (encode_orderbook(data, settings.ORDERBOOK_DEPTH, cached_at) if kind == "orderbook"
+                      else encode_ticker(data, cached_at))
+            self._queue_write(pipeline, exchange_id, symbol, kind, record)
+        with redis_operation_time.labels(operation="flush" if buffered else "write").time():
+            await pipeline.execute()
+
+    async def get(self, kind: str, exchange_id: str, symbol: str) -> Optional[Dict[str, Any]]:
+        key = orderbook_key(exchange_id, symbol) if kind == "orderbook" else ticker_key(exchange_id, symbol)
+        with redis_operation_time.labels(operation="get").time():
+            serialized_data = await self._get_client().get(key)
+        return decode_record(serialized_data) if serialized_data else None
+
+    async def get_many(self, market_keys: List[MarketKey]) -> MarketRecords:
+        """Стаканы и тикеры одним запросом MGET; каждое значение декодируется один раз."""
+        redis_keys = [orderbook_key(exchange_id, symbol) for exchange_id, symbol in market_keys]
+        redis_keys += [ticker_key(exchange_id, symbol) for exchange_id, symbol in market_keys]
+        with redis_operation_time.labels(operation="mget").time():
+            values = await self._get_client().mget(redis_keys)
+        count = len(market_keys)
+        return (self._decode_values(market_keys, values[:count], "стакана"),
+                self._decode_values(market_keys, values[count:], "тикера"))
+
+    async def publish(self, channel: str, message: bytes, snapshot: bytes):
+        """Снимок в ключе <канал>:snapshot и сообщение в pubsub канала, одним pipeline."""
+        async with self._get_client().pipeline(transaction=False) as pipe:
+            pipe.set(f"{channel}:snapshot", snapshot)
+            pipe.publish(channel, message)
+            with redis_operation_time.labels(operation="publish").time():
+                await pipe.execute()
+
+    @staticmethod
+    def _decode_values(market_keys: List[MarketKey], values: List[Optional[bytes]], kind: str) -> Dict[MarketKey, Dict[str, Any]]:
+        decoded: Dict[MarketKey, Dict[str, Any]] = {}
+        for market_key, serialized_data in zip(market_keys, values):
+            if not serialized_data:
+                continue
+            try:
+                decoded[market_key] = decode_record(serialized_data)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Не удалось декодировать данные {kind} для {market_key[0]}:{market_key[1]}: {e}")
+        return decoded
+
+
+class InMemoryMarketDataStore(MarketDataStore):
+    """
+    Записи в памяти процесса - словари с полями decode_record (records.orderbook_record / ticker_record).
+    Срез отдает сами записи, без сериализации и копирования: записи после сохранения не изменяются.
+    Запись истекает через ttl секунд, как ключ Redis; истекшие записи удаляются при чтении и периодически при записи.
+    Данные видны только этому процессу: коллектор и поиск должны работать в нем же (COLLECTOR_MODE=inprocess).
+    Каналы возможностей тоже работают в процессе: сообщения передаются зарегистрированным получателям
+    (рассылке WebSocket), снимки каналов хранятся в памяти.
+    """
+
+    def __init__(self, ttl: float, depth: int):
+        self._ttl = ttl
+        self._depth = depth
+        # (вид записи, рынок) -> (запись, момент истечения по time.monotonic)
+        self._records: Dict[Tuple[str, MarketKey], Tuple[Dict[str, Any], float]] = {}
+        self._next_sweep = 0.0
+        self._connected = False
+        self._snapshots: Dict[str, bytes] = {}
+        self._listeners: List[ChannelListener] = []
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def connect(self):
+        self._connected = True
+
+    async def disconnect(self):
+        # Записи сохраняются, как в Redis при отключении клиента
+        self._connected = False
+
+    async def write(self, updates: Sequence[MarketUpdate], cached_at: float, buffered: bool = False):
+        now = time.monotonic()
+        expires_at = now + self._ttl
+        for kind, exchange_id, symbol, data in updates:
+            record = (orderbook_record(data, self._depth, cached_at) if kind == "orderbook"
+                      else ticker_record(data, cached_at))
+            self._records[(kind, (exchange_id, symbol))] = (record, expires_at)
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+    def _sweep(self, now: float):
+        expired = [key for key, (_, expires_at) in self._records.items() if expires_at <= now]
+        for key in expired:
+            del self._records[key]
+        self._next_sweep = now + self._ttl
+
+    def _get(self, key: Tuple[str, MarketKey], now: float) -> Optional[Dict[str, Any]]:
+        entry = self._records.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._records[key]
+            return None
+        return entry[0]
+
+    async def get(self, kind: str, exchange_id: str, symbol: str) -> Optional[Dict[str, Any]]:
+        return self._get((kind, (exchange_id, symbol)), time.monotonic())
+
+    async def get_many(self, market_keys: List[MarketKey]) -> MarketRecords:
+        now = time.monotonic()
+        orderbooks: Dict[MarketKey, Dict[str, Any]] = {}
+        tickers: Dict[MarketKey, Dict[str, Any]] = {}
+        for market_key in market_keys:
+            record = self._get(("orderbook", market_key), now)
+            if record is not None:
+                orderbooks[market_key] = record
+            record = self._get(("ticker", market_key), now)
+            if record is not None:
+                tickers[market_key] = record
+        return orderbooks, tickers
+
+    async def publish(self, channel: str, message: bytes, snapshot: bytes):
+        self._snapshots[channel] = snapshot
+        for listener in tuple(self._listeners):
+            listener(channel, message)
+
+    def channel_snapshot(self, channel: str) -> Optional[bytes]:
+        return self._snapshots.get(channel)
+
+    def add_listener(self, listener: ChannelListener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: ChannelListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+
+def create_market_data_store(kind: str) -> MarketDataStore:
+    """Хранилище по значению MARKET_DATA_STORE."""
+    if kind == "redis":
+        return RedisMarketDataStore()
+    if kind == "memory":
+        return InMemoryMarketDataStore(settings.MARKET_DATA_TTL, settings.ORDERBOOK_DEPTH)
+    raise ValueError(f"Неизвестное хранилище рыночных данных MARKET_DATA_STORE={kind!r}: ожидается redis или memory")
@@ -0,0 +1,99 @@
+# backend/data_processor/streams.py
+from typing import Dict, Any, Optional, Iterable, List, Set, Tuple
+
+import redis.asyncio as redis
+
+from backend.core.config import settings
+from backend.core.types import MarketKey, MarketSnapshot
+from backend.data_processor.processor import data_processor
+from backend.data_processor.store import market_stream_key, STREAM_KIND_ORDERBOOK, STREAM_KIND_TICKER
+from backend.data_processor.records import decode_record
+from backend.utils.logger import logger
+
+
+class MarketStreamConsumer:
+    """
+    Читает обновления рынков из Redis Streams бирж (XREAD без групп, поэтому каждый экземпляр
+    поиска получает весь поток) и держит последнее состояние стаканов и тикеров в памяти.
+
+    Начальное состояние: сначала запоминаются последние ID стримов, затем читается срез ключей,
+    после чего XREAD продолжает с запомненных ID. Обновления, пришедшие между этими шагами,
+    применяются повторно - это безопасно, так как побеждает последняя запись.
+    """
+
+    def __init__(self, exchanges: Iterable[str]):
+        self._streams: Dict[str, str] = {market_stream_key(exchange_id): exchange_id for exchange_id in exchanges}
+        self._last_ids: Dict[str, bytes] = {}
+        self._orderbooks: Dict[MarketKey, Dict[str, Any]] = {}
+        self._tickers: Dict[MarketKey, Dict[str, Any]] = {}
+        self._redis_client: Optional[redis.Redis] = None
+
+    def _get_client(self) -> redis.Redis:
+        if self._redis_client is None:
+            self._redis_client = redis.Redis(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                decode_responses=False
+            )
+        return self._redis_client
+
+    async def bootstrap(self, keys: Iterable[MarketKey]):
+        """Запоминает текущие позиции стримов и загружает начальное состояние рынков из ключей."""
+        client = self._get_client()
+        for stream in self._streams:
+            last = await client.xrevrange(stream, count=1)
+            self._last_ids[stream] = last[0][0] if last else b"0-0"
+        snapshot = await data_processor.get_market_snapshot(keys)
+        self._orderbooks.update(snapshot.orderbooks)
+        self._tickers.update(snapshot.tickers)
+        logger.info(f"Начальное состояние рынков из Redis: {len(self._orderbooks)} стаканов, {len(self._tickers)} тикеров.")
+
+    async def read(self, block_ms: int, count: Optional[int] = None) -> Set[MarketKey]:
+        """
+        Блокирующе читает новые сообщения всех стримов с последних прочитанных ID, применяет их
+        к состоянию в памяти и возвращает набор обновившихся рынков (пустой, если за block_ms ничего не пришло).
+        """
+        client = self._get_client()
+        response = await client.xread(self._last_ids, count=count, block=block_ms)
+        return self._apply(response or [])
+
+    def _apply(self, response: List[Tuple[Any, List[Tuple[bytes, Dict[bytes, bytes]]]]]) -> Set[MarketKey]:
+        updated: Set[MarketKey] = set()
+        for stream, messages in response:
+            stream = stream.decode() if isinstance(stream, bytes) else stream
+            exchange_id = self._streams.get(stream)
+            if exchange_id is None:
+                continue
+            for message_id, fields in messages:
+                self._last_ids[stream] = message_id
+                try:
+                    market = (exchange_id, fields[b"s"].decode())
+                    record = decode_record(fields[b"d"])
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Не удалось декодировать сообщение {message_id!r} стрима {stream}: {e}")
+                    continue
+                kind = fields.get(b"k")
+                if kind == STREAM_KIND_ORDERBOOK:
+                    self._orderbooks[market] = record
+                elif kind == STREAM_KIND_TICKER:
+                    self._tickers[market] = record
+                else:
+                    continue
+                updated.add(market)
+        return updated
+
+    def snapshot(self, keys: Optional[Iterable[MarketKey]] = None) -> MarketSnapshot:
+        """Срез текущего состояния в памяти (всех рынков или только keys)."""
+        if keys is None:
+            return MarketSnapshot(self._orderbooks, self._tickers)
+        keys = list(keys)
+        return MarketSnapshot(
+            {key: self._orderbooks[key] for key in keys if key in self._orderbooks},
+            {key: self._tickers[key] for key in keys if key in self._tickers},
+        )
+
+    async def close(self):
+        if self._redis_client is not None:
+            await self._redis_client.aclose()
+            self._redis_client = None
@@ -4,13 +4,14 @@ from fastapi.middleware.cors import CORSMiddleware
 import asyncio
 from contextlib import asynccontextmanager
 
-from backend.core.config import settings
+from backend.core.config import settings, commissions_config
 from backend.utils.logger import logger
 from backend.data_processor.processor import data_processor
 from backend.data_collector.collector import data_collector
 from backend.arbitrage_finder.finder import arbitrage_finder
 from backend.api.v1.endpoints import router as api_v1_router
-from backend.monitoring import start_prometheus_server
+from backend.api.broadcast import broadcast_hub
+from backend.monitoring import start_prometheus_server, monitor_event_loop_lag
 
 logger.info(f"Запуск приложения: {settings.PROJECT_NAME} (v{settings.VERSION})")
 
@@ -18,14 +19,33 @@ logger.info(f"Запуск приложения: {settings.PROJECT_NAME} (v{sett
 async def lifespan(app: FastAPI):
     logger.info("Выполнение startup...")
     start_prometheus_server()
-    await data_processor.connect_redis()
-    asyncio.create_task(data_collector.start_collecting())
+    loop_lag_task = None
+    if settings.EVENT_LOOP_LAG_INTERVAL > 0:
+        loop_lag_task = asyncio.create_task(monitor_event_loop_lag(settings.EVENT_LOOP_LAG_INTERVAL), name="event_loop_lag")
+    await data_processor.connect()
+    if settings.COLLECTOR_MODE == "inprocess":
+        data_processor.start_writer()
+        asyncio.create_task(data_collector.start_collecting())
+    else:
+        logger.info("Коллектор работает во внешнем супервизоре, процесс API данные с бирж не собирает.")
+        if settings.MARKET_DATA_STORE != "redis":
+            logger.error("Внешний коллектор пишет данные в Redis, а поиск читает их из памяти процесса: задайте MARKET_DATA_STORE=redis.")
     asyncio.create_task(arbitrage_finder.start_finding_loop())
+    commissions_watch_task = None
+    if settings.COMMISSIONS_RELOAD_INTERVAL > 0:
+        commissions_watch_task = asyncio.create_task(commissions_config.watch(settings.COMMISSIONS_RELOAD_INTERVAL))
     yield
     logger.info("Выполнение shutdown...")
-    await data_collector.stop_collecting()
+    if commissions_watch_task:
+        commissions_watch_task.cancel()
+    if loop_lag_task:
+        loop_lag_task.cancel()
+    if settings.COLLECTOR_MODE == "inprocess":
+        await data_collector.stop_collecting()
     await arbitrage_finder.stop_finding_loop()
-    await data_processor.disconnect_redis()
+    await broadcast_hub.stop()
+    await data_processor.stop_writer()
+    await data_processor.disconnect()
     logger.info("Startup/shutdown события выполнены.")
 
 app = FastAPI(
@@ -47,4 +67,9 @@ app.include_router(api_v1_router, prefix="/api/v1")
 
 @app.get("/", tags=["Root"])
 async def read_root():
-    return {"message": "Crypto Arbitrage Scanner API is running", "version": settings.VERSION}
\ No newline at end of file
+    return {"message": "Crypto Arbitrage Scanner API is running", "version": settings.VERSION}
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=settings.API_HOST, port=settings.API_PORT, ws_per_message_deflate=settings.WS_PER_MESSAGE_DEFLATE)
@@ -1,5 +1,39 @@
 # backend/monitoring.py
-from prometheus_client import Counter, Histogram, start_http_server
+import asyncio
+from typing import Iterable, Optional, Set
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from backend.core.config import settings
+
+
+class BoundedLabel:
+    """
+    Значения метки с ограниченной кардинальностью: как есть передаются только значения из allowed,
+    а если allowed пуст - первые max_values различных значений; остальные объединяются в "other".
+    """
+    OTHER = "other"
+
+    def __init__(self, max_values: int, allowed: Optional[Iterable[str]] = None):
+        self._max_values = max_values
+        self._allowed = frozenset(allowed) if allowed else None
+        self._seen: Set[str] = set()
+
+    def __call__(self, value: str) -> str:
+        if value in self._seen:
+            return value
+        if self._allowed is not None:
+            accepted = value in self._allowed
+        else:
+            accepted = len(self._seen) < self._max_values
+        if not accepted:
+            return self.OTHER
+        self._seen.add(value)
+        return value
+
+
+# Метка symbol: число рынков растет с числом пар в комиссиях, поэтому ограничивается настройками
+symbol_label = BoundedLabel(settings.METRICS_MAX_SYMBOLS, settings.METRICS_SYMBOLS)
 
 # Метрики
 arbitrage_cex_cex_count = Counter(
@@ -15,6 +49,148 @@ arbitrage_search_time = Histogram(
     "Time spent searching for arbitrage opportunities",
     labelnames=["type"]
 )
+arbitrage_triangle_index_size = Gauge(
+    "arbitrage_triangle_index_size",
+    "Number of 3-leg cycles in the precomputed triangle index"
+)
+redis_write_updates = Counter(
+    "redis_write_updates_total",
+    "Market data updates accepted by the buffered Redis writer"
+)
+redis_write_conflated = Counter(
+    "redis_write_conflated_total",
+    "Updates replaced by a newer update for the same key before flush (last-write-wins)"
+)
+redis_write_dropped = Counter(
+    "redis_write_dropped_total",
+    "Updates dropped because their flush to Redis failed"
+)
+redis_flush_batch_size = Histogram(
+    "redis_flush_batch_size",
+    "Number of keys written per Redis pipeline flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+)
+collector_messages = Counter(
+    "collector_messages_total",
+    "Market data messages received from exchange websockets",
+    labelnames=["exchange", "kind"]
+)
+scan_queue_time = Histogram(
+    "arbitrage_scan_queue_seconds",
+    "Time a scan waited for a free slot and a pool worker before it started computing",
+    labelnames=["type"]
+)
+scan_compute_time = Histogram(
+    "arbitrage_scan_compute_seconds",
+    "Time a scan spent computing in the scan executor",
+    labelnames=["type"]
+)
+ws_clients = Gauge(
+    "ws_clients",
+    "Connected WebSocket clients",
+    labelnames=["channel"]
+)
+ws_client_queue_depth = Histogram(
+    "ws_client_queue_depth",
+    "Per-client WebSocket queue length after enqueueing a message",
+    labelnames=["channel"],
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64)
+)
+ws_messages_dropped = Counter(
+    "ws_messages_dropped_total",
+    "Messages dropped from full per-client WebSocket queues (client is resynced with a snapshot)",
+    labelnames=["channel"]
+)
+opportunity_stream_messages = Counter(
+    "opportunity_stream_messages_total",
+    "Opportunity stream publishes by message type (snapshot, delta, suppressed when nothing changed)",
+    labelnames=["type", "message"]
+)
+opportunity_stream_bytes = Counter(
+    "opportunity_stream_bytes_total",
+    "Bytes published to opportunity pubsub channels",
+    labelnames=["type"]
+)
+# Задержки рыночных данных по этапам: биржа -> получение коллектором -> запись в кэш -> обнаружение возможностей
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+market_data_receive_latency = Histogram(
+    "market_data_receive_latency_seconds",
+    "Exchange timestamp to local receive time of a market data update (includes clock skew)",
+    labelnames=["exchange"],
+    buckets=_LATENCY_BUCKETS
+)
+market_data_cache_latency = Histogram(
+    "market_data_cache_latency_seconds",
+    "Local receive time to the write of the update into the Redis cache",
+    labelnames=["exchange"],
+    buckets=_LATENCY_BUCKETS
+)
+arbitrage_detection_latency = Histogram(
+    "arbitrage_detection_latency_seconds",
+    "Cache write of a market update to the end of the arbitrage search that consumed it",
+    labelnames=["exchange"],
+    buckets=_LATENCY_BUCKETS
+)
+market_quotes_stale = Counter(
+    "market_quotes_stale_total",
+    "Cached quotes skipped by the finder because they are older than MAX_QUOTE_AGE_MS",
+    labelnames=["exchange"]
+)
+collector_symbol_messages = Counter(
+    "collector_symbol_messages_total",
+    "Market data messages received per market (symbols beyond METRICS_MAX_SYMBOLS are reported as \"other\")",
+    labelnames=["exchange", "symbol", "kind"]
+)
+collector_reconnects = Counter(
+    "collector_reconnects_total",
+    "Exchange websocket subscriptions restarted after an error",
+    labelnames=["exchange", "kind"]
+)
+redis_operation_time = Histogram(
+    "redis_operation_duration_seconds",
+    "Latency of Redis round trips by operation",
+    labelnames=["operation"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+arbitrage_stage_time = Histogram(
+    "arbitrage_stage_duration_seconds",
+    "Time spent in each finder stage: fetch (market snapshot), graph_build, search, publish",
+    labelnames=["stage"]
+)
+ws_messages_sent = Counter(
+    "ws_messages_sent_total",
+    "Messages sent to WebSocket clients",
+    labelnames=["channel"]
+)
+ws_connections = Counter(
+    "ws_connections_total",
+    "WebSocket connections accepted",
+    labelnames=["channel"]
+)
+event_loop_lag = Gauge(
+    "event_loop_lag_seconds",
+    "How late the event loop woke up for the last scheduled lag probe"
+)
+event_loop_lag_histogram = Histogram(
+    "event_loop_lag_distribution_seconds",
+    "Distribution of event loop lag probes (catches stalls between scrapes)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+
+async def monitor_event_loop_lag(interval: float):
+    """
+    Непрерывно измеряет задержку event loop: насколько позже заданного просыпается sleep(interval).
+    Рост задержки означает, что loop занят синхронной работой (разбор сообщений, расчеты) и не успевает обслуживать I/O.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        event_loop_lag.set(lag)
+        event_loop_lag_histogram.observe(lag)
+
 
 def start_prometheus_server():
     start_http_server(8001)  # Порт для Prometheus
\ No newline at end of file
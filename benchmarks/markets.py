@@ -0,0 +1,145 @@
+# benchmarks/markets.py
+"""
+Детерминированный генератор синтетических рынков и хранилище рыночных данных в памяти вместо Redis.
+"""
+import json
+import math
+import random
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, List, NamedTuple, Optional
+
+from backend.core.config import settings, commissions_config, COMMISSIONS_DIR
+from backend.core.types import MarketKey, MarketSnapshot
+from backend.data_processor.store import orderbook_key, ticker_key
+from backend.data_processor.records import encode_orderbook, decode_record
+
+# Валюты котировки синтетических пар; пары между ними (BTC/USDT, ETH/USDT, ETH/BTC) замыкают треугольники
+QUOTE_CURRENCIES = ("USDT", "BTC", "ETH")
+_QUOTE_PRICES_USD = {"USDT": 1.0, "BTC": 60000.0, "ETH": 3000.0}
+
+
+class MarketSpec(NamedTuple):
+    """
+    Параметры синтетического рынка.
+    spread_bps - медиана половины спреда (логнормальное распределение с разбросом spread_sigma),
+    dispersion_bps - стандартное отклонение середины стакана биржи от справочной цены пары:
+    именно расхождение между биржами создает арбитражные возможности.
+    """
+    name: str
+    exchanges: int
+    pairs: int
+    currencies: Optional[int] = None
+    spread_bps: float = 5.0
+    spread_sigma: float = 0.5
+    dispersion_bps: float = 15.0
+    fee_percent: float = 0.1
+    depth: int = 20
+    seed: int = 1
+
+
+def synthetic_pairs(pairs: int, currencies: Optional[int] = None) -> List[str]:
+    """Первые pairs пар: сначала пары между валютами котировки, затем C0001/USDT, C0001/BTC, C0001/ETH, C0002/USDT..."""
+    universe = ["BTC/USDT", "ETH/USDT", "ETH/BTC"]
+    base_count = currencies if currencies is not None else max(1, math.ceil((pairs - len(universe)) / len(QUOTE_CURRENCIES)))
+    universe += [f"C{index:04d}/{quote}" for index in range(1, base_count + 1) for quote in QUOTE_CURRENCIES]
+    if pairs > len(universe):
+        raise ValueError(f"{base_count} валют дают только {len(universe)} пар, запрошено {pairs}")
+    return universe[:pairs]
+
+
+class SyntheticMarket:
+    """
+    Стаканы всех пар на всех биржах, сгенерированные из одного seed: одинаковые параметры дают
+    одинаковые данные на любой машине, поэтому замеры разных запусков сравнимы.
+    """
+
+    def __init__(self, spec: MarketSpec):
+        self.spec = spec
+        rng = random.Random(spec.seed)
+        self.exchanges = [f"bench{index:02d}" for index in range(spec.exchanges)]
+        self.pairs = synthetic_pairs(spec.pairs, spec.currencies)
+        prices_usd = dict(_QUOTE_PRICES_USD)
+        for pair in self.pairs:
+            base = pair.split("/")[0]
+            if base not in prices_usd:
+                prices_usd[base] = math.exp(rng.uniform(math.log(0.01), math.log(1000)))
+        self.orderbooks: Dict[MarketKey, Dict[str, Any]] = {}
+        for pair in self.pairs:
+            base, quote = pair.split("/")
+            reference = prices_usd[base] / prices_usd[quote]
+            for exchange_id in self.exchanges:
+                mid = reference * (1 + rng.gauss(0, spec.dispersion_bps / 10000))
+                half_spread = rng.lognormvariate(math.log(spec.spread_bps / 10000), spec.spread_sigma)
+                self.orderbooks[(exchange_id, pair)] = self._orderbook(rng, pair, mid, half_spread, prices_usd[base])
+
+    def _orderbook(self, rng: random.Random, pair: str, mid: float, half_spread: float, base_price_usd: float) -> Dict[str, Any]:
+        # Уровни через шаг в половину спреда, объемы - на 100..10000 USD на уровень
+        bids, asks = [], []
+        for level in range(self.spec.depth):
+            offset = half_spread * (1 + level)
+            bids.append([mid * (1 - offset), rng.uniform(100, 10000) / base_price_usd])
+            asks.append([mid * (1 + offset), rng.uniform(100, 10000) / base_price_usd])
+        return {
+            "symbol": pair,
+            "bid": bids[0][0], "bidVolume": bids[0][1],
+            "ask": asks[0][0], "askVolume": asks[0][1],
+            "bids": bids, "asks": asks,
+        }
+
+    @property
+    def market_keys(self) -> List[MarketKey]:
+        return list(self.orderbooks)
+
+    def commissions(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        """Комиссии в формате файлов config/commissions: одинаковый taker для всех рынков."""
+        rate = f"{self.spec.fee_percent}%"
+        return {
+            exchange_id: {pair: {"taker_buy_rate": rate, "taker_sell_rate": rate} for pair in self.pairs}
+            for exchange_id in self.exchanges
+        }
+
+    @contextmanager
+    def configured(self) -> Iterator[None]:
+        """Подменяет список бирж и комиссии приложения синтетическими на время замеров."""
+        exchanges = settings.EXCHANGES
+        with tempfile.TemporaryDirectory(prefix="bench_commissions_") as directory:
+            for exchange_id, commissions in self.commissions().items():
+                (Path(directory) / f"{exchange_id}.json").write_text(json.dumps(commissions), encoding="utf-8")
+            settings.EXCHANGES = self.exchanges
+            commissions_config.set_directory(Path(directory))
+            try:
+                yield
+            finally:
+                settings.EXCHANGES = exchanges
+                commissions_config.set_directory(COMMISSIONS_DIR)
+
+
+class InMemoryMarketStore:
+    """
+    Хранилище рыночных данных в памяти вместо Redis: записи лежат в том же бинарном формате и под теми же
+    ключами, а срез собирается как в DataProcessor.get_market_snapshot (один проход, каждое значение декодируется).
+    Замер не зависит от сети и Redis, но включает стоимость декодирования записей.
+    """
+
+    def __init__(self, depth: int = settings.ORDERBOOK_DEPTH):
+        self._values: Dict[str, bytes] = {}
+        self._depth = depth
+
+    def load(self, market: SyntheticMarket):
+        for (exchange_id, symbol), orderbook in market.orderbooks.items():
+            self._values[orderbook_key(exchange_id, symbol)] = encode_orderbook(orderbook, self._depth)
+
+    def get_market_snapshot(self, keys: Iterable[MarketKey]) -> MarketSnapshot:
+        market_keys = list(dict.fromkeys(keys))
+        orderbooks: Dict[MarketKey, Dict[str, Any]] = {}
+        tickers: Dict[MarketKey, Dict[str, Any]] = {}
+        for market_key in market_keys:
+            value = self._values.get(orderbook_key(*market_key))
+            if value is not None:
+                orderbooks[market_key] = decode_record(value)
+            value = self._values.get(ticker_key(*market_key))
+            if value is not None:
+                tickers[market_key] = decode_record(value)
+        return MarketSnapshot(orderbooks, tickers)
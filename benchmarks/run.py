@@ -0,0 +1,198 @@
+# benchmarks/run.py
+"""
+Бенчмарк поиска арбитража на синтетических рынках.
+
+    python -m benchmarks.run                     # все размеры, таблица результатов
+    python -m benchmarks.run --sizes 3x10,15x200 # только выбранные размеры
+    python -m benchmarks.run --check             # сравнить p50 с benchmarks/baselines.json, код 1 при регрессии
+    python -m benchmarks.run --update-baselines  # записать текущие p50 как базовые
+
+Замеры: fetch (срез из хранилища в памяти с декодированием записей), cex_cex и cex_cex_cex
+(поиск по готовому срезу, поиск циклов выполняется в event loop, SCAN_EXECUTOR=inline).
+Базовые значения зависят от машины: перед сравнением на новой машине их нужно перезаписать.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from backend.arbitrage_finder.finder import ArbitrageFinder
+from backend.core.config import settings
+from backend.utils.logger import logger
+from benchmarks.markets import MarketSpec, SyntheticMarket, InMemoryMarketStore
+
+BASELINES_PATH = Path(__file__).resolve().parent / "baselines.json"
+
+# Размеры "биржи x пары" и число повторов замера
+SIZES: Dict[str, MarketSpec] = {
+    "3x10": MarketSpec("3x10", exchanges=3, pairs=10),
+    "15x200": MarketSpec("15x200", exchanges=15, pairs=200),
+    "15x2000": MarketSpec("15x2000", exchanges=15, pairs=2000),
+}
+REPEATS = {"3x10": 50, "15x200": 10, "15x2000": 3}
+
+
+class BenchResult(NamedTuple):
+    size: str
+    scan: str
+    markets: int
+    opportunities: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    peak_alloc_kib: float
+
+    @property
+    def opportunities_per_sec(self) -> float:
+        return self.opportunities / (self.p50_ms / 1000) if self.p50_ms > 0 else 0.0
+
+    @property
+    def markets_per_sec(self) -> float:
+        return self.markets / (self.p50_ms / 1000) if self.p50_ms > 0 else 0.0
+
+
+def _percentile(samples: Sequence[float], percent: float) -> float:
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1))))
+    return ordered[rank]
+
+
+async def _measure(size: str, scan: str, markets: int, repeats: int, run: Callable[[], Awaitable[int]]) -> BenchResult:
+    """
+    Один прогрев, repeats замеров времени и отдельный прогон под tracemalloc (он замедляет выполнение):
+    пик памяти, выделенной за один прогон сверх уже занятой.
+    """
+    await run()
+    samples = []
+    opportunities = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        opportunities = await run()
+        samples.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    try:
+        await run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchResult(
+        size=size, scan=scan, markets=markets, opportunities=opportunities,
+        p50_ms=statistics.median(samples), p95_ms=_percentile(samples, 95), p99_ms=_percentile(samples, 99),
+        peak_alloc_kib=peak / 1024,
+    )
+
+
+async def run_size(spec: MarketSpec, repeats: int) -> List[BenchResult]:
+    market = SyntheticMarket(spec)
+    store = InMemoryMarketStore()
+    store.load(market)
+    keys = market.market_keys
+    with market.configured():
+        # Поиск циклов в event loop: замер без пересылки входных данных в пул процессов
+        executor, settings.SCAN_EXECUTOR = settings.SCAN_EXECUTOR, "inline"
+        try:
+            finder = ArbitrageFinder()
+        finally:
+            settings.SCAN_EXECUTOR = executor
+        snapshot = store.get_market_snapshot(keys)
+
+        async def fetch() -> int:
+            store.get_market_snapshot(keys)
+            return 0
+
+        async def cex_cex() -> int:
+            return len(await finder.find_cex_cex_opportunities(snapshot))
+
+        async def cex_cex_cex() -> int:
+            return len(await finder.find_cex_cex_cex_opportunities(snapshot))
+
+        results = [
+            await _measure(spec.name, "fetch", len(keys), repeats, fetch),
+            await _measure(spec.name, "cex_cex", len(keys), repeats, cex_cex),
+            await _measure(spec.name, "cex_cex_cex", len(keys), repeats, cex_cex_cex),
+        ]
+        await finder.stop_finding_loop()
+    return results
+
+
+def load_baselines(path: Path = BASELINES_PATH) -> Dict[str, Dict[str, float]]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))["p50_ms"]
+
+
+def save_baselines(results: Sequence[BenchResult], path: Path = BASELINES_PATH):
+    baselines = load_baselines(path)
+    for result in results:
+        baselines.setdefault(result.size, {})[result.scan] = round(result.p50_ms, 3)
+    path.write_text(json.dumps({"p50_ms": baselines}, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+
+
+def check_regressions(results: Sequence[BenchResult], baselines: Dict[str, Dict[str, float]],
+                      threshold: float) -> List[str]:
+    """Замеры, p50 которых больше базового более чем на threshold (доля); замеры без базового значения не проверяются."""
+    regressions = []
+    for result in results:
+        baseline = baselines.get(result.size, {}).get(result.scan)
+        if baseline is not None and result.p50_ms > baseline * (1 + threshold):
+            regressions.append(f"{result.size} {result.scan}: p50 {result.p50_ms:.3f} мс, "
+                               f"базовое {baseline:.3f} мс (+{(result.p50_ms / baseline - 1) * 100:.0f}%)")
+    return regressions
+
+
+def format_table(results: Sequence[BenchResult]) -> str:
+    lines = [f"{'size':<8} {'scan':<12} {'markets':>8} {'opps':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} "
+             f"{'peak KiB':>10} {'opps/s':>10} {'markets/s':>11}"]
+    for r in results:
+        lines.append(f"{r.size:<8} {r.scan:<12} {r.markets:>8} {r.opportunities:>6} {r.p50_ms:>10.3f} {r.p95_ms:>10.3f} "
+                     f"{r.p99_ms:>10.3f} {r.peak_alloc_kib:>10.1f} {r.opportunities_per_sec:>10.0f} "
+                     f"{r.markets_per_sec:>11.0f}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска арбитража на синтетических рынках")
+    parser.add_argument("--sizes", default=",".join(SIZES), help=f"размеры через запятую ({', '.join(SIZES)})")
+    parser.add_argument("--repeat", type=int, default=None, help="число замеров (по умолчанию зависит от размера)")
+    parser.add_argument("--check", action="store_true", help="сравнить с базовыми значениями, код 1 при регрессии")
+    parser.add_argument("--threshold", type=float, default=0.25, help="допустимый рост p50 относительно базового (доля)")
+    parser.add_argument("--update-baselines", action="store_true", help="записать текущие p50 как базовые")
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args(argv)
+
+    unknown = [size for size in args.sizes.split(",") if size not in SIZES]
+    if unknown:
+        parser.error(f"неизвестные размеры: {', '.join(unknown)}")
+    # Логи поиска на каждом прогоне искажают замер
+    logger.setLevel(logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results: List[BenchResult] = []
+    for size in args.sizes.split(","):
+        results += asyncio.run(run_size(SIZES[size], args.repeat or REPEATS[size]))
+
+    if args.json:
+        print(json.dumps([dict(r._asdict(), opportunities_per_sec=r.opportunities_per_sec,
+                               markets_per_sec=r.markets_per_sec) for r in results], indent=2))
+    else:
+        print(format_table(results))
+    if args.update_baselines:
+        save_baselines(results)
+        print(f"Базовые значения записаны в {BASELINES_PATH}")
+    if args.check:
+        regressions = check_regressions(results, load_baselines(), args.threshold)
+        if regressions:
+            print("Регрессии производительности:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+        print(f"Регрессий нет (порог +{args.threshold * 100:.0f}%)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# tests/conftest.py
+import asyncio
+import os
+import socket
+
+import pytest
+
+# Хранилище рыночных данных по умолчанию для тестов без обоих вариантов (см. market_data_store).
+# Задается до импорта настроек приложения
+os.environ.setdefault("MARKET_DATA_STORE", "memory")
+
+# Тесты, обращающиеся к этим именам модуля тестов, прогоняются на обоих хранилищах рыночных данных
+_STORE_DEPENDENT_NAMES = {"data_processor", "ArbitrageFinder"}
+MARKET_DATA_STORES = ("memory", "redis")
+
+
+def _redis_available() -> bool:
+    from backend.core.config import settings
+    try:
+        socket.create_connection((settings.REDIS_HOST, settings.REDIS_PORT), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "requires_redis(store=False): тест работает с Redis напрямую (pubsub, стримы, хэши); "
+        "store=True - еще и рыночные данные должны храниться в Redis (тест прогоняется только на нем)",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    marker = metafunc.definition.get_closest_marker("requires_redis")
+    if marker is not None and marker.kwargs.get("store"):
+        stores = ("redis",)
+    elif _STORE_DEPENDENT_NAMES & set(metafunc.function.__code__.co_names):
+        stores = MARKET_DATA_STORES
+    else:
+        return
+    metafunc.parametrize("market_data_store", stores, indirect=True)
+
+
+@pytest.fixture(autouse=True)
+def market_data_store(request, monkeypatch):
+    """
+    Хранилище рыночных данных общего data_processor на время теста. Тесты процессора и поиска
+    параметризуются обоими хранилищами (pytest_generate_tests); Redis пропускается, если недоступен.
+    Остальные тесты используют хранилище из MARKET_DATA_STORE.
+    """
+    from backend.core.config import settings
+    kind = getattr(request, "param", None)
+    if kind is None:
+        return settings.MARKET_DATA_STORE
+    if kind == "redis" and not _redis_available():
+        pytest.skip(f"Redis недоступен на {settings.REDIS_HOST}:{settings.REDIS_PORT}")
+    from backend.data_processor.processor import data_processor
+    from backend.data_processor.store import create_market_data_store
+    monkeypatch.setattr(settings, "MARKET_DATA_STORE", kind)
+    monkeypatch.setattr(data_processor, "_store", create_market_data_store(kind))
+    # Отметки обновлений относятся к прежнему хранилищу; события процессора привязываются к loop
+    # первого ожидания, а у каждого прогона теста свой loop
+    monkeypatch.setattr(data_processor, "_dirty_markets", set())
+    monkeypatch.setattr(data_processor, "_dirty_event", asyncio.Event())
+    monkeypatch.setattr(data_processor, "_batch_full", asyncio.Event())
+    return kind
+
+
+def pytest_collection_modifyitems(config, items):
+    from backend.core.config import settings
+    redis_available = None
+    for item in items:
+        if item.get_closest_marker("requires_redis") is None:
+            continue
+        if redis_available is None:
+            redis_available = _redis_available()
+        if not redis_available:
+            item.add_marker(pytest.mark.skip(reason=f"Redis недоступен на {settings.REDIS_HOST}:{settings.REDIS_PORT}"))
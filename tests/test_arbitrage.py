@@ -1,8 +1,10 @@
 # tests/test_arbitrage.py
 import pytest
 import asyncio
+import json
 from decimal import Decimal
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
 from backend.api.v1.endpoints import router as api_v1_router
 from backend.arbitrage_finder.finder import ArbitrageFinder, OpportunityCexCex, OpportunityCexCexCex
 from backend.core.config import settings, commissions_config
@@ -60,8 +62,18 @@ async def test_cex_cex_arbitrage():
 
 
 @pytest.mark.asyncio
-async def test_cex_cex_cex_arbitrage():
+async def test_cex_cex_cex_arbitrage(tmp_path, request):
     """Тестирует логику поиска CEX-CEX-CEX арбитража."""
+    from backend.core.config import COMMISSIONS_DIR
+
+    # Собственные комиссии теста: рабочие файлы и пара ETH/BTC на Bybit для цикла из трех рынков
+    for commissions_file in COMMISSIONS_DIR.glob("*.json"):
+        (tmp_path / commissions_file.name).write_text(commissions_file.read_text(encoding="utf-8"), encoding="utf-8")
+    bybit = json.loads((tmp_path / "bybit.json").read_text(encoding="utf-8"))
+    bybit["ETH/BTC"] = {"taker_buy_rate": "0.1%", "taker_sell_rate": "0.1%"}
+    (tmp_path / "bybit.json").write_text(json.dumps(bybit), encoding="utf-8")
+    commissions_config.set_directory(tmp_path)
+    request.addfinalizer(lambda: commissions_config.set_directory(COMMISSIONS_DIR))
     await data_processor.connect_redis()
 
     # Кэшируем данные для Binance
@@ -99,6 +111,57 @@ async def test_cex_cex_cex_arbitrage():
     await data_processor.disconnect_redis()
 
 
+@pytest.mark.asyncio
+async def test_incremental_triangle_counter_counts_new_only(tmp_path, request):
+    """Тестирует счетчик найденных треугольников: перестройка индекса и новые цены не учитывают возможности повторно."""
+    from backend.core.config import COMMISSIONS_DIR
+
+    # Комиссии треугольника BTC/USDT (Binance) - ETH/BTC (Bybit) - ETH/USDT (MEXC)
+    rates = {"taker_buy_rate": "0.1%", "taker_sell_rate": "0.1%"}
+    for exchange_id, pair in (("binance", "BTC/USDT"), ("bybit", "ETH/BTC"), ("mexc", "ETH/USDT")):
+        (tmp_path / f"{exchange_id}.json").write_text(json.dumps({pair: rates}), encoding="utf-8")
+    commissions_config.set_directory(tmp_path)
+    request.addfinalizer(lambda: commissions_config.set_directory(COMMISSIONS_DIR))
+    await data_processor.connect_redis()
+
+    await data_processor.cache_orderbook(
+        exchange_id="binance",
+        symbol="BTC/USDT",
+        orderbook_data={"ask": 50000, "askVolume": 1, "bid": 49000, "bidVolume": 1}
+    )
+    await data_processor.cache_orderbook(
+        exchange_id="bybit",
+        symbol="ETH/BTC",
+        orderbook_data={"ask": 0.05, "askVolume": 1, "bid": 0.04, "bidVolume": 1}
+    )
+    await data_processor.cache_orderbook(
+        exchange_id="mexc",
+        symbol="ETH/USDT",
+        orderbook_data={"ask": 2500, "askVolume": 1, "bid": 2600, "bidVolume": 1}
+    )
+
+    finder = ArbitrageFinder()
+    found_before = REGISTRY.get_sample_value("arbitrage_cex_cex_cex_opportunities_total")
+    finder.rebuild_triangle_index(await finder.get_market_snapshot())
+    found = len(finder.current_cex_cex_cex_opportunities())
+    assert found > 0
+    assert REGISTRY.get_sample_value("arbitrage_cex_cex_cex_opportunities_total") - found_before == found
+
+    # Повторная перестройка находит те же треугольники
+    finder.rebuild_triangle_index(await finder.get_market_snapshot())
+    assert REGISTRY.get_sample_value("arbitrage_cex_cex_cex_opportunities_total") - found_before == found
+
+    # Новая цена уже найденного треугольника - изменение, но не новая возможность
+    await data_processor.cache_orderbook(
+        exchange_id="mexc",
+        symbol="ETH/USDT",
+        orderbook_data={"ask": 2500, "askVolume": 1, "bid": 2650, "bidVolume": 1}
+    )
+    assert "cex_cex_cex" in await finder.process_dirty_markets({("mexc", "ETH/USDT")})
+    assert REGISTRY.get_sample_value("arbitrage_cex_cex_cex_opportunities_total") - found_before == found
+    await data_processor.disconnect_redis()
+
+
 @pytest.mark.asyncio
 async def test_api_cex_cex_endpoint():
     """Тестирует эндпоинт /api/v1/arbitrage/cex_cex."""
@@ -128,4 +191,1104 @@ async def test_api_cex_cex_endpoint():
     assert data[0]["pair"] == "BTC/USDT"
     assert data[0]["buy_exchange"] == "BYBIT"
     assert data[0]["sell_exchange"] == "BINANCE"
-    await data_processor.disconnect_redis()
\ No newline at end of file
+    await data_processor.disconnect_redis()
+
+@pytest.mark.asyncio
+async def test_market_snapshot_single_round_trip():
+    """Тестирует получение среза стаканов и тикеров одним запросом."""
+    await data_processor.connect_redis()
+
+    await data_processor.cache_orderbook(
+        exchange_id="binance",
+        symbol="DOGE/USDT",
+        orderbook_data={"ask": 0.15, "askVolume": 2, "bid": 0.14, "bidVolume": 3}
+    )
+    await data_processor.cache_ticker(
+        exchange_id="binance",
+        symbol="DOGE/USDT",
+        ticker_data={"ask": 0.16, "bid": 0.13}
+    )
+
+    snapshot = await data_processor.get_market_snapshot([
+        ("binance", "DOGE/USDT"),
+        ("binance", "DOGE/USDT"),
+        ("binance", "XRP/USDT"),
+    ])
+
+    assert snapshot.get_orderbook("binance", "DOGE/USDT")["ask"] == 0.15
+    assert snapshot.get_ticker("binance", "DOGE/USDT")["bid"] == 0.13
+    assert snapshot.get_orderbook("binance", "XRP/USDT") is None
+    with pytest.raises(TypeError):
+        snapshot.orderbooks[("binance", "XRP/USDT")] = {}
+    await data_processor.disconnect_redis()
+
+
+def test_vectorized_engine_matches_decimal():
+    """Сверяет векторизованный CEX-CEX движок с эталонной Decimal реализацией."""
+    from backend.core.types import MarketSnapshot
+
+    snapshot = MarketSnapshot(
+        orderbooks={
+            ("binance", "BTC/USDT"): {"ask": 50000, "askVolume": 1, "bid": 49000, "bidVolume": 1},
+            ("bybit", "BTC/USDT"): {"ask": 48000, "askVolume": 0.5, "bid": 51000, "bidVolume": 2},
+            ("mexc", "ETH/USDT"): {"ask": 2500, "askVolume": 1, "bid": 2490, "bidVolume": 1},
+        },
+        tickers={
+            ("bybit", "ETH/USDT"): {"ask": 2400, "bid": 2450},
+        },
+    )
+
+    finder = ArbitrageFinder()
+    exchanges = settings.EXCHANGES
+    configured_pairs_by_exchange = finder._configured_pairs_by_exchange()
+    expected = finder._scan_cex_cex_decimal(snapshot, exchanges, configured_pairs_by_exchange)
+    actual = finder._scan_cex_cex_vectorized(snapshot, exchanges, configured_pairs_by_exchange)
+
+    def key(opp):
+        return opp.pair, opp.buy_exchange, opp.sell_exchange
+
+    assert len(expected) > 0
+    assert sorted(map(key, actual)) == sorted(map(key, expected))
+    expected_by_key = {key(opp): opp for opp in expected}
+    for opp in actual:
+        reference = expected_by_key[key(opp)]
+        assert abs(opp.profit_percent - reference.profit_percent) < Decimal("1e-9")
+        assert (opp.volume_usd is None) == (reference.volume_usd is None)
+
+
+@pytest.mark.asyncio
+async def test_incremental_cex_cex_dirty_markets():
+    """Тестирует инкрементальный пересчет CEX-CEX только по обновившимся парам."""
+    await data_processor.connect_redis()
+    # Сбрасываем отметки, оставшиеся от предыдущих тестов
+    if data_processor._dirty_event.is_set():
+        await data_processor.wait_dirty_markets()
+
+    await data_processor.cache_orderbook(
+        exchange_id="binance",
+        symbol="BTC/USDT",
+        orderbook_data={"ask": 50000, "askVolume": 1, "bid": 49000, "bidVolume": 1}
+    )
+    await data_processor.cache_orderbook(
+        exchange_id="bybit",
+        symbol="BTC/USDT",
+        orderbook_data={"ask": 48000, "askVolume": 1, "bid": 51000, "bidVolume": 1}
+    )
+    dirty_markets = await asyncio.wait_for(data_processor.wait_dirty_markets(), timeout=1)
+    assert dirty_markets == {("binance", "BTC/USDT"), ("bybit", "BTC/USDT")}
+
+    found_before = REGISTRY.get_sample_value("arbitrage_cex_cex_opportunities_total")
+    finder = ArbitrageFinder()
+    assert "cex_cex" in await finder.process_dirty_markets(dirty_markets)
+    opportunities = finder.current_cex_cex_opportunities()
+    assert {opp.pair for opp in opportunities} == {"BTC/USDT"}
+    assert opportunities[0].buy_exchange == "BYBIT"
+    assert REGISTRY.get_sample_value("arbitrage_cex_cex_opportunities_total") - found_before == len(opportunities)
+
+    # Повторная обработка без изменений не должна считаться изменением
+    assert await finder.process_dirty_markets(dirty_markets) == set()
+
+    # Новая цена уже найденной возможности - изменение, но не новая найденная возможность
+    await data_processor.cache_orderbook(
+        exchange_id="bybit",
+        symbol="BTC/USDT",
+        orderbook_data={"ask": 48000, "askVolume": 1, "bid": 51500, "bidVolume": 1}
+    )
+    assert "cex_cex" in await finder.process_dirty_markets({("bybit", "BTC/USDT")})
+    assert REGISTRY.get_sample_value("arbitrage_cex_cex_opportunities_total") - found_before == len(opportunities)
+    await data_processor.disconnect_redis()
+
+
+def test_negative_cycle_engine():
+    """Тестирует поиск отрицательных циклов: петли из двух сделок не мешают найти треугольник."""
+    import math
+    from backend.arbitrage_finder.cycles import find_negative_cycles
+
+    # Валюты: 0 - USDT, 1 - BTC, 2 - ETH
+    edges = [
+        (0, 1, -math.log(1 / 48000)),   # купить BTC за USDT
+        (1, 0, -math.log(51000)),       # продать BTC за USDT (петля из двух сделок с ребром 0)
+        (1, 2, -math.log(1 / 0.05)),    # купить ETH за BTC
+        (2, 0, -math.log(2600)),        # продать ETH за USDT
+        (2, 0, -math.log(2500)),        # то же направление на другой бирже, хуже
+    ]
+    cycles = find_negative_cycles(3, edges, max_length=4)
+    # Сначала лучший треугольник, затем он же через худшее параллельное ребро; каждый цикл - один раз
+    assert cycles == [(0, 2, 3), (0, 2, 4)]
+
+    # Ограничение длины цикла
+    assert find_negative_cycles(3, edges, max_length=2) == []
+
+
+def test_triangle_index():
+    """Тестирует индекс треугольников: перечисление, поиск по рынку и расчет прибыли."""
+    from backend.arbitrage_finder.triangles import TriangleIndex
+
+    index = TriangleIndex(lambda exchange_id, pair: (0.0, 0.0))
+    universe = {"binance": ["BTC/USDT", "ETH/USDT", "ETH/BTC"], "bybit": ["BTC/USDT"]}
+    assert index.build(universe) is True
+    # По два треугольника в каждую сторону: BTC/USDT торгуется на двух биржах
+    assert len(index) == 4
+    assert index.build(universe) is False
+
+    index.update_market(("bybit", "BTC/USDT"), ask=48000, bid=47900, ask_volume=1, bid_volume=1)
+    index.update_market(("binance", "BTC/USDT"), ask=50000, bid=49900, ask_volume=1, bid_volume=1)
+    index.update_market(("binance", "ETH/BTC"), ask=0.05, bid=0.049)
+    index.update_market(("binance", "ETH/USDT"), ask=2610, bid=2600, ask_volume=2, bid_volume=2)
+
+    touched = index.triangles_for_markets([("bybit", "BTC/USDT")])
+    assert len(touched) == 2
+    profits = index.evaluate(touched)
+    best = int(touched[profits.argmax()])
+    # USDT -> BTC на BYBIT -> ETH -> USDT: 2600 / (48000 * 0.05) - 1
+    assert set(index.cycle(best)) == {
+        ("bybit", "BTC/USDT", "buy"), ("binance", "ETH/BTC", "buy"), ("binance", "ETH/USDT", "sell")
+    }
+    assert abs(profits.max() - (2600 / 2400 - 1) * 100) < 1e-9
+    # Объем ограничен ногой ETH/USDT: 2 * 2600
+    assert index.volume_usd(best) == 5200
+
+
+def test_commissions_hot_reload(tmp_path):
+    """Тестирует скомпилированную таблицу комиссий и ее перезагрузку при изменении файлов."""
+    import json
+    import os
+    from backend.core.config import CommissionsConfig
+
+    commissions_file = tmp_path / "testex.json"
+    commissions_file.write_text(json.dumps({
+        "BTC/USDT": {"taker_buy_rate": "0.1%", "taker_order_rate": "0.2%"},
+    }))
+    config = CommissionsConfig(tmp_path)
+    rates = config.fee_table.rates("testex", "BTC/USDT")
+    # taker_sell_rate не задан - используется taker_order_rate
+    assert (rates.taker_buy, rates.taker_sell) == (Decimal("0.001"), Decimal("0.002"))
+    assert rates.taker_sell_float == 0.002
+    assert config.fee_table.rates("testex", "ETH/USDT").taker_buy == 0
+    assert config.reload_if_changed() is False
+
+    version = config.fee_table.version
+    commissions_file.write_text(json.dumps({
+        "BTC/USDT": {"taker_buy_rate": "0.05%", "taker_sell_rate": "0.05%"},
+        "ETH/USDT": {"taker_buy_rate": "0.1%", "taker_sell_rate": "0.1%"},
+    }))
+    stat = commissions_file.stat()
+    os.utime(commissions_file, (stat.st_atime, stat.st_mtime + 1))
+    assert config.reload_if_changed() is True
+    assert config.fee_table.version == version + 1
+    assert config.fee_table.rates("testex", "BTC/USDT").taker_sell == Decimal("0.0005")
+    assert config.get_all_exchange_symbols("testex") == ["BTC/USDT", "ETH/USDT"]
+
+    # Недописанный файл: комиссии биржи остаются прежними, файл перечитывается при следующей проверке
+    version = config.fee_table.version
+    commissions_file.write_text('{"BTC/USDT": {"taker_buy_rate": "0.07%"')
+    os.utime(commissions_file, (stat.st_atime, stat.st_mtime + 2))
+    assert config.reload_if_changed() is False
+    assert config.fee_table.version == version
+    assert config.get_all_exchange_symbols("testex") == ["BTC/USDT", "ETH/USDT"]
+    commissions_file.write_text(json.dumps({"BTC/USDT": {"taker_buy_rate": "0.07%", "taker_sell_rate": "0.07%"}}))
+    os.utime(commissions_file, (stat.st_atime, stat.st_mtime + 2))
+    assert config.reload_if_changed() is True
+    assert config.fee_table.rates("testex", "BTC/USDT").taker_buy == Decimal("0.0007")
+
+
+@pytest.mark.asyncio
+async def test_collector_start_collecting(monkeypatch):
+    """Тестирует start_collecting: на бирже наблюдаются только настроенные пары, которые на ней торгуются."""
+    from backend.data_collector.collector import DataCollector
+
+    class MarketsExchange:
+        # Без watch методов задачи сбора не запускаются, проверяется только выбор пар
+        has = {}
+
+        def __init__(self, exchange_id, markets):
+            self.id = exchange_id
+            self.markets = markets
+            self.symbols = list(markets)
+
+        async def close(self):
+            pass
+
+    exchanges = {
+        "binance": MarketsExchange("binance", {"BTC/USDT": {}, "ETH/USDT": {}, "FOO/BAR": {}}),
+        "bybit": MarketsExchange("bybit", {"BTC/USDT": {}, "ETH/USDT": {}, "SOL/USDT": {}}),
+    }
+    collector = DataCollector(["binance", "bybit"])
+
+    async def load_exchanges():
+        collector._exchanges = exchanges
+
+    monkeypatch.setattr(collector, "load_exchanges", load_exchanges)
+    await data_processor.connect()
+    try:
+        await collector.start_collecting()
+    finally:
+        await collector.stop_collecting()
+        await data_processor.disconnect()
+
+    assert collector.watched_symbols == {"binance": ["BTC/USDT", "ETH/USDT"], "bybit": ["BTC/USDT", "ETH/USDT", "SOL/USDT"]}
+
+
+def test_depth_sweep():
+    """Тестирует проход по глубине стаканов: максимальный прибыльный объем и средневзвешенную прибыль."""
+    from backend.core.types import L2Book, MarketSnapshot
+    from backend.arbitrage_finder.depth import sweep_cex_cex, sweep_cycle
+
+    buy_book = L2Book.from_orderbook({"asks": [[100, 1], [101, 2]], "bids": [[99, 1]]}, depth=20)
+    sell_book = L2Book.from_orderbook({"bids": [[103, 1.5], [100.5, 5]], "asks": [[104, 1]]}, depth=20)
+    fill = sweep_cex_cex(buy_book, sell_book, 0.0, 0.0)
+    # Выгодны весь первый уровень ask и половина второго; уровень 101/100.5 уже убыточен
+    assert fill.size == 1.5
+    assert (fill.cost, fill.revenue) == (150.5, 154.5)
+
+    # Тот же проход как цикл из двух сделок, начиная с quote
+    cycle_fill = sweep_cycle([(buy_book, True, 0.0), (sell_book, False, 0.0)])
+    assert abs(cycle_fill.amount_in - fill.cost) < 1e-9
+    assert abs(cycle_fill.amount_out - fill.revenue) < 1e-9
+
+    # Глубина ограничивает память стакана; без уровней используется лучшая цена
+    assert len(L2Book.from_orderbook({"asks": [[1, 1]] * 50, "bids": []}, depth=20).ask_prices) == 20
+    top_only = L2Book.from_orderbook({"ask": 10, "askVolume": 2, "bid": 9, "bidVolume": 3}, depth=20)
+    assert (list(top_only.ask_prices), list(top_only.bid_sizes)) == ([10.0], [3.0])
+
+    snapshot = MarketSnapshot(
+        orderbooks={
+            ("binance", "BTC/USDT"): {"ask": 50000, "askVolume": 1, "bid": 49900, "bidVolume": 1,
+                                      "asks": [[50000, 1], [50500, 1]], "bids": [[49900, 1]]},
+            ("bybit", "BTC/USDT"): {"ask": 51000, "askVolume": 1, "bid": 51000, "bidVolume": 0.5,
+                                    "asks": [[51000, 1]], "bids": [[51000, 0.5], [50600, 2]]},
+        },
+        tickers={},
+    )
+    finder = ArbitrageFinder()
+    opportunities = finder._scan_cex_cex(snapshot, settings.EXCHANGES, finder._configured_pairs_by_exchange())
+    opp = next(opp for opp in opportunities if opp.buy_exchange == "BINANCE" and opp.sell_exchange == "BYBIT")
+    # 0.5 BTC по 50000 -> 51000 и еще 0.5 BTC по 50000 -> 50600; уровень 50500 -> 50600 съедают комиссии
+    assert opp.max_size == Decimal("1.0")
+    assert opp.net_profit_percent < opp.profit_percent
+
+
+@pytest.mark.asyncio
+async def test_buffered_writer_conflation():
+    """Тестирует буферизованную запись: последнее обновление по ключу и сброс одним pipeline."""
+
+    await data_processor.connect_redis()
+    if data_processor._dirty_event.is_set():
+        await data_processor.wait_dirty_markets()
+    data_processor.start_writer()
+    try:
+        conflated_before = REGISTRY.get_sample_value("redis_write_conflated_total")
+        for ask in (1.0, 1.1, 1.2):
+            await data_processor.cache_orderbook("exmo", "LTC/USDT", {"ask": ask, "bid": 0.9})
+        await data_processor.cache_ticker("exmo", "LTC/USDT", {"ask": 1.2, "bid": 0.9})
+        assert REGISTRY.get_sample_value("redis_write_conflated_total") - conflated_before == 2
+        # До сброса чтения видят несброшенное обновление, рынок еще не помечен обновившимся
+        assert (await data_processor.get_orderbook("exmo", "LTC/USDT"))["ask"] == 1.2
+        assert not data_processor._dirty_event.is_set()
+
+        dirty_markets = await asyncio.wait_for(data_processor.wait_dirty_markets(), timeout=1)
+        assert dirty_markets == {("exmo", "LTC/USDT")}
+        assert data_processor._pending == {}
+        snapshot = await data_processor.get_market_snapshot([("exmo", "LTC/USDT")])
+        assert snapshot.get_orderbook("exmo", "LTC/USDT")["ask"] == 1.2
+    finally:
+        await data_processor.stop_writer()
+        await data_processor.disconnect_redis()
+
+
+def test_binary_market_records():
+    """Тестирует бинарный формат записей рыночных данных и чтение старых JSON значений."""
+    import json
+    from backend.data_processor.records import encode_orderbook, encode_ticker, decode_record
+
+    orderbook = {
+        "symbol": "BTC/USDT", "timestamp": 1700000000000, "info": {"raw": "x" * 100},
+        "bids": [[49900.5, 1.5, 3], [49900, 2]], "asks": [[50000, 0.25], [50001, 1], [50002, 4]],
+    }
+    record = decode_record(encode_orderbook(orderbook, depth=2))
+    assert record["timestamp"] == 1700000000000
+    # Лучшие цены берутся из первого уровня, глубина обрезается, лишние поля отбрасываются
+    assert (record["bid"], record["bidVolume"], record["ask"], record["askVolume"]) == (49900.5, 1.5, 50000, 0.25)
+    assert record["bids"] == [(49900.5, 1.5), (49900, 2)]
+    assert record["asks"] == [(50000, 0.25), (50001, 1)]
+    assert "info" not in record
+
+    ticker = decode_record(encode_ticker({"ask": 1.2, "bid": 1.1, "askVolume": None, "last": 1.15}))
+    assert ticker == {"timestamp": None, "receivedAt": None, "cachedAt": None,
+                      "ask": 1.2, "askVolume": None, "bid": 1.1, "bidVolume": None}
+    # Время получения коллектором и записи в кэш хранятся в записи
+    ticker = decode_record(encode_ticker({"ask": 1.2, "bid": 1.1, "receivedAt": 1700000000100}, cached_at=1700000000105))
+    assert (ticker["receivedAt"], ticker["cachedAt"]) == (1700000000100, 1700000000105)
+
+    # Значения, записанные до миграции, читаются как JSON
+    legacy = {"ask": 50000, "bid": 49000}
+    assert decode_record(json.dumps(legacy).encode()) == legacy
+    with pytest.raises(ValueError):
+        decode_record(b"XX" + bytes(60))
+
+
+@pytest.mark.requires_redis(store=True)
+@pytest.mark.asyncio
+async def test_market_stream_consumer():
+    """Тестирует доставку обновлений через Redis Streams и состояние рынков в памяти потребителя."""
+    from backend.data_processor.streams import MarketStreamConsumer
+
+    await data_processor.connect_redis()
+    consumer = MarketStreamConsumer(["kucoin"])
+    try:
+        await data_processor.cache_orderbook("kucoin", "DOT/USDT", {"ask": 5.0, "bid": 4.9})
+        await consumer.bootstrap([("kucoin", "DOT/USDT"), ("kucoin", "ADA/USDT")])
+        # Начальное состояние берется из ключей, старые сообщения стрима не читаются повторно
+        assert consumer.snapshot().get_orderbook("kucoin", "DOT/USDT")["ask"] == 5.0
+        assert await consumer.read(block_ms=10) == set()
+
+        await data_processor.cache_orderbook("kucoin", "DOT/USDT", {"ask": 5.1, "bid": 5.0})
+        await data_processor.cache_ticker("kucoin", "ADA/USDT", {"ask": 0.31, "bid": 0.3})
+        assert await consumer.read(block_ms=100) == {("kucoin", "DOT/USDT"), ("kucoin", "ADA/USDT")}
+
+        snapshot = consumer.snapshot([("kucoin", "DOT/USDT"), ("kucoin", "ADA/USDT")])
+        assert snapshot.get_orderbook("kucoin", "DOT/USDT")["ask"] == 5.1
+        assert snapshot.get_ticker("kucoin", "ADA/USDT")["bid"] == 0.3
+    finally:
+        await consumer.close()
+        await data_processor.disconnect_redis()
+
+
+@pytest.mark.asyncio
+async def test_bulk_watch_exchange_loop():
+    """Тестирует bulk подписку коллектора: одна задача на биржу обрабатывает тикеры и стаканы всех пар."""
+    from backend.data_collector.collector import DataCollector
+
+    class BulkExchange:
+        id = "bitrue"
+
+        def __init__(self):
+            self.ticker_updates = asyncio.Queue()
+            self.orderbook_updates = asyncio.Queue()
+
+        async def watch_tickers(self, symbols):
+            return await self.ticker_updates.get()
+
+        async def watch_order_book_for_symbols(self, symbols, limit=None):
+            return await self.orderbook_updates.get()
+
+    await data_processor.connect_redis()
+    collector = DataCollector()
+    exchange = BulkExchange()
+    task = asyncio.create_task(collector._watch_exchange_loop(exchange, ["SOL/USDT", "AVAX/USDT"], True, True))
+    try:
+        await exchange.ticker_updates.put({
+            "SOL/USDT": {"symbol": "SOL/USDT", "ask": 150.1, "bid": 150.0},
+            "AVAX/USDT": {"symbol": "AVAX/USDT", "ask": 30.1, "bid": 30.0},
+            # Пары вне подписки игнорируются
+            "DOGE/USDT": {"symbol": "DOGE/USDT", "ask": 0.2, "bid": 0.19},
+        })
+        await exchange.orderbook_updates.put({
+            "symbol": "SOL/USDT", "timestamp": 1, "bids": [[149.9, 2]], "asks": [[150.2, 3]],
+        })
+        for _ in range(100):
+            if collector._message_counts.get("bitrue") == 3:
+                break
+            await asyncio.sleep(0.01)
+        assert collector._message_counts == {"bitrue": 3}
+
+        snapshot = await data_processor.get_market_snapshot([("bitrue", "SOL/USDT"), ("bitrue", "AVAX/USDT")])
+        assert snapshot.get_ticker("bitrue", "AVAX/USDT")["ask"] == 30.1
+        assert snapshot.get_orderbook("bitrue", "SOL/USDT")["ask"] == 150.2
+    finally:
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await data_processor.disconnect_redis()
+
+
+@pytest.mark.requires_redis
+@pytest.mark.asyncio
+async def test_collector_supervisor_health():
+    """Тестирует разбиение бирж между воркерами и сводное состояние коллектора из Redis."""
+    import json
+    import time
+    import redis.asyncio as redis
+    from backend.data_collector.supervisor import COLLECTOR_HEALTH_KEY, partition_exchanges, read_collector_health
+
+    assert partition_exchanges(["a", "b", "c", "d", "e"], 2) == [["a", "c", "e"], ["b", "d"]]
+    # Воркеров не больше, чем бирж
+    assert partition_exchanges(["a", "b"], 8) == [["a"], ["b"]]
+
+    redis_client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB, decode_responses=True)
+    try:
+        now = time.time()
+        await redis_client.delete(COLLECTOR_HEALTH_KEY)
+        await redis_client.hset(COLLECTOR_HEALTH_KEY, mapping={
+            "0": json.dumps({"worker": 0, "exchanges": ["a"], "messages": {"a": 5}, "updated_at": now}),
+            # Давно не обновлявшийся воркер считается неживым
+            "1": json.dumps({"worker": 1, "exchanges": ["b"], "messages": {}, "updated_at": now - 3600}),
+            "supervisor": json.dumps({"workers": {"0": {"alive": True, "restarts": 2}, "1": {"alive": True, "restarts": 0}}}),
+        })
+        health = await read_collector_health(redis_client)
+        assert health["status"] == "degraded"
+        assert [(w["worker"], w["alive"], w["restarts"], w["messages_total"]) for w in health["workers"]] == [
+            (0, True, 2, 5), (1, False, 0, 0)
+        ]
+    finally:
+        await redis_client.delete(COLLECTOR_HEALTH_KEY)
+        await redis_client.aclose()
+
+
+@pytest.mark.requires_redis
+@pytest.mark.asyncio
+async def test_collector_worker_start_failure(monkeypatch):
+    """Тестирует завершение воркера с ненулевым кодом и ошибку в его состоянии, если запуск сбора упал."""
+    import redis.asyncio as redis
+    from backend.data_collector.collector import DataCollector
+    from backend.data_collector.supervisor import COLLECTOR_HEALTH_KEY, _run_worker, read_collector_health
+
+    async def failing_start(self):
+        raise AttributeError("module 'ccxt.pro' has no attribute 'TICK_SIZE'")
+
+    monkeypatch.setattr(DataCollector, "start_collecting", failing_start)
+    monkeypatch.setattr(settings, "COLLECTOR_METRICS_PORT", 0)
+    monkeypatch.setattr(settings, "EVENT_LOOP_LAG_INTERVAL", 0)
+    redis_client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB, decode_responses=True)
+    try:
+        await redis_client.delete(COLLECTOR_HEALTH_KEY)
+        assert await asyncio.wait_for(_run_worker(3, ["binance"]), timeout=5) == 1
+        health = await read_collector_health(redis_client)
+        assert health["status"] == "down"
+        assert health["workers"][0]["error"] == "AttributeError: module 'ccxt.pro' has no attribute 'TICK_SIZE'"
+    finally:
+        await redis_client.delete(COLLECTOR_HEALTH_KEY)
+        await redis_client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_scan_executor_process_pool():
+    """Тестирует поиск циклов в пуле процессов: результат как при расчете в loop, метрики очереди и расчета."""
+    from backend.arbitrage_finder.cycle_scan import CycleScanInput, scan_cycles
+    from backend.arbitrage_finder.executor import ScanExecutor
+
+    scan_input = CycleScanInput(
+        markets=[
+            ("binance", "BTC/USDT", 50000.0, 49990.0, 1.0, 1.0, 0.001, 0.001),
+            ("binance", "ETH/BTC", 0.05, 0.0499, 10.0, 10.0, 0.001, 0.001),
+            ("binance", "ETH/USDT", 2600.0, 2590.0, 10.0, 10.0, 0.001, 0.001),
+        ],
+        max_length=4, min_length=3, max_rounds=16, min_profit_percent=0.01,
+    )
+    expected = scan_cycles(scan_input)
+    assert expected and expected[0][0] == [("binance", "BTC/USDT", "buy"), ("binance", "ETH/BTC", "buy"), ("binance", "ETH/USDT", "sell")]
+
+    executor = ScanExecutor("process", workers=1, max_concurrent=1)
+    computed_before = REGISTRY.get_sample_value("arbitrage_scan_compute_seconds_count", {"type": "test"}) or 0
+    try:
+        # Второе сканирование ждет в очереди, пока первое занимает единственный слот
+        results = await asyncio.gather(
+            executor.run("test", scan_cycles, scan_input),
+            executor.run("test", scan_cycles, scan_input),
+        )
+    finally:
+        executor.shutdown()
+    assert results == [expected, expected]
+    assert REGISTRY.get_sample_value("arbitrage_scan_compute_seconds_count", {"type": "test"}) - computed_before == 2
+    assert REGISTRY.get_sample_value("arbitrage_scan_queue_seconds_count", {"type": "test"}) >= 2
+
+
+def test_scan_executor_releases_closed_loops():
+    """Тестирует, что семафоры пула сканирования не удерживают завершенные event loop."""
+    import gc
+    from backend.arbitrage_finder.executor import ScanExecutor
+
+    executor = ScanExecutor("inline", workers=1, max_concurrent=1)
+    for _ in range(3):
+        assert asyncio.run(executor.run("test", sum, [1, 2])) == 3
+    gc.collect()
+    assert len(executor._semaphores) == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_result_recompute():
+    """Тестирует объединение одновременных запросов свежего результата в один пересчет."""
+    finder = ArbitrageFinder()
+    scans = 0
+
+    async def slow_scan(snapshot=None):
+        nonlocal scans
+        scans += 1
+        await asyncio.sleep(0.05)
+        return []
+
+    finder.find_cex_cex_opportunities = slow_scan
+    results = await asyncio.gather(*(finder.get_result("cex_cex", fresh=True) for _ in range(20)))
+    assert scans == 1
+    assert len({result.etag for result in results}) == 1
+    # Без fresh отдается последний результат без пересчета
+    assert await finder.get_result("cex_cex") is results[0]
+    assert scans == 1
+    assert (await finder.get_result("cex_cex", fresh=True)).version == results[0].version + 1
+
+
+@pytest.mark.asyncio
+async def test_publish_after_fresh_recompute():
+    """Тестирует новую версию результата, когда публикация без изменений потока расходится с пересчетом по запросу."""
+    finder = ArbitrageFinder()
+    found = [OpportunityCexCex("BTC/USDT", "BINANCE", "BYBIT", Decimal("1"), Decimal("1.02"), Decimal("2"))]
+
+    async def scan(snapshot=None):
+        return []
+
+    finder.find_cex_cex_opportunities = scan
+    try:
+        await finder._publish("cex_cex", found)
+        published = finder.latest_result("cex_cex")
+        # Набор не изменился: версия и ETag прежние
+        await finder._publish("cex_cex", found)
+        assert finder.latest_result("cex_cex").etag == published.etag
+
+        fresh = await finder.get_result("cex_cex", fresh=True)
+        assert fresh.opportunities == [] and fresh.version > published.version
+        # Поток пересчет не видел и дельту не публикует, но содержимое отличается от свежего результата
+        await finder._publish("cex_cex", found)
+        latest = finder.latest_result("cex_cex")
+        assert latest.opportunities == found and latest.version > fresh.version and latest.etag != fresh.etag
+    finally:
+        await finder.stop_finding_loop()
+
+
+def test_api_conditional_get():
+    """Тестирует ETag и ответ 304 для неизменившегося результата."""
+    response = client.get("/api/v1/arbitrage/cex_cex_cex")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert int(response.headers["x-result-version"]) > 0
+
+    not_modified = client.get("/api/v1/arbitrage/cex_cex_cex", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == etag
+
+    refreshed = client.get("/api/v1/arbitrage/cex_cex_cex", params={"fresh": "true"}, headers={"If-None-Match": etag})
+    assert refreshed.status_code == 200
+    assert refreshed.headers["etag"] != etag
+
+
+@pytest.mark.requires_redis(store=True)
+@pytest.mark.asyncio
+async def test_broadcast_hub_backpressure():
+    """Тестирует общую рассылку: одна подписка Redis на канал, снимок для новых и переполненных клиентов, ресинхронизация при разрыве."""
+    import redis.asyncio as redis
+    from backend.api.broadcast import BroadcastHub
+    from backend.arbitrage_finder.deltas import OpportunityStream
+
+    stream = OpportunityStream("cex_cex", "e1", snapshot_interval=3600)
+
+    def update(profit: str) -> bytes:
+        return stream.update([OpportunityCexCex("BTC/USDT", "a", "b", Decimal("1"), Decimal("1.01"), Decimal(profit))]).data
+
+    publisher = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB, decode_responses=True)
+    await publisher.set("test:hub:snapshot", update("1"))
+    hub = BroadcastHub(("test:hub",), queue_size=2)
+    fast, slow = hub.subscribe("test:hub"), hub.subscribe("test:hub")
+    try:
+        # Первое сообщение нового клиента - снимок, загруженный хабом из Redis
+        first = json.loads(await asyncio.wait_for(fast.get(), timeout=2))
+        assert first["type"] == "snapshot" and first["seq"] == 1
+        assert json.loads(await asyncio.wait_for(slow.get(), timeout=1)) == first
+
+        for profit in ("2", "3", "4", "5"):
+            delta = update(profit)
+            await publisher.publish("test:hub", delta)
+            assert await asyncio.wait_for(fast.get(), timeout=1) == delta.decode()
+        # Медленный клиент не читал: очередь переполнилась и была сброшена, вместо дельт он получает текущий снимок
+        assert slow.dropped == 2
+        snapshot = json.loads(await slow.get())
+        assert snapshot["seq"] == 5 and snapshot["opportunities"][0]["profit_percent"] == "5"
+
+        # Разрыв последовательности: дельта 6 потеряна, хаб загружает снимок из Redis и ресинхронизирует клиентов
+        update("6")
+        delta = update("7")
+        await publisher.set("test:hub:snapshot", stream.snapshot_message())
+        await publisher.publish("test:hub", delta)
+        resynced = json.loads(await asyncio.wait_for(fast.get(), timeout=1))
+        assert resynced["type"] == "snapshot" and resynced["seq"] == 7
+
+        hub.unsubscribe(slow)
+        assert hub.client_count("test:hub") == 1
+    finally:
+        await hub.stop()
+        await publisher.delete("test:hub:snapshot")
+        await publisher.aclose()
+
+
+@pytest.mark.requires_redis(store=True)
+def test_websocket_broadcast():
+    """Тестирует доставку снимка и дельт канала в WebSocket через общую рассылку."""
+    import time
+    import redis as sync_redis
+    from backend.api.broadcast import broadcast_hub
+    from backend.arbitrage_finder.deltas import OpportunityStream
+
+    stream = OpportunityStream("cex_cex_cex", "e1", snapshot_interval=3600)
+    cycle = [["a", "BTC/USDT", "buy"], ["a", "ETH/BTC", "buy"], ["a", "ETH/USDT", "sell"]]
+    publisher = sync_redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+    publisher.set("arbitrage:cex_cex_cex:snapshot", stream.update([]).data)
+    try:
+        with client.websocket_connect("/api/v1/ws/arbitrage/cex_cex_cex") as websocket:
+            assert json.loads(websocket.receive_text())["type"] == "snapshot"
+            delta = stream.update([OpportunityCexCexCex(cycle, Decimal("1"))]).data
+            # Повторные публикации той же дельты отбрасываются хабом как уже примененные
+            for _ in range(100):
+                if publisher.publish("arbitrage:cex_cex_cex", delta) >= 1:
+                    break
+                time.sleep(0.01)
+            message = json.loads(websocket.receive_text())
+            assert message["type"] == "delta" and message["seq"] == 2
+            assert message["added"][0]["id"] == "a:BTC/USDT:buy>a:ETH/BTC:buy>a:ETH/USDT:sell"
+
+            # Фильтр подписки задается сообщением клиента
+            websocket.send_text(json.dumps({"type": "subscribe", "top": 0}))
+            assert json.loads(websocket.receive_text())["type"] == "error"
+            websocket.send_text(json.dumps({"type": "subscribe", "exchange": "b"}))
+            assert json.loads(websocket.receive_text())["type"] == "subscribed"
+            filtered = json.loads(websocket.receive_text())
+            assert filtered["type"] == "snapshot" and filtered["opportunities"] == []
+            assert broadcast_hub.client_count("arbitrage:cex_cex_cex") == 1
+        # После отключения последнего клиента общая подписка закрыта
+        assert broadcast_hub.client_count("arbitrage:cex_cex_cex") == 0
+        assert publisher.publish("arbitrage:cex_cex_cex", delta) == 0
+    finally:
+        publisher.delete("arbitrage:cex_cex_cex:snapshot")
+        publisher.close()
+
+
+def test_opportunity_stream_deltas():
+    """Тестирует дельты потока возможностей: стабильные id, подавление пустых публикаций, периодический снимок, разрыв seq."""
+    from backend.arbitrage_finder.deltas import OpportunityStream, OpportunityState
+
+    def opp(pair: str, profit: str) -> OpportunityCexCex:
+        return OpportunityCexCex(pair, "binance", "okx", Decimal("1"), Decimal("1.01"), Decimal(profit))
+
+    def parsed(state: dict) -> dict:
+        return {key: json.loads(encoded) for key, encoded in state.items()}
+
+    stream = OpportunityStream("cex_cex", "e1", snapshot_interval=30)
+    receiver = OpportunityState("cex_cex")
+    snapshot = json.loads(stream.update([opp("BTC/USDT", "1"), opp("ETH/USDT", "2")], now=0).data)
+    assert snapshot["type"] == "snapshot" and snapshot["seq"] == 1
+    assert receiver.apply(snapshot)
+    # Без изменений ничего не публикуется
+    assert stream.update([opp("BTC/USDT", "1"), opp("ETH/USDT", "2")], now=1) is None
+
+    delta = json.loads(stream.update([opp("BTC/USDT", "1.5"), opp("SOL/USDT", "3")], now=2).data)
+    assert delta["type"] == "delta" and delta["seq"] == 2
+    assert [p["id"] for p in delta["added"]] == ["SOL/USDT|binance|okx"]
+    assert [p["id"] for p in delta["updated"]] == ["BTC/USDT|binance|okx"]
+    assert delta["removed"] == ["ETH/USDT|binance|okx"]
+    assert receiver.apply(delta) and receiver.opportunities == parsed(stream.opportunities)
+    # Повтор уже примененной дельты игнорируется, пропуск дельты ломает состояние до следующего снимка
+    assert not receiver.apply(delta) and receiver.synced
+    stream.update([opp("BTC/USDT", "2")], now=3)
+    gap = json.loads(stream.update([opp("BTC/USDT", "2.5")], now=4).data)
+    assert not receiver.apply(gap) and not receiver.synced
+
+    resync = json.loads(stream.update([opp("BTC/USDT", "2.5")], now=31).data)
+    assert resync["type"] == "snapshot" and resync["seq"] == 5
+    assert receiver.apply(resync) and receiver.opportunities == parsed(stream.opportunities)
+
+
+def test_opportunity_filters():
+    """Тестирует выборку по индексу (пара, биржа, прибыль, объем, top-N) против полного прохода и фильтры REST."""
+    import random
+    from backend.arbitrage_finder.finder import arbitrage_finder
+    from backend.arbitrage_finder.filters import OpportunityFilter, OpportunityIndex, opportunity_keys
+
+    rng = random.Random(7)
+    pairs, exchanges = ["BTC/USDT", "ETH/USDT", "SOL/USDT"], ["binance", "okx", "bybit"]
+    opportunities = [
+        OpportunityCexCex(rng.choice(pairs), *rng.sample(exchanges, 2), Decimal("1"), Decimal("1.01"),
+                          Decimal(str(round(rng.uniform(0, 2), 4))),
+                          volume_usd=Decimal(str(rng.randint(10, 10000))) if rng.random() < 0.8 else None)
+        for _ in range(300)
+    ]
+    index = OpportunityIndex([opportunity_keys("cex_cex", opp) for opp in opportunities])
+    by_profit = sorted(opportunities, key=lambda opp: -opp.profit_percent)
+    for _ in range(200):
+        f = OpportunityFilter.create(
+            pair=rng.choice([None, "btc/usdt", "ETH/USDT", "XRP/USDT"]),
+            exchange=rng.choice([None, "OKX", "bybit"]),
+            min_profit=rng.choice([None, 0.5, 1.5]),
+            min_volume=rng.choice([None, 5000]),
+            top=rng.choice([None, 1, 5]),
+        )
+        expected = [
+            opp for opp in by_profit
+            if (f.pair is None or opp.pair == f.pair)
+            and (f.exchange is None or f.exchange in (opp.buy_exchange, opp.sell_exchange))
+            and (f.min_profit is None or float(opp.profit_percent) >= f.min_profit)
+            and (f.min_volume is None or (opp.volume_usd is not None and float(opp.volume_usd) >= f.min_volume))
+        ][:f.top]
+        selected = [opportunities[i] for i in index.select(f)]
+        assert [opp.profit_percent for opp in selected] == [opp.profit_percent for opp in expected]
+        assert all((f.pair is None or opp.pair == f.pair) for opp in selected)
+
+    with pytest.raises(ValueError):
+        OpportunityFilter.from_message({"type": "subscribe", "top": 0})
+    with pytest.raises(ValueError):
+        OpportunityFilter.from_message({"type": "subscribe", "pairs": "BTC/USDT"})
+
+    arbitrage_finder._store_result("cex_cex", opportunities)
+    response = client.get("/api/v1/arbitrage/cex_cex", params={"pair": "BTC/USDT", "exchange": "okx", "top": 3})
+    assert response.status_code == 200
+    data = response.json()
+    assert 0 < len(data) <= 3
+    assert all(opp["pair"] == "BTC/USDT" and "okx" in (opp["buy_exchange"], opp["sell_exchange"]) for opp in data)
+    assert [Decimal(opp["profit_percent"]) for opp in data] == sorted((Decimal(opp["profit_percent"]) for opp in data), reverse=True)
+    assert client.get("/api/v1/arbitrage/cex_cex", params={"top": 0}).status_code == 422
+
+
+@pytest.mark.requires_redis(store=True)
+@pytest.mark.asyncio
+async def test_filtered_subscription():
+    """Тестирует фильтрованную подписку: собственный снимок и дельты отфильтрованного набора."""
+    from backend.api.broadcast import BroadcastHub
+    from backend.arbitrage_finder.deltas import OpportunityStream
+    from backend.arbitrage_finder.filters import OpportunityFilter
+
+    stream = OpportunityStream("cex_cex", "e1", snapshot_interval=3600)
+
+    def opp(pair: str, profit: str) -> OpportunityCexCex:
+        return OpportunityCexCex(pair, "binance", "okx", Decimal("1"), Decimal("1.01"), Decimal(profit), volume_usd=Decimal("100"))
+
+    import redis.asyncio as redis
+
+    publisher = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB, decode_responses=True)
+    await publisher.set("test:cex_cex:snapshot", stream.update([opp("BTC/USDT", "1"), opp("ETH/USDT", "2")]).data)
+    hub = BroadcastHub(("test:cex_cex",), queue_size=4)
+    client_queue = hub.subscribe("test:cex_cex")
+    try:
+        client_queue.set_filter(OpportunityFilter.create(pair="BTC/USDT"))
+        assert json.loads(await asyncio.wait_for(client_queue.get(), timeout=1))["type"] == "subscribed"
+        snapshot = json.loads(await asyncio.wait_for(client_queue.get(), timeout=2))
+        assert snapshot["type"] == "snapshot" and [p["pair"] for p in snapshot["opportunities"]] == ["BTC/USDT"]
+
+        # Изменение вне фильтра клиенту не отправляется
+        await publisher.publish("test:cex_cex", stream.update([opp("BTC/USDT", "1"), opp("ETH/USDT", "3")]).data)
+        await publisher.publish("test:cex_cex", stream.update([opp("BTC/USDT", "1.5"), opp("ETH/USDT", "3")]).data)
+        delta = json.loads(await asyncio.wait_for(client_queue.get(), timeout=1))
+        assert delta["type"] == "delta" and delta["seq"] == snapshot["seq"] + 1
+        assert [p["profit_percent"] for p in delta["updated"]] == ["1.5"] and not delta["added"] and not delta["removed"]
+
+        # Top-1 по всему каналу
+        client_queue.set_filter(OpportunityFilter.create(top=1))
+        await asyncio.wait_for(client_queue.get(), timeout=1)
+        top = json.loads(await asyncio.wait_for(client_queue.get(), timeout=1))
+        assert [p["pair"] for p in top["opportunities"]] == ["ETH/USDT"]
+    finally:
+        hub.unsubscribe(client_queue)
+        await hub.stop()
+        await publisher.delete("test:cex_cex:snapshot")
+        await publisher.aclose()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_hub_in_process(market_data_store):
+    """Тестирует рассылку без Redis: с хранилищем в памяти поиск передает сообщения каналов хабу в этом же процессе."""
+    from backend.api.broadcast import BroadcastHub
+
+    if market_data_store != "memory":
+        pytest.skip("каналы в процессе публикуются только хранилищем в памяти")
+    store = data_processor.store
+    finder = ArbitrageFinder()
+    found = [OpportunityCexCex("BTC/USDT", "BINANCE", "BYBIT", Decimal("1"), Decimal("1.02"), Decimal("2"))]
+    await finder._publish("cex_cex", found)
+    hub = BroadcastHub(("arbitrage:cex_cex",), queue_size=4)
+    client_queue = hub.subscribe("arbitrage:cex_cex")
+    try:
+        # Первое сообщение - снимок канала, сохраненный хранилищем
+        snapshot = json.loads(await asyncio.wait_for(client_queue.get(), timeout=1))
+        assert snapshot["type"] == "snapshot" and [p["pair"] for p in snapshot["opportunities"]] == ["BTC/USDT"]
+        await finder._publish("cex_cex", [])
+        delta = json.loads(await asyncio.wait_for(client_queue.get(), timeout=1))
+        assert delta["type"] == "delta" and delta["removed"] == [found[0].id]
+        # После отключения последнего клиента хаб перестает получать сообщения хранилища
+        hub.unsubscribe(client_queue)
+        assert store._listeners == []
+    finally:
+        await hub.stop()
+        await finder.stop_finding_loop()
+
+
+def test_opportunity_json_encoded_once():
+    """Тестирует однократное кодирование JSON возможности и его использование в ответе REST без повторной сериализации."""
+    from backend.arbitrage_finder.finder import arbitrage_finder
+
+    opp = OpportunityCexCex("BTC/USDT", "binance", "okx", Decimal("100"), Decimal("101"), Decimal("1"), volume_usd=Decimal("0"))
+    with pytest.raises(AttributeError):
+        opp.extra = 1
+    encoded = opp.to_json()
+    assert opp.to_json() is encoded
+    assert json.loads(encoded) == {
+        "id": "BTC/USDT|binance|okx", "pair": "BTC/USDT", "buy_exchange": "binance", "sell_exchange": "okx",
+        "buy_price": "100", "sell_price": "101", "profit_percent": "1", "volume_usd": "0", "max_size": None,
+        "net_profit_percent": None,
+    }
+    cycle = OpportunityCexCexCex([("binance", "BTC/USDT", "buy"), ("binance", "ETH/BTC", "buy")], Decimal("0.5"))
+    assert json.loads(cycle.to_json())["cycle"] == [["binance", "BTC/USDT", "buy"], ["binance", "ETH/BTC", "buy"]]
+
+    arbitrage_finder._store_result("cex_cex", [opp])
+    response = client.get("/api/v1/arbitrage/cex_cex")
+    assert response.content == b"[" + encoded + b"]"
+
+
+@pytest.mark.asyncio
+async def test_stale_quotes_excluded():
+    """Тестирует исключение устаревших котировок из поиска и метрики задержки."""
+    import time
+    from backend.core.types import MarketSnapshot
+    from backend.monitoring import market_quotes_stale, arbitrage_detection_latency
+
+    now_ms = time.time() * 1000
+    fresh = {"ask": 48000, "askVolume": 1, "bid": 51000, "bidVolume": 1, "receivedAt": now_ms}
+    stale = {"ask": 50000, "askVolume": 1, "bid": 49000, "bidVolume": 1, "receivedAt": now_ms - 60000}
+    snapshot = MarketSnapshot({("bybit", "ETH/USDT"): fresh, ("binance", "ETH/USDT"): stale}, {})
+    filtered, stale_markets = snapshot.without_stale(5000, now_ms=now_ms)
+    assert stale_markets == [("binance", "ETH/USDT")]
+    assert list(filtered.orderbooks) == [("bybit", "ETH/USDT")]
+    # Без устаревших записей возвращается тот же срез; записи без времени не считаются устаревшими
+    assert filtered.without_stale(5000, now_ms=now_ms) == (filtered, [])
+    assert MarketSnapshot({("okx", "ETH/USDT"): {"ask": 1}}, {}).without_stale(0)[1] == []
+
+    await data_processor.connect_redis()
+    try:
+        await data_processor.cache_orderbook("bybit", "ETH/USDT", fresh)
+        await data_processor.cache_orderbook("binance", "ETH/USDT", stale)
+        finder = ArbitrageFinder()
+        stale_before = market_quotes_stale.labels(exchange="binance")._value.get()
+        detections_before = arbitrage_detection_latency.labels(exchange="bybit")._sum.get()
+        opportunities = await finder.find_cex_cex_opportunities()
+        # Нога на бирже с устаревшим стаканом не рассматривается
+        assert not [opp for opp in opportunities if opp.pair == "ETH/USDT" and "BINANCE" in (opp.buy_exchange, opp.sell_exchange)]
+        assert market_quotes_stale.labels(exchange="binance")._value.get() == stale_before + 1
+
+        # Рынок со свежей котировкой устареет позже, рынок с устаревшей в отслеживание не попадает
+        assert finder._expired_markets() == set()
+        finder._quote_times[("bybit", "ETH/USDT")] -= 60000
+        assert finder._expired_markets() == {("bybit", "ETH/USDT")}
+
+        finder._observe_detection_latency()
+        assert arbitrage_detection_latency.labels(exchange="bybit")._sum.get() > detections_before
+        assert finder._undetected == []
+        # Повторная загрузка тех же записей не учитывается в задержке обнаружения еще раз
+        await finder.find_cex_cex_opportunities()
+        assert finder._undetected == []
+    finally:
+        await data_processor.disconnect_redis()
+
+
+@pytest.mark.asyncio
+async def test_instrumentation_metrics():
+    """Тестирует ограничение кардинальности меток, задержку event loop и метрики этапов поиска и Redis."""
+    import time
+    from backend.monitoring import BoundedLabel, monitor_event_loop_lag, event_loop_lag, arbitrage_stage_time, \
+        redis_operation_time
+
+    label = BoundedLabel(2)
+    assert [label(value) for value in ("A", "B", "C", "A")] == ["A", "B", "other", "A"]
+    pinned = BoundedLabel(100, allowed=["BTC/USDT"])
+    assert (pinned("BTC/USDT"), pinned("ETH/USDT")) == ("BTC/USDT", "other")
+
+    # Синхронная работа в loop видна как задержка пробуждения пробы
+    task = asyncio.create_task(monitor_event_loop_lag(0.01))
+    await asyncio.sleep(0)
+    time.sleep(0.1)
+    await asyncio.sleep(0.005)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert event_loop_lag._value.get() >= 0.05
+
+    def count(histogram, **labels):
+        return sum(sample.value for metric in histogram.collect() for sample in metric.samples
+                   if sample.name.endswith("_count") and all(sample.labels.get(k) == v for k, v in labels.items()))
+
+    await data_processor.connect_redis()
+    try:
+        before = {stage: count(arbitrage_stage_time, stage=stage) for stage in ("fetch", "search")}
+        mget_before = count(redis_operation_time, operation="mget")
+        await ArbitrageFinder().find_cex_cex_opportunities()
+        assert count(arbitrage_stage_time, stage="fetch") == before["fetch"] + 1
+        assert count(arbitrage_stage_time, stage="search") == before["search"] + 1
+        # Хранилище в памяти к Redis не обращается
+        assert count(redis_operation_time, operation="mget") == mget_before + (settings.MARKET_DATA_STORE == "redis")
+    finally:
+        await data_processor.disconnect_redis()
+
+
+@pytest.mark.asyncio
+async def test_benchmark_suite():
+    """Тестирует генератор синтетических рынков, хранилище в памяти и проверку регрессий бенчмарка."""
+    from benchmarks.markets import MarketSpec, SyntheticMarket, InMemoryMarketStore, synthetic_pairs
+    from benchmarks.run import run_size, check_regressions
+
+    spec = MarketSpec("3x10", exchanges=3, pairs=10)
+    # Одинаковый seed - одинаковые данные
+    assert SyntheticMarket(spec).orderbooks == SyntheticMarket(spec).orderbooks
+    assert SyntheticMarket(spec._replace(seed=2)).orderbooks != SyntheticMarket(spec).orderbooks
+    assert synthetic_pairs(5) == ["BTC/USDT", "ETH/USDT", "ETH/BTC", "C0001/USDT", "C0001/BTC"]
+    with pytest.raises(ValueError):
+        synthetic_pairs(10, currencies=1)
+
+    market = SyntheticMarket(spec)
+    store = InMemoryMarketStore()
+    store.load(market)
+    snapshot = store.get_market_snapshot(market.market_keys)
+    assert len(snapshot.orderbooks) == 30
+    assert snapshot.get_orderbook("bench00", "BTC/USDT")["bid"] == pytest.approx(market.orderbooks[("bench00", "BTC/USDT")]["bid"])
+
+    exchanges = settings.EXCHANGES
+    results = await run_size(spec, repeats=2)
+    # Настройки приложения восстановлены после замеров
+    assert settings.EXCHANGES == exchanges
+    assert commissions_config.get_all_exchange_symbols("bench00") == []
+    assert [result.scan for result in results] == ["fetch", "cex_cex", "cex_cex_cex"]
+    assert all(result.p50_ms > 0 for result in results)
+    assert results[1].opportunities > 0
+
+    baselines = {"3x10": {"fetch": results[0].p50_ms * 2, "cex_cex": results[1].p50_ms / 2}}
+    regressions = check_regressions(results, baselines, threshold=0.25)
+    assert len(regressions) == 1 and regressions[0].startswith("3x10 cex_cex:")
+
+
+@pytest.mark.asyncio
+async def test_market_recording_replay(tmp_path):
+    """Тестирует журнал рыночных данных (ротация, недописанный хвост, слияние) и детерминированное воспроизведение."""
+    import io
+    from benchmarks.markets import MarketSpec, SyntheticMarket
+    from backend.data_processor.recorder import MarketRecorder, read_recording, recording_segments
+    from backend.arbitrage_finder.replay import replay
+
+    market = SyntheticMarket(MarketSpec("3x10", exchanges=3, pairs=10))
+    start_ms = 1700000000000.0
+    # Каждое обновление - отдельный блок, сегмент - не больше двух блоков
+    recorder = MarketRecorder(tmp_path, segment_bytes=1, segment_seconds=3600, max_segments=0, block_bytes=1)
+    for index, ((exchange_id, symbol), orderbook) in enumerate(market.orderbooks.items()):
+        recorder.record("orderbook", exchange_id, symbol, orderbook, recorded_at=start_ms + index)
+    recorder.record("ticker", "bench00", "BTC/USDT", {"bid": 1.0, "ask": 2.0}, recorded_at=start_ms + 100)
+    recorder.close()
+    segments = recording_segments(tmp_path)
+    assert len(segments) == len(market.orderbooks) + 1
+    # Недописанный блок в конце сегмента пропускается
+    with open(segments[-1], "ab") as segment:
+        segment.write(b"\xff\xff\x00\x00\x01\x02")
+
+    updates = list(read_recording(tmp_path))
+    assert [update.recorded_at for update in updates] == sorted(update.recorded_at for update in updates)
+    assert len(updates) == len(market.orderbooks) + 1
+    assert updates[-1].kind == "ticker" and updates[-1].market == ("bench00", "BTC/USDT")
+    assert updates[0].decode()["bid"] == pytest.approx(market.orderbooks[updates[0].market]["bid"])
+    assert updates[0].decode()["cachedAt"] == start_ms
+
+    with market.configured():
+        outputs = []
+        for _ in range(2):
+            output = io.BytesIO()
+            result = await replay(tmp_path, speed=None, window_ms=5, output=output)
+            outputs.append(output.getvalue())
+    assert result.updates == len(updates) and result.batches == 6
+    assert outputs[0] == outputs[1]
+    events = [json.loads(line) for line in outputs[0].splitlines()]
+    assert len(events) == result.opportunity_events > 0
+    assert any(event["kind"] == "cex_cex" and event["opportunities"] for event in events)
+
+
+def test_top_of_book_history(tmp_path, monkeypatch):
+    """Тестирует колоночную историю лучших цен: запись блоками, чтение диапазона и /api/v1/history."""
+    import math
+    from backend.data_processor.history import HistoryWriter, HistorySeries, series_path, spread_history
+
+    writer = HistoryWriter(tmp_path, chunk_rows=4)
+    for second in range(10):
+        writer.append("binance", "BTC/USDT", {"receivedAt": 1000 * second, "bid": 100 + second, "ask": 101 + second,
+                                              "bidVolume": 1, "askVolume": 2})
+    # Бирже bybit котировки приходят только до 4-й секунды
+    for second in range(5):
+        writer.append("bybit", "BTC/USDT", {"receivedAt": 1000 * second + 500, "bid": 103.0, "ask": 104.0})
+    assert writer.flush() == 15
+    writer.close()
+    # Повторное открытие продолжает файл; время не убывает
+    writer = HistoryWriter(tmp_path, chunk_rows=64)
+    writer.append("binance", "BTC/USDT", {"receivedAt": 500, "bid": 110, "ask": 111})
+    writer.close()
+
+    series = HistorySeries(series_path(tmp_path, "binance", "BTC/USDT"))
+    assert (series.rows, series.chunk_rows) == (11, 4)
+    rows = list(series.slices(2500, 7000))
+    assert [list(part["ts"]) for part in rows] == [[3000.0], [4000.0, 5000.0, 6000.0]]
+    # Представления колонок ссылаются на отображенный файл, а не на копию
+    assert not rows[0]["bid"].flags.owndata
+    assert list(next(series.slices(8500, 20000))["ts"]) == [9000.0, 9000.0]
+
+    history = spread_history(tmp_path, "BTC/USDT", None, 0, 10000, 2000, max_age_ms=3000)
+    assert list(history["exchanges"]) == ["binance", "bybit"]
+    assert list(history["timestamps"]) == [0, 2000, 4000, 6000, 8000]
+    assert list(history["exchanges"]["binance"]["bid"]) == [101.0, 103.0, 105.0, 107.0, 110.0]
+    bybit_bid = history["exchanges"]["bybit"]["bid"]
+    # Котировка bybit протягивается вперед не дольше max_age_ms
+    assert list(bybit_bid[:3]) == [103.0, 103.0, 103.0] and math.isnan(bybit_bid[4])
+    spread = next(s for s in history["spreads"] if (s["buy_exchange"], s["sell_exchange"]) == ("binance", "bybit"))
+    assert spread["spread_percent"][0] == pytest.approx((103 - 102) / 102 * 100)
+
+    monkeypatch.setattr(settings, "HISTORY_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "MAX_QUOTE_AGE_MS", 3000)
+    response = client.get("/api/v1/history", params={"pair": "BTC/USDT", "exchanges": "BINANCE,bybit",
+                                                      "start": 0, "end": 10000, "step_ms": 2000})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["step_ms"] == 2000 and body["exchanges"]["bybit"]["bid"][4] is None
+    assert len(body["spreads"]) == 2
+    assert client.get("/api/v1/history", params={"pair": "BTC/USDT", "start": 10, "end": 5}).status_code == 400
+    # Пара приводится к верхнему регистру; биржи вне EXCHANGES и пары не вида BASE/QUOTE не попадают в пути файлов
+    lower = client.get("/api/v1/history", params={"pair": "btc/usdt", "exchanges": "binance", "start": 0, "end": 10000})
+    assert lower.status_code == 200 and lower.json()["pair"] == "BTC/USDT"
+    assert client.get("/api/v1/history", params={"pair": "BTC/USDT", "exchanges": "../..", "start": 0, "end": 10000}).status_code == 400
+    assert client.get("/api/v1/history", params={"pair": "../BTC/USDT", "start": 0, "end": 10000}).status_code == 400
+    monkeypatch.setattr(settings, "HISTORY_MAX_POINTS", 2)
+    assert client.get("/api/v1/history", params={"pair": "BTC/USDT", "start": 0, "end": 10000}).json()["step_ms"] == 5000
+
+
+@pytest.mark.asyncio
+async def test_in_memory_market_data_store(monkeypatch):
+    """Тестирует хранилище рыночных данных в памяти: те же записи, что из Redis, срез без копирования, TTL."""
+    import time
+    from backend.data_processor.processor import DataProcessor
+    from backend.data_processor.records import encode_orderbook, encode_ticker, decode_record
+    from backend.data_processor.store import InMemoryMarketDataStore, create_market_data_store
+
+    with pytest.raises(ValueError):
+        create_market_data_store("memcached")
+
+    store = InMemoryMarketDataStore(ttl=60, depth=2)
+    processor = DataProcessor(store)
+    orderbook = {"timestamp": 1700000000000, "receivedAt": 1700000000100, "info": {"raw": "x"},
+                 "bids": [[49900.5, 1.5], [49900, 2], [49800, 3]], "asks": [[50000, 0.25]]}
+    ticker = {"ask": 1.2, "bid": 1.1, "askVolume": None, "last": 1.15}
+    assert await processor.cache_orderbook("binance", "BTC/USDT", orderbook) is False
+    await processor.connect()
+    assert await processor.cache_orderbook("binance", "BTC/USDT", orderbook) is True
+    assert await processor.cache_ticker("binance", "BTC/USDT", ticker) is True
+
+    record = await processor.get_orderbook("binance", "BTC/USDT")
+    # Запись совпадает с декодированной из Redis (время записи в кэш - свое у каждого сохранения)
+    assert record == decode_record(encode_orderbook(orderbook, 2, record["cachedAt"]))
+    assert await processor.get_ticker("binance", "BTC/USDT") == decode_record(
+        encode_ticker(ticker, (await processor.get_ticker("binance", "BTC/USDT"))["cachedAt"]))
+    snapshot = await processor.get_market_snapshot([("binance", "BTC/USDT"), ("bybit", "BTC/USDT")])
+    # Срез отдает сохраненные записи, а не копии
+    assert snapshot.get_orderbook("binance", "BTC/USDT") is record
+    assert list(snapshot.orderbooks) == [("binance", "BTC/USDT")]
+
+    # Записи истекают через TTL, как ключи Redis
+    expires_at = time.monotonic() + 61
+    monkeypatch.setattr(time, "monotonic", lambda: expires_at)
+    assert await processor.get_orderbook("binance", "BTC/USDT") is None
+    assert (await processor.get_market_snapshot([("binance", "BTC/USDT")])).tickers == {}
+    await processor.cache_ticker("okx", "ETH/USDT", ticker)
+    assert list(store._records) == [("ticker", ("okx", "ETH/USDT"))]
+    await processor.disconnect()